@@ -0,0 +1,227 @@
+"""目录打包下载：边生成边发送 ZIP（含 ZIP64）或 TAR
+
+  - 不生成临时压缩包，也不在内存中缓存整个包；每写出一块数据就交给服务器发送
+  - 已压缩的格式（图片、视频、压缩包等）以 STORED 方式存入 ZIP，不再重复压缩
+  - 后台线程池提前打开后续若干文件并读取文件头部，当前文件则双缓冲读取，
+    发送不会被单个文件的打开/读取延迟卡住；内存占用只与预读深度有关，与目录大小无关
+  - 遍历时跳过符号链接，避免把共享文件夹之外的内容打进包里
+"""
+import collections
+import os
+import stat
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+READ_SIZE = 512 * 1024
+# 提前打开的文件数和每个文件预读的字节数，决定了额外内存上限（约 PREFETCH_FILES * READ_SIZE）
+PREFETCH_FILES = 8
+PREFETCH_WORKERS = 4
+
+# 本身已压缩、再压缩没有收益的扩展名
+STORED_EXTENSIONS = {
+    'zip', 'rar', '7z', 'gz', 'tgz', 'bz2', 'xz', 'zst', 'lz4', 'lzma',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'avif',
+    'mp4', 'm4v', 'avi', 'mkv', 'mov', 'webm', 'flv', 'wmv',
+    'mp3', 'aac', 'm4a', 'ogg', 'opus', 'flac', 'wma',
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'jar', 'apk', 'whl', 'epub', 'woff', 'woff2',
+}
+
+FORMATS = ('zip', 'tar')
+
+
+def iter_tree(root):
+    """深度优先遍历 root，产生 (相对路径, 绝对路径, stat结果)；目录的相对路径以 '/' 结尾"""
+    stack = [('', root)]
+    while stack:
+        relative_dir, directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            relative_path = f'{relative_dir}{entry.name}'
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                yield relative_path + '/', entry.path, st
+                subdirs.append((relative_path + '/', entry.path))
+            elif stat.S_ISREG(st.st_mode):
+                yield relative_path, entry.path, st
+        # 逆序入栈，出栈时仍按名称顺序
+        stack.extend(reversed(subdirs))
+
+
+class _OpenedFile:
+    """预读线程打开的文件：头部数据和定位在头部之后的文件对象"""
+
+    __slots__ = ('file', 'head', 'error')
+
+    def __init__(self, file=None, head=b'', error=None):
+        self.file = file
+        self.head = head
+        self.error = error
+
+
+def _open_with_head(path):
+    try:
+        f = open(path, 'rb')
+    except OSError as e:
+        return _OpenedFile(error=e)
+    try:
+        return _OpenedFile(f, f.read(READ_SIZE))
+    except OSError as e:
+        f.close()
+        return _OpenedFile(error=e)
+
+
+def prefetched(entries, executor, depth=PREFETCH_FILES):
+    """对 entries 中的文件提前在线程池中打开并读取头部，产生 (条目, _OpenedFile 或 None)"""
+    window = collections.deque()
+    entries = iter(entries)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(window) < depth:
+                try:
+                    entry = next(entries)
+                except StopIteration:
+                    exhausted = True
+                    break
+                relative_path, path, _st = entry
+                future = None if relative_path.endswith('/') else executor.submit(_open_with_head, path)
+                window.append((entry, future))
+            if not window:
+                return
+            entry, future = window.popleft()
+            yield entry, future.result() if future is not None else None
+    finally:
+        # 客户端中途断开：关闭已经预先打开的文件
+        for _entry, future in window:
+            if future is not None:
+                opened = future.result()
+                if opened.file is not None:
+                    opened.file.close()
+
+
+def read_blocks(opened, executor, limit=None):
+    """产生文件数据块：先是预读的头部，之后在线程池中提前读取下一块（双缓冲）"""
+    remaining = limit
+    pending = None
+    try:
+        data = opened.head
+        while data:
+            if len(data) == READ_SIZE:
+                pending = executor.submit(opened.file.read, READ_SIZE)
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            yield data
+            if pending is None or remaining == 0:
+                return
+            data, pending = pending.result(), None
+    finally:
+        if pending is not None:
+            # 等待尚未完成的预读，之后才能安全关闭文件
+            pending.exception()
+        opened.file.close()
+
+
+class _ChunkSink:
+    """给 zipfile 写入的不可定位输出，写入的数据暂存等待生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def stream_zip(root, compress=True, executor=None):
+    """流式生成 root 目录的 ZIP 数据"""
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='archive')
+    sink = _ChunkSink()
+    try:
+        with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+            for (relative_path, path, st), opened in prefetched(iter_tree(root), executor):
+                date_time = time.localtime(max(st.st_mtime, 315532800))[:6]  # ZIP 不支持 1980 年以前
+                zinfo = zipfile.ZipInfo(relative_path, date_time)
+                zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                if opened is None:
+                    zinfo.external_attr |= 0x10  # MS-DOS 目录属性
+                    zf.writestr(zinfo, b'')
+                elif opened.error is None:
+                    ext = relative_path.rsplit('.', 1)[-1].lower() if '.' in relative_path else ''
+                    if compress and ext not in STORED_EXTENSIONS:
+                        zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    else:
+                        zinfo.compress_type = zipfile.ZIP_STORED
+                    # 按 stat 大小预先决定是否需要 ZIP64 扩展
+                    zinfo.file_size = st.st_size
+                    with zf.open(zinfo, 'w') as dest:
+                        for block in read_blocks(opened, executor):
+                            dest.write(block)
+                            data = sink.drain()
+                            if data:
+                                yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        # 中央目录在关闭时写出
+        yield sink.drain()
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def stream_tar(root, executor=None):
+    """流式生成 root 目录的 TAR 数据（PAX 格式，支持长文件名和超大文件）"""
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='archive')
+    try:
+        for (relative_path, path, st), opened in prefetched(iter_tree(root), executor):
+            info = tarfile.TarInfo(relative_path.rstrip('/'))
+            info.mtime = int(st.st_mtime)
+            info.mode = st.st_mode & 0o7777
+            if opened is None:
+                info.type = tarfile.DIRTYPE
+                yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+                continue
+            if opened.error is not None:
+                continue
+            # 头部中的大小以 stat 为准；读取期间文件变长则截断，变短则补零，保证包结构正确
+            info.size = st.st_size
+            yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            written = 0
+            for block in read_blocks(opened, executor, limit=st.st_size):
+                written += len(block)
+                yield block
+            padding = (st.st_size - written) + (-st.st_size % tarfile.BLOCKSIZE)
+            if padding:
+                yield bytes(padding)
+        # 结尾两个空块
+        yield bytes(tarfile.BLOCKSIZE * 2)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
@@ -0,0 +1,249 @@
+"""把 Flask（WSGI）应用包装成 ASGI 应用
+
+路由代码不变，仍在线程池中执行；区别在于发送响应正文不再占用线程：
+  - 通过 wsgi.file_wrapper 交出的文件（下载引擎的所有下载）由事件循环发送：
+    服务器支持 http.response.zerocopysend 扩展时直接 sendfile，
+    否则每次在 I/O 线程池里读一块，await send() 等客户端收下后再读下一块
+  - 其他迭代器（在线压缩、打包下载、流式目录列表）每取一块数据占用一次 I/O 线程，
+    两块之间同样由 send() 的背压控制
+  - 限速的传输（transfer_scheduler）不在 I/O 线程里 sleep，读完一块就把需要等待的时间交回事件循环
+一个线程只在处理路由函数和读一块数据时被占用，几千个慢速下载可以同时进行，不会挤占目录列表等请求。
+
+用法:
+    python serve.py --backend asyncio
+    uvicorn asgi_app:create_application --factory
+"""
+import asyncio
+import logging
+import os
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from transfer_scheduler import deferred_throttle
+
+logger = logging.getLogger(__name__)
+
+# 回退路径每次读取的字节数
+READ_SIZE = 256 * 1024
+
+_END = object()
+
+
+def _next_paced(iterator):
+    """在 I/O 线程中取下一块，返回 (数据或 _END, 需要等待的秒数)
+
+    限速的迭代器（transfer_scheduler.ShapedIterable）被 werkzeug 等包装在里面，
+    在 deferred_throttle 中迭代时它只报告等待时间而不 sleep，等待由事件循环完成。
+    """
+    with deferred_throttle() as pacing:
+        data = next(iterator, _END)
+    return data, pacing.delay
+
+
+class FileWrapper:
+    """wsgi.file_wrapper：交给事件循环发送的文件"""
+
+    def __init__(self, filelike, block_size=READ_SIZE):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.block_size), b'')
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
+class _ReceiveStream:
+    """wsgi.input：在路由线程中调用，按需从事件循环取请求体"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('客户端已断开')
+        self._buffer += message.get('body', b'')
+        self._more = message.get('more_body', False)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._more:
+                self._fill()
+            size = len(self._buffer)
+        else:
+            while len(self._buffer) < size and self._more:
+                self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while b'\n' not in self._buffer and self._more and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self.read(end)
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def build_environ(scope, body):
+    """由 ASGI 的 http scope 构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    raw_path = scope.get('raw_path')
+    if raw_path is not None:
+        path = urllib.parse.unquote_to_bytes(raw_path.split(b'?', 1)[0])
+    else:
+        path = scope['path'].encode('utf-8')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.input_terminated': True,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        if '_' in name:
+            continue
+        key = name.replace('-', '_').upper()
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsgiAdapter:
+    """ASGI 应用：路由在 threads 个线程中执行，响应正文的读取使用 io_threads 个线程"""
+
+    def __init__(self, wsgi_app, threads=16, io_threads=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-app')
+        self.io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='asgi-io')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"不支持的连接类型: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.io_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, _ReceiveStream(receive, loop))
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if response.get('started'):
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            response['status'] = status
+            response['headers'] = headers
+            return written.append
+
+        result = await loop.run_in_executor(self.executor, self.wsgi_app, environ, start_response)
+        try:
+            headers = [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                       for key, value in response['headers']]
+            response['started'] = True
+            await send({
+                'type': 'http.response.start',
+                'status': int(response['status'].split(' ', 1)[0]),
+                'headers': headers,
+            })
+            for data in written:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            if isinstance(result, FileWrapper):
+                length = next((int(value) for key, value in headers if key == b'content-length'), None)
+                await self._send_file(scope, send, result, length)
+            else:
+                iterator = iter(result)
+                while True:
+                    data, delay = await loop.run_in_executor(self.io_executor, _next_paced, iterator)
+                    if data is _END:
+                        break
+                    if data:
+                        await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                    if delay:
+                        await asyncio.sleep(delay)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except OSError:
+            # 客户端中途断开
+            pass
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.io_executor, result.close)
+
+    async def _send_file(self, scope, send, wrapper, length):
+        """从文件当前位置起发送 length 字节（None 表示到文件末尾）"""
+        filelike = wrapper.filelike
+        fileno = getattr(filelike, 'fileno', None)
+        if fileno is not None and 'http.response.zerocopysend' in scope.get('extensions', {}):
+            offset = os.lseek(fileno(), 0, os.SEEK_CUR)
+            message = {'type': 'http.response.zerocopysend', 'file': filelike, 'offset': offset, 'more_body': True}
+            if length is not None:
+                message['count'] = length
+            await send(message)
+            return
+        loop = asyncio.get_running_loop()
+        # 限速的文件（transfer_scheduler.ShapedFile）返回需要等待的时间，在事件循环中等待，不占用 I/O 线程
+        read_paced = getattr(filelike, 'read_paced', None)
+        while True:
+            if read_paced is not None:
+                data, delay = await loop.run_in_executor(self.io_executor, read_paced, wrapper.block_size)
+            else:
+                data, delay = await loop.run_in_executor(self.io_executor, filelike.read, wrapper.block_size), 0
+            if not data:
+                return
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            if delay:
+                await asyncio.sleep(delay)
+
+
+def create_application(threads=None, io_threads=32):
+    """导入 file_server 并返回包装好的 ASGI 应用（供 uvicorn --factory 等使用）"""
+    import file_server
+    return AsgiAdapter(file_server.app, threads or file_server.config.threads, io_threads)
@@ -0,0 +1,438 @@
+"""最小的 asyncio HTTP/1.1 服务器，用来运行 asgi_app
+
+没有安装 uvicorn 等 ASGI 服务器时由 serve.py --backend asyncio 使用：
+  - 所有连接都在一个事件循环里，空闲和慢速连接只占用一个协程，几千个并发下载只受文件描述符数限制
+  - 支持 keep-alive、分块传输、Expect: 100-continue；请求体按应用读取的速度从套接字读取
+  - 响应正文写入后 await drain()，客户端收得慢时应用一侧自然停下来（背压）
+  - 实现 http.response.zerocopysend 扩展，文件用 loop.sendfile 发送（不支持时 asyncio 自动回退为读写）
+  - SIGTERM / SIGINT 时停止接受连接，关闭空闲连接，等待进行中的请求完成（最多 graceful_timeout 秒）
+"""
+import asyncio
+import email.utils
+import http
+import logging
+import os
+import signal
+import time
+import urllib.parse
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 请求头（含请求行）的最大字节数
+MAX_HEADER_SIZE = 64 * 1024
+# 每次交给应用的请求体字节数
+RECEIVE_SIZE = 64 * 1024
+# 应用没有读完的请求体不超过该字节数时读掉丢弃以复用连接，否则关闭连接
+MAX_DRAIN = 1024 * 1024
+
+
+class BadRequest(Exception):
+    def __init__(self, status=400):
+        super().__init__(status)
+        self.status = status
+
+
+def raise_nofile_limit():
+    """把可打开文件数的软限制提高到硬限制，每个并发连接都要占用文件描述符"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+        except (ValueError, OSError):
+            pass
+
+
+_date_cache = (0, '')
+
+
+def reason_phrase(status):
+    try:
+        return http.HTTPStatus(status).phrase
+    except ValueError:
+        return ''
+
+
+def http_date():
+    global _date_cache
+    now = int(time.time())
+    if _date_cache[0] != now:
+        _date_cache = (now, email.utils.formatdate(now, usegmt=True))
+    return _date_cache[1]
+
+
+class _Connection:
+    """一个客户端连接，依次处理其上的请求"""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.idle = True
+        self.requests_handled = 0
+
+    async def run(self):
+        config = self.server.config
+        try:
+            while not self.server.stopping:
+                self.idle = True
+                timeout = config.keepalive if self.requests_handled else config.timeout
+                try:
+                    head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+                except (asyncio.IncompleteReadError, TimeoutError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._simple_response(431)
+                    return
+                self.idle = False
+                try:
+                    request = self._parse_head(head)
+                except BadRequest as e:
+                    await self._simple_response(e.status)
+                    return
+                if not await self._handle(*request):
+                    return
+                self.requests_handled += 1
+        except (ConnectionError, TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    @staticmethod
+    def _parse_head(head):
+        lines = head[:-4].split(b'\r\n')
+        parts = lines[0].split(b' ')
+        if len(parts) != 3 or not parts[2].startswith(b'HTTP/1.'):
+            raise BadRequest()
+        method, target, version = parts
+        headers = []
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            if not sep or not name or name != name.strip():
+                raise BadRequest()
+            headers.append((name.lower(), value.strip()))
+        return method.decode('ascii'), target, version.decode('ascii')[5:], headers
+
+    async def _simple_response(self, status):
+        self.writer.write(f'HTTP/1.1 {status} {reason_phrase(status)}\r\n'
+                          'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.server.config.timeout)
+        except (ConnectionError, TimeoutError):
+            pass
+
+    async def _handle(self, method, target, http_version, headers):
+        """处理一个请求，返回连接能否继续使用"""
+        header_map = {}
+        for name, value in headers:
+            header_map[name] = header_map[name] + b',' + value if name in header_map else value
+        connection_tokens = {t.strip() for t in header_map.get(b'connection', b'').lower().split(b',')}
+        keep_alive = b'close' not in connection_tokens if http_version == '1.1' else b'keep-alive' in connection_tokens
+
+        chunked_body = b'chunked' in header_map.get(b'transfer-encoding', b'').lower()
+        content_length = header_map.get(b'content-length', b'0')
+        if not chunked_body and not content_length.isdigit():
+            await self._simple_response(400)
+            return False
+        body = _RequestBody(self, None if chunked_body else int(content_length),
+                            header_map.get(b'expect', b'').lower() == b'100-continue')
+
+        raw_path, _, query = target.partition(b'?')
+        if raw_path.startswith((b'http://', b'https://')):
+            raw_path = urllib.parse.urlsplit(raw_path).path or b'/'
+        sockname = self.writer.get_extra_info('sockname') or ('', 0)
+        peername = self.writer.get_extra_info('peername') or ('', 0)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': http_version,
+            'method': method,
+            'scheme': 'http',
+            'path': urllib.parse.unquote(raw_path.decode('latin-1'), encoding='utf-8', errors='surrogateescape'),
+            'raw_path': raw_path,
+            'query_string': query,
+            'root_path': '',
+            'headers': headers,
+            'client': peername[:2],
+            'server': sockname[:2],
+            'extensions': {'http.response.zerocopysend': {}},
+        }
+        response = _Response(self, method, http_version, keep_alive)
+        try:
+            await self.server.app(scope, body.receive, response.send)
+        except (ConnectionError, TimeoutError):
+            return False
+        except Exception:
+            logger.exception(f'处理请求 {method} {target!r} 时出错')
+            if not response.started:
+                await self._simple_response(500)
+            return False
+        finally:
+            body.finish()
+        if not response.complete:
+            if not response.started:
+                await self._simple_response(500)
+            return False
+        if not await body.drain(MAX_DRAIN):
+            return False
+        return response.keep_alive and not self.server.stopping
+
+
+class _RequestBody:
+    """ASGI receive()：应用要数据时才从套接字读取请求体"""
+
+    def __init__(self, connection, length, expect_continue):
+        self.connection = connection
+        self.reader = connection.reader
+        self.remaining = length  # None 表示分块传输
+        self.chunk_left = 0
+        self.done = length == 0
+        self.expect_continue = expect_continue
+        self.finished = asyncio.Event()
+
+    async def receive(self):
+        if self.done:
+            # 请求体已读完：按 ASGI 约定一直等到请求结束再报告断开
+            await self.finished.wait()
+            return {'type': 'http.disconnect'}
+        if self.expect_continue:
+            self.expect_continue = False
+            self.connection.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        timeout = self.connection.server.config.timeout
+        try:
+            data = await asyncio.wait_for(self._read(), timeout)
+        except (ConnectionError, TimeoutError, asyncio.IncompleteReadError, ValueError):
+            self.done = True
+            return {'type': 'http.disconnect'}
+        return {'type': 'http.request', 'body': data, 'more_body': not self.done}
+
+    async def _read(self):
+        if self.remaining is not None:
+            data = await self.reader.read(min(RECEIVE_SIZE, self.remaining))
+            if not data:
+                raise ConnectionError('请求体不完整')
+            self.remaining -= len(data)
+            self.done = self.remaining == 0
+            return data
+        if self.chunk_left == 0:
+            line = await self.reader.readuntil(b'\r\n')
+            self.chunk_left = int(line.split(b';', 1)[0].strip(), 16)
+            if self.chunk_left == 0:
+                # 跳过尾部字段
+                while line != b'\r\n':
+                    line = await self.reader.readuntil(b'\r\n')
+                self.done = True
+                return b''
+        data = await self.reader.read(min(RECEIVE_SIZE, self.chunk_left))
+        if not data:
+            raise ConnectionError('请求体不完整')
+        self.chunk_left -= len(data)
+        if self.chunk_left == 0:
+            await self.reader.readexactly(2)
+        return data
+
+    def finish(self):
+        self.finished.set()
+
+    async def drain(self, limit):
+        """读掉应用没有读的请求体，超过 limit 字节时放弃，返回连接能否继续使用"""
+        if self.expect_continue:
+            # 没有发送 100 Continue，客户端不会再发请求体
+            return False
+        drained = 0
+        while not self.done:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                return False
+            drained += len(message['body'])
+            if drained > limit:
+                return False
+        return True
+
+
+class _Response:
+    """ASGI send()：写响应头和正文，每次写入后等待缓冲区排空"""
+
+    def __init__(self, connection, method, http_version, keep_alive):
+        self.connection = connection
+        self.writer = connection.writer
+        self.method = method
+        self.http_version = http_version
+        self.keep_alive = keep_alive
+        self.started = False
+        self.complete = False
+        self.chunked = False
+        self.body_allowed = True
+
+    async def send(self, message):
+        kind = message['type']
+        if self.writer.is_closing():
+            raise ConnectionResetError('连接已关闭')
+        if kind == 'http.response.start':
+            self._start(message['status'], message.get('headers', []))
+        elif kind == 'http.response.body':
+            await self._body(message.get('body', b''), message.get('more_body', False))
+        elif kind == 'http.response.zerocopysend':
+            await self._zerocopy(message)
+        else:
+            raise ValueError(f'未知的消息类型: {kind}')
+
+    def _start(self, status, headers):
+        if self.started:
+            raise RuntimeError('响应头已经发送')
+        self.started = True
+        lines = [f'HTTP/1.1 {status} {reason_phrase(status)}'.encode('latin-1')]
+        names = set()
+        for name, value in headers:
+            name = name.lower()
+            names.add(name)
+            if name == b'connection' and b'close' in value.lower():
+                self.keep_alive = False
+            lines.append(name + b': ' + value)
+        if b'date' not in names:
+            lines.append(b'date: ' + http_date().encode())
+        if b'server' not in names:
+            lines.append(b'server: file_server')
+        self.body_allowed = not (self.method == 'HEAD' or 100 <= status < 200 or status in (204, 304))
+        if b'content-length' not in names and self.body_allowed:
+            if self.http_version == '1.1':
+                self.chunked = True
+                lines.append(b'transfer-encoding: chunked')
+            else:
+                self.keep_alive = False
+        if self.connection.server.stopping:
+            self.keep_alive = False
+        if not self.keep_alive:
+            lines.append(b'connection: close')
+        elif self.http_version == '1.0':
+            lines.append(b'connection: keep-alive')
+        self.writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+
+    async def _drain(self):
+        await asyncio.wait_for(self.writer.drain(), self.connection.server.config.timeout)
+
+    async def _body(self, data, more_body):
+        if not self.started or self.complete:
+            raise RuntimeError('响应状态不正确')
+        if data and self.body_allowed:
+            if self.chunked:
+                self.writer.writelines((b'%x\r\n' % len(data), data, b'\r\n'))
+            else:
+                self.writer.write(data)
+        if not more_body:
+            if self.chunked:
+                self.writer.write(b'0\r\n\r\n')
+            self.complete = True
+        await self._drain()
+
+    async def _zerocopy(self, message):
+        if not self.started or self.complete:
+            raise RuntimeError('响应状态不正确')
+        file = message['file']
+        offset = message.get('offset')
+        if offset is None:
+            offset = os.lseek(file.fileno(), 0, os.SEEK_CUR)
+        count = message.get('count')
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        if self.body_allowed and count:
+            if self.chunked:
+                self.writer.write(b'%x\r\n' % count)
+            await self._drain()
+            loop = asyncio.get_running_loop()
+            # loop.sendfile 结束时会 seek 文件对象，复制一份描述符，不影响应用手里的文件
+            with open(os.dup(file.fileno()), 'rb') as dup:
+                sent = await loop.sendfile(self.writer.transport, dup, offset, count)
+            if sent < count:
+                raise ConnectionResetError('文件发送不完整')
+            if self.chunked:
+                self.writer.write(b'\r\n')
+        if not message.get('more_body', False):
+            if self.chunked:
+                self.writer.write(b'0\r\n\r\n')
+            self.complete = True
+        await self._drain()
+
+
+class AsgiServer:
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self.stopping = False
+        self.connections = {}  # _Connection -> Task
+        self._stop = None
+
+    async def _on_connection(self, reader, writer):
+        connection = _Connection(self, reader, writer)
+        self.connections[connection] = asyncio.current_task()
+        try:
+            await connection.run()
+        finally:
+            self.connections.pop(connection, None)
+
+    def stop(self):
+        self.stopping = True
+        self._stop.set()
+
+    async def _lifespan(self, queue, send_queue):
+        scope = {'type': 'lifespan', 'asgi': {'version': '3.0', 'spec_version': '2.0'}}
+        try:
+            await self.app(scope, queue.get, send_queue.put)
+        except Exception:
+            logger.exception('lifespan 出错')
+
+    async def serve(self, sock=None):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        raise_nofile_limit()
+        lifespan_in, lifespan_out = asyncio.Queue(), asyncio.Queue()
+        lifespan = asyncio.create_task(self._lifespan(lifespan_in, lifespan_out))
+        await lifespan_in.put({'type': 'lifespan.startup'})
+        await lifespan_out.get()
+
+        if sock is not None:
+            server = await asyncio.start_server(self._on_connection, sock=sock, limit=MAX_HEADER_SIZE)
+        else:
+            server = await asyncio.start_server(self._on_connection, self.config.host, self.config.port,
+                                                backlog=self.config.backlog, reuse_address=True,
+                                                limit=MAX_HEADER_SIZE)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, lambda: logger.warning('asyncio 模式不支持平滑重载，请重启进程'))
+        logger.info(f'监听 http://{self.config.host}:{self.config.port}（asyncio）')
+        try:
+            await self._stop.wait()
+        finally:
+            logger.info('正在停止，等待请求处理完成')
+            server.close()
+            for connection, task in list(self.connections.items()):
+                if connection.idle:
+                    task.cancel()
+            busy = list(self.connections.values())
+            if busy:
+                _done, pending = await asyncio.wait(busy, timeout=self.config.graceful_timeout)
+                for task in pending:
+                    task.cancel()
+            await lifespan_in.put({'type': 'lifespan.shutdown'})
+            try:
+                await asyncio.wait_for(lifespan, 5)
+            except TimeoutError:
+                lifespan.cancel()
+
+
+def run(app, config, sock=None):
+    asyncio.run(AsgiServer(app, config).serve(sock))
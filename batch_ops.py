@@ -0,0 +1,415 @@
+"""批量文件操作
+
+一个请求中对多个路径执行 delete / rename / move / copy / mkdir：
+  - 先一次性检查所有路径（必须位于共享文件夹内、不能是共享文件夹本身、名称合法），不合法的条目直接报错，
+    其余照常执行；文件是否存在等在执行时检查，因为前面的操作可能刚刚创建或移走了它
+  - 操作按涉及的路径分成若干轮：与前面某个操作的路径相同或互为上下级的操作排在它之后一轮，
+    同一轮内的操作互不相关，在线程池中并发执行；因此结果与按顺序逐个执行相同
+  - 每个条目单独返回结果，一个失败不影响其他条目
+
+每个操作都有一个原子的提交点（rename 或 mkdir），之前的准备工作放在同目录下以 .batch- 开头的临时名称上：
+  delete  先改名为临时名称（提交点），再删除临时文件/目录；非空目录只有条目带 "recursive": true 时才整个删除，
+          否则删除失败并改回原名
+  rename / move  直接 rename（提交点）
+  copy    复制到目标目录下的临时名称，再改名为最终名称（提交点）
+  mkdir   mkdir（提交点）
+
+意图日志：每一轮开始前把本轮所有操作（含临时名称）追加到批次的日志文件并 fsync 一次，操作完成后追加完成记录，
+整批完成后删除日志；执行期间对日志文件加 flock，其他工作进程据此知道它仍在进行。
+进程中途崩溃时，启动时 recover() 按文件系统的实际状态处理日志中未完成的操作：
+已过提交点的向前完成（删除已改名的临时文件），未过提交点的回滚（删除复制了一半的临时文件），
+因此共享文件夹中不会留下半个操作的结果。
+"""
+import errno
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import fs_events
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，多进程部署时无法区分进行中的批次和中断的批次
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('delete', 'rename', 'move', 'copy', 'mkdir')
+
+# 临时名称的前缀，其他子系统（如去重存储）扫描时应跳过
+TEMP_PREFIX = '.batch-'
+
+
+class BatchError(Exception):
+    """单个条目失败，message 返回给客户端"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _check_name(name):
+    if not isinstance(name, str) or not name or name in ('.', '..') or '/' in name or '\\' in name or '\0' in name:
+        raise BatchError(f'无效的名称: {name!r}')
+    if name.startswith(TEMP_PREFIX):
+        raise BatchError(f'名称不能以 {TEMP_PREFIX} 开头')
+    return name
+
+
+def _overlaps(a, b):
+    """两个绝对路径相同或互为上下级"""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _remove_entry(temp, source):
+    """删除改名为 temp 的文件或空目录，返回是否已删除；目录不为空时改回原名 source"""
+    if os.path.isdir(temp) and not os.path.islink(temp):
+        try:
+            os.rmdir(temp)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            os.rename(temp, source)
+            return False
+    else:
+        os.remove(temp)
+    return True
+
+
+class Operation:
+    """一个已通过路径检查的条目
+
+    source 为操作的对象，target 为操作完成后的路径（delete 为 None），temp 为提交前使用的临时路径，
+    recursive 只用于 delete，为 True 时允许删除非空目录。
+    """
+
+    def __init__(self, index, op, source, target=None, temp=None, recursive=False):
+        self.index = index
+        self.op = op
+        self.source = source
+        self.target = target
+        self.temp = temp
+        self.recursive = recursive
+
+    def paths(self):
+        return [path for path in (self.source, self.target) if path is not None]
+
+    def to_record(self):
+        return {'index': self.index, 'op': self.op, 'source': self.source, 'target': self.target, 'temp': self.temp,
+                'recursive': self.recursive}
+
+
+class BatchOperations:
+    """执行批量操作，journal_dir 存放意图日志（应在共享文件夹之外）"""
+
+    def __init__(self, share_root, journal_dir, workers=8, fsync=True):
+        self.share_root = os.path.abspath(share_root)
+        self.journal_dir = journal_dir
+        self.workers = workers
+        self.fsync = fsync
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        self.batches = 0
+        self.operations = 0
+        self.failures = 0
+        self.recovered = 0
+        self._lock = threading.Lock()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    # 路径检查
+
+    def _resolve(self, relative):
+        if not isinstance(relative, str) or not relative.strip('/'):
+            raise BatchError('缺少路径')
+        path = os.path.abspath(os.path.join(self.share_root, relative.lstrip('/')))
+        if not path.startswith(self.share_root + os.sep):
+            raise BatchError(f'路径越界: {relative}', 403)
+        _check_name(os.path.basename(path))
+        return path
+
+    def _resolve_dir(self, relative):
+        """目标目录，可以是共享文件夹本身"""
+        if not isinstance(relative, str):
+            raise BatchError('缺少目标目录')
+        path = os.path.abspath(os.path.join(self.share_root, relative.lstrip('/')))
+        if path != self.share_root and not path.startswith(self.share_root + os.sep):
+            raise BatchError(f'路径越界: {relative}', 403)
+        return path
+
+    def relative(self, path):
+        return os.path.relpath(path, self.share_root).replace(os.sep, '/')
+
+    def prepare(self, index, item, batch_id):
+        """检查一个条目，返回 Operation；不合法时抛出 BatchError"""
+        if not isinstance(item, dict):
+            raise BatchError('条目必须是JSON对象')
+        op = item.get('op')
+        if op not in OPERATIONS:
+            raise BatchError(f'不支持的操作: {op!r}')
+        source = self._resolve(item.get('path'))
+        temp_name = f'{TEMP_PREFIX}{batch_id}-{index}'
+        if op == 'delete':
+            recursive = item.get('recursive', False)
+            if not isinstance(recursive, bool):
+                raise BatchError('recursive 必须是 true 或 false')
+            return Operation(index, op, source, temp=os.path.join(os.path.dirname(source), temp_name),
+                             recursive=recursive)
+        if op == 'mkdir':
+            return Operation(index, op, None, target=source)
+        if op == 'rename':
+            target = os.path.join(os.path.dirname(source), _check_name(item.get('name')))
+            return Operation(index, op, source, target)
+        # move / copy：dest 为目标目录，name 可选，默认保持原名
+        dest_dir = self._resolve_dir(item.get('dest'))
+        name = _check_name(item['name']) if item.get('name') is not None else os.path.basename(source)
+        target = os.path.join(dest_dir, name)
+        if _overlaps(source, target) and (op == 'copy' or target.startswith(source + os.sep)):
+            raise BatchError('不能移动或复制到自身或其子目录中')
+        temp = os.path.join(dest_dir, temp_name) if op == 'copy' else None
+        return Operation(index, op, source, target, temp)
+
+    # 执行
+
+    def schedule(self, operations):
+        """分轮：与前面的操作路径重叠的操作排在其后一轮，返回 [[Operation, ...], ...]
+
+        按路径记录已安排的最晚轮次，每个操作只需查看自己路径的各级上级，不必与前面所有操作两两比较。
+        """
+        waves = []
+        exact = {}  # 路径 -> 涉及该路径的操作的最晚轮次
+        below = {}  # 目录 -> 涉及其下级路径的操作的最晚轮次
+        for operation in operations:
+            paths = operation.paths()
+            wave = 0
+            for path in paths:
+                wave = max(wave, below.get(path, -1) + 1)
+                ancestor = path
+                while ancestor != self.share_root:
+                    wave = max(wave, exact.get(ancestor, -1) + 1)
+                    ancestor = os.path.dirname(ancestor)
+            for path in paths:
+                exact[path] = max(exact.get(path, -1), wave)
+                ancestor = os.path.dirname(path)
+                while True:
+                    below[ancestor] = max(below.get(ancestor, -1), wave)
+                    if ancestor == self.share_root:
+                        break
+                    ancestor = os.path.dirname(ancestor)
+            if wave == len(waves):
+                waves.append([])
+            waves[wave].append(operation)
+        return waves
+
+    def run(self, items):
+        """执行一批操作，返回 (批次号, 结果列表)，结果与 items 一一对应"""
+        batch_id = uuid.uuid4().hex[:12]
+        results = [None] * len(items)
+        operations = []
+        for index, item in enumerate(items):
+            try:
+                operations.append(self.prepare(index, item, batch_id))
+            except BatchError as e:
+                results[index] = self._result(index, item, error=e)
+
+        journal_path = os.path.join(self.journal_dir, f'{batch_id}.jsonl')
+        # 先以其他名称创建并加锁，再改为 .jsonl，recover() 看到的日志一定已经加锁
+        with open(journal_path + '.new', 'a', encoding='utf-8') as journal:
+            if fcntl is not None:
+                fcntl.flock(journal, fcntl.LOCK_EX)
+            os.rename(journal_path + '.new', journal_path)
+            lock = threading.Lock()
+
+            def execute(operation):
+                try:
+                    self._execute(operation)
+                    error = None
+                except BatchError as e:
+                    error = e
+                except OSError as e:
+                    error = BatchError(f'{e.strerror or e}', 500)
+                with lock:
+                    journal.write(json.dumps({'done': operation.index}) + '\n')
+                return operation, error
+
+            for wave in self.schedule(operations):
+                self._append(journal, [operation.to_record() for operation in wave])
+                for operation, error in self._pool.map(execute, wave):
+                    results[operation.index] = self._result(operation.index, items[operation.index], operation, error)
+            # 先删除再解锁（关闭），其他进程不会把已完成的批次当作中断的批次
+            os.remove(journal_path)
+
+        with self._lock:
+            self.batches += 1
+            self.operations += len(items)
+            self.failures += sum(1 for result in results if result['status'] != 'success')
+        return batch_id, results
+
+    def _append(self, journal, records):
+        journal.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+    def _result(self, index, item, operation=None, error=None):
+        result = {'index': index, 'op': item.get('op') if isinstance(item, dict) else None,
+                  'path': item.get('path') if isinstance(item, dict) else None}
+        if error is not None:
+            result.update(status='error', message=error.message)
+        else:
+            result['status'] = 'success'
+            if operation.target is not None:
+                result['target'] = self.relative(operation.target)
+        return result
+
+    def _execute(self, operation):
+        op = operation.op
+        if op == 'mkdir':
+            if os.path.lexists(operation.target):
+                raise BatchError('已存在', 409)
+            if not os.path.isdir(os.path.dirname(operation.target)):
+                raise BatchError('上级目录不存在', 404)
+            os.mkdir(operation.target)
+            fs_events.emit('created', operation.target)
+            return
+
+        source = operation.source
+        if not os.path.lexists(source):
+            raise BatchError('路径不存在', 404)
+        if op == 'delete':
+            os.rename(source, operation.temp)
+            if operation.recursive:
+                _remove(operation.temp)
+            elif not _remove_entry(operation.temp, source):
+                raise BatchError('目录不为空，删除整个目录需要指定 "recursive": true', 409)
+            fs_events.emit('deleted', source)
+            return
+
+        target = operation.target
+        if not os.path.isdir(os.path.dirname(target)):
+            raise BatchError('目标目录不存在', 404)
+        if os.path.lexists(target):
+            raise BatchError('目标已存在', 409)
+        if op in ('rename', 'move'):
+            os.rename(source, target)
+            fs_events.emit('renamed', source, target)
+            return
+
+        # copy
+        try:
+            if os.path.isdir(source) and not os.path.islink(source):
+                shutil.copytree(source, operation.temp, symlinks=True)
+            else:
+                shutil.copy2(source, operation.temp, follow_symlinks=False)
+            if os.path.lexists(target):
+                raise BatchError('目标已存在', 409)
+            os.rename(operation.temp, target)
+        finally:
+            if os.path.lexists(operation.temp):
+                _remove(operation.temp)
+        fs_events.emit('created', target)
+
+    # 崩溃恢复
+
+    def recover(self):
+        """处理上次运行中断的批次，返回处理的操作数；应在开始处理请求之前调用"""
+        recovered = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if name.endswith('.jsonl.new'):
+                # 创建后还没来得及改名就崩溃了，其中不会有记录
+                self._remove_stale(os.path.join(self.journal_dir, name))
+                continue
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            records, done = [], set()
+            try:
+                f = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with f:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        # 另一个工作进程正在执行这一批
+                        continue
+                    if not os.path.exists(path):
+                        # 等锁期间对方刚好完成并删除了日志
+                        continue
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+                    if 'done' in record:
+                        done.add(record['done'])
+                    else:
+                        records.append(record)
+                for record in records:
+                    if record['index'] in done:
+                        continue
+                    try:
+                        action = self._recover_one(record)
+                    except OSError as e:
+                        logger.error(f'恢复批量操作 {record} 失败: {e}')
+                        continue
+                    recovered += 1
+                    logger.warning(f"批量操作 {name[:-6]} 第 {record['index']} 项 {record['op']} 未完成，已{action}")
+                os.remove(path)
+        with self._lock:
+            self.recovered += recovered
+        return recovered
+
+    @staticmethod
+    def _remove_stale(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+
+    @staticmethod
+    def _recover_one(record):
+        """按文件系统的实际状态完成或回滚一个操作，返回所做处理的描述"""
+        op, temp = record['op'], record['temp']
+        if op == 'delete':
+            if temp and os.path.lexists(temp):
+                # 已改名（过了提交点），把删除做完；非递归删除的目录不为空时改回原名
+                if record.get('recursive'):
+                    _remove(temp)
+                elif not _remove_entry(temp, record['source']):
+                    return '回滚（目录不为空）'
+                return '向前完成'
+            return '确认（未开始或已完成）'
+        if op == 'copy':
+            if temp and os.path.lexists(temp):
+                # 复制未完成，丢弃临时副本
+                _remove(temp)
+                return '回滚'
+            return '确认（未开始或已完成）'
+        # rename / move / mkdir 只有一步原子操作，要么做了要么没做
+        return '确认（原子操作）'
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'failures': self.failures,
+            'recovered': self.recovered,
+            'workers': self.workers,
+        }
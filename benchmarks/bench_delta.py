@@ -0,0 +1,151 @@
+"""增量同步基准测试
+
+用 serve.py 启动服务器，对比大文件小幅修改后重新上传的两种方式：
+  full   通过上传表单（multipart，upload_file）重新上传整个文件
+  delta  用 delta_client 只上传变化的块（包括获取签名）
+
+步骤：先整体上传旧版本；在本地修改若干处（随机位置覆盖 --changes 段，共 --changed-mb MB，另在中间插入一小段以检验错位匹配）；
+分别测量 delta（签名未缓存和已缓存各一次）与 full 的传输字节数和耗时。
+
+客户端和服务器在同一台机器上，回环网络几乎不限带宽，整体上传反而最快；
+"估算" 列按 --link-mbps 指定的链路带宽估算实际网络中的耗时：计算时间 + 传输字节数 / 带宽。
+
+用法:
+    python benchmarks/bench_delta.py --size-mb 1024 --changed-mb 8
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import delta_client  # noqa: E402
+from bench_suite import BOUNDARY, start_server, stop_server  # noqa: E402
+
+REMOTE_DIR = 'bench'
+FILENAME = 'image.bin'
+
+
+def write_random(path, size_mb):
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+
+def modify(src, dst, changes, changed_bytes, rng):
+    """复制 src 到 dst 并随机覆盖 changes 段，再在中间插入 1000 字节"""
+    shutil.copyfile(src, dst)
+    size = os.path.getsize(dst)
+    piece = max(changed_bytes // changes, 1)
+    with open(dst, 'r+b') as f:
+        for _ in range(changes):
+            f.seek(rng.randrange(0, size - piece))
+            f.write(os.urandom(piece))
+    tmp = dst + '.tmp'
+    with open(dst, 'rb') as f, open(tmp, 'wb') as out:
+        remaining = size // 2
+        while remaining:
+            data = f.read(min(remaining, 1024 * 1024))
+            out.write(data)
+            remaining -= len(data)
+        out.write(os.urandom(1000))
+        shutil.copyfileobj(f, out)
+    os.replace(tmp, dst)
+
+
+def full_upload(port, path):
+    """以 multipart 表单上传整个文件，返回 (耗时, 请求体字节数)"""
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{FILENAME}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode()
+    tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+    length = len(head) + os.path.getsize(path) + len(tail)
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.putrequest('POST', f'/files/{REMOTE_DIR}/upload')
+    conn.putheader('Content-Type', f'multipart/form-data; boundary={BOUNDARY}')
+    conn.putheader('Content-Length', str(length))
+    conn.endheaders()
+    conn.send(head)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            conn.send(data)
+    conn.send(tail)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    if response.status >= 400:
+        raise RuntimeError(f'上传失败: {response.status}')
+    return time.perf_counter() - started, length
+
+
+def main():
+    parser = argparse.ArgumentParser(description='增量同步与整体上传的对比')
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--changed-mb', type=float, default=4)
+    parser.add_argument('--changes', type=int, default=16, help='修改的段数')
+    parser.add_argument('--block-size', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--link-mbps', type=float, default=100, help='估算用的链路带宽（Mbit/s）')
+    parser.add_argument('--dir', help='临时文件的位置，默认系统临时目录')
+    parser.add_argument('--backend', default='builtin')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix='bench-delta-', dir=args.dir)
+    share, state = os.path.join(work, 'share'), os.path.join(work, 'state')
+    os.makedirs(os.path.join(share, REMOTE_DIR))
+    os.makedirs(state)
+    old_path, new_path = os.path.join(work, 'old.bin'), os.path.join(work, 'new.bin')
+    remote = f'{REMOTE_DIR}/{FILENAME}'
+    server = None
+    try:
+        print(f'生成 {args.size_mb}MB 的测试文件...')
+        write_random(old_path, args.size_mb)
+        modify(old_path, new_path, args.changes, int(args.changed_mb * 1024 * 1024), rng)
+        server, port = start_server(args, share, state)
+        full_upload(port, old_path)
+
+        rows = []
+        stats = delta_client.sync(f'http://127.0.0.1:{port}', new_path, remote, args.block_size)
+        rows.append(('delta（签名未缓存）', stats))
+        # 再同步一次：服务器上已是新版本，签名在上次重建时已缓存
+        stats = delta_client.sync(f'http://127.0.0.1:{port}', new_path, remote, args.block_size)
+        rows.append(('delta（无变化）', stats))
+        # 恢复旧版本（签名未缓存），再测签名已缓存时的同步
+        full_upload(port, old_path)
+        delta_client.sync(f'http://127.0.0.1:{port}', old_path, remote, args.block_size)
+        stats = delta_client.sync(f'http://127.0.0.1:{port}', new_path, remote, args.block_size)
+        rows.append(('delta（签名已缓存）', stats))
+        full_upload(port, old_path)
+        seconds, sent = full_upload(port, new_path)
+
+        print(f"\n文件 {os.path.getsize(new_path)} 字节，修改 {args.changes} 处共 {args.changed_mb}MB，另插入 1000 字节")
+        print(f"{'方式':<22}{'传输(MB)':>10}{'占比':>9}{'耗时(s)':>9}{'签名':>8}{'增量':>8}{'上传':>8}"
+              f"{f'估算@{args.link_mbps:g}Mbps':>16}")
+        size = os.path.getsize(new_path)
+        link = args.link_mbps * 1e6 / 8
+        for name, stats in rows:
+            sent_bytes = stats['delta_bytes'] + stats['signature_bytes']
+            total = stats['signature_seconds'] + stats['delta_seconds'] + stats['upload_seconds']
+            print(f"{name:<18}{sent_bytes / 1024 ** 2:>10.2f}{sent_bytes / size:>9.2%}{total:>9.2f}"
+                  f"{stats['signature_seconds']:>8.2f}{stats['delta_seconds']:>8.2f}{stats['upload_seconds']:>8.2f}"
+                  f"{total + sent_bytes / link:>16.2f}")
+        print(f"{'full':<22}{sent / 1024 ** 2:>10.2f}{sent / size:>9.2%}{seconds:>9.2f}{'':>24}"
+              f"{max(seconds, sent / link):>16.2f}")
+    finally:
+        if server is not None:
+            stop_server(server)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""下载路径基准测试
+
+对比三种发送方式处理同一个大文件时的吞吐量和每 GB 消耗的 CPU 时间：
+  legacy    原来的 4KB 生成器
+  fallback  服务器不提供 wsgi.file_wrapper 时，file_response 返回的大块迭代器
+  sendfile  服务器提供 wsgi.file_wrapper（serve.py 的 SendfileWrapper）时，像 serve.py 一样对套接字 socket.sendfile
+
+响应正文写入 socketpair 的一端，另一端由线程读出丢弃，与写入真实连接一样需要经过内核套接字缓冲区
+（写入 /dev/null 时 sendfile 几乎什么都不做，得到的数字没有意义）。
+fallback 和 sendfile 都通过 file_response 构造响应、按 WSGI 调用取得正文，与服务器处理下载请求的路径相同。
+CPU 时间包含读出线程的消耗，各方式相同。
+
+用法:
+    python benchmarks/bench_download.py --size-mb 1024 --repeat 3
+"""
+import argparse
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_engine import file_response  # noqa: E402
+from serve import SendfileWrapper  # noqa: E402
+
+RECV_SIZE = 1024 * 1024
+
+
+def make_environ(file_wrapper):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SERVER_NAME': '127.0.0.1',
+        'SERVER_PORT': '80',
+        'PATH_INFO': '/files/bench.bin',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    if file_wrapper:
+        environ['wsgi.file_wrapper'] = SendfileWrapper
+    return environ
+
+
+def call_app(environ, path, size):
+    """像 WSGI 服务器一样调用 file_response 构造的响应，返回正文迭代器"""
+    response = file_response(environ, path, 0, size, 200, 'application/octet-stream')
+    return response(environ, lambda status, headers, exc_info=None: None)
+
+
+def legacy(path, size, sock):
+    """原 list_files 中的生成器实现"""
+    def generate():
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(4096)
+                if not chunk:
+                    break
+                yield chunk
+
+    for chunk in generate():
+        sock.sendall(chunk)
+
+
+def fallback(path, size, sock):
+    """没有 wsgi.file_wrapper：werkzeug 的 FileWrapper 按 FALLBACK_CHUNK_SIZE 迭代"""
+    body = call_app(make_environ(False), path, size)
+    try:
+        for chunk in body:
+            sock.sendall(chunk)
+    finally:
+        body.close()
+
+
+def sendfile(path, size, sock):
+    """serve.py 的做法：识别出 SendfileWrapper 后从文件当前位置 socket.sendfile Content-Length 个字节"""
+    body = call_app(make_environ(True), path, size)
+    try:
+        assert isinstance(body, SendfileWrapper), type(body)
+        offset = os.lseek(body.filelike.fileno(), 0, os.SEEK_CUR)
+        sent = sock.sendfile(body.filelike, offset, size)
+        if sent != size:
+            raise RuntimeError(f'只发送了 {sent} 字节')
+    finally:
+        body.close()
+
+
+def drain(sock, expected, result):
+    """读出并丢弃 expected 字节"""
+    buffer = bytearray(RECV_SIZE)
+    received = 0
+    while received < expected:
+        n = sock.recv_into(buffer)
+        if not n:
+            break
+        received += n
+    result.append(received)
+
+
+def make_file(directory, size_mb):
+    path = os.path.join(directory, 'bench.bin')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return path
+
+
+def run(name, func, path, size, repeat):
+    best_wall = None
+    best_cpu = None
+    for _ in range(repeat):
+        sender, receiver = socket.socketpair()
+        try:
+            result = []
+            reader = threading.Thread(target=drain, args=(receiver, size, result))
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            reader.start()
+            func(path, size, sender)
+            reader.join()
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+        finally:
+            sender.close()
+            receiver.close()
+        if result != [size]:
+            raise RuntimeError(f'{name}: 收到 {result} 字节，应为 {size}')
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    gb = size / (1024 ** 3)
+    print(f"{name:<10} {size / best_wall / 1024 ** 2:>10.1f} MB/s {best_cpu / gb:>10.3f} CPU s/GB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载路径基准测试')
+    parser.add_argument('--size-mb', type=int, default=512, help='测试文件大小(MB)')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式重复次数，取最好成绩')
+    parser.add_argument('--dir', default=None, help='测试文件所在目录，默认系统临时目录')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = make_file(tmp, args.size_mb)
+        size = os.path.getsize(path)
+        print(f"文件大小: {args.size_mb} MB，重复 {args.repeat} 次")
+        for name, func in (('legacy', legacy), ('fallback', fallback), ('sendfile', sendfile)):
+            run(name, func, path, size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
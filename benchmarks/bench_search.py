@@ -0,0 +1,135 @@
+"""文件名搜索基准测试
+
+报告索引建立时间和各类查询的延迟（p50/p99）。两种数据来源：
+  --files N       在临时目录中真实创建 N 个空文件，计时 MetadataIndex 的完整重建（并行扫描 + 写入 + 搜索表）
+  --synthetic N   不创建文件，直接向索引写入 N 条虚构路径，只计时写入和搜索表的批量重建，
+                  用于几百万条路径的规模
+
+用法:
+    python benchmarks/bench_search.py --synthetic 2000000 --repeat 50
+    python benchmarks/bench_search.py --files 100000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_index import MetadataIndex  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+WORDS = ['report', 'photo', 'IMG', 'backup', 'data', 'final', 'draft', 'video', 'music', 'notes',
+         '2023', '2024', 'project', 'scan', 'invoice', '报告', '照片', '会议纪要']
+EXTENSIONS = ['jpg', 'png', 'pdf', 'txt', 'mp4', 'docx', 'zip', 'log']
+FILES_PER_DIR = 500
+
+# (名称, search() 的参数)
+QUERIES = [
+    ('子串-常见', {'query': 'report'}),
+    ('子串-罕见', {'query': '_12345.'}),
+    ('子串-中文', {'query': '会议纪要'}),
+    ('短查询-两字', {'query': '报告'}),
+    ('前缀', {'query': 'IMG', 'mode': 'prefix'}),
+    ('扩展名', {'extensions': ['pdf']}),
+    ('子串+扩展名', {'query': 'final', 'extensions': ['docx', 'zip']}),
+    ('路径', {'query': 'report_0/'}),
+    ('无结果', {'query': 'zzzzqqq'}),
+]
+
+
+def synthetic_names(count, seed=0):
+    """产生 (目录, 文件名)，每个目录 FILES_PER_DIR 个文件"""
+    rng = random.Random(seed)
+    for i in range(count):
+        directory = f'{WORDS[i // 100000 % len(WORDS)]}_{i // 10000}/{WORDS[i // FILES_PER_DIR % len(WORDS)]}_{i // FILES_PER_DIR}'
+        name = f'{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i}.{rng.choice(EXTENSIONS)}'
+        yield directory, name
+
+
+def build_real(index, share, count):
+    for directory, name in synthetic_names(count):
+        path = os.path.join(share, directory)
+        os.makedirs(path, exist_ok=True)
+        open(os.path.join(path, name), 'wb').close()
+    started = time.perf_counter()
+    index.rebuild()
+    return time.perf_counter() - started
+
+
+def build_synthetic(index, search, count):
+    """直接写入 entries 表（与整体重建相同：先暂停触发器，写完后批量重建搜索表）"""
+    now = time.time_ns()
+    rows = [('', None, '', 1, 0, now, 1, None, 0, count, 0, 1)]
+    directories = set()
+    for i, (directory, name) in enumerate(synthetic_names(count)):
+        parts = directory.split('/')
+        for depth in range(1, len(parts) + 1):
+            path = '/'.join(parts[:depth])
+            if path not in directories:
+                directories.add(path)
+                rows.append((path, '/'.join(parts[:depth - 1]), parts[depth - 1], 1, 0, now, 2 + len(directories),
+                             None, 0, 0, 0, 1))
+        rows.append((f'{directory}/{name}', directory, name, 0, 0, now, 10 ** 9 + i, None, 0, 1, 0, 1))
+    started = time.perf_counter()
+    with index._transaction() as db:
+        search.suspend(db)
+        db.execute('DELETE FROM entries')
+        insert_started = time.perf_counter()
+        db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        inserted = time.perf_counter() - insert_started
+        search.resume(db)
+    index.ready = True
+    total = time.perf_counter() - started
+    print(f'写入 {len(rows)} 行: {inserted:.2f} 秒，搜索表重建: {total - inserted:.2f} 秒')
+    return total
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件名搜索基准测试')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--files', type=int, help='真实创建的文件数')
+    source.add_argument('--synthetic', type=int, default=1_000_000, help='直接写入索引的虚构路径数')
+    parser.add_argument('--repeat', type=int, default=30, help='每个查询的重复次数')
+    parser.add_argument('--limit', type=int, default=100, help='每次查询返回的条目数')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    try:
+        share = os.path.join(work, 'share')
+        os.makedirs(share)
+        index = MetadataIndex(share, os.path.join(work, 'metadata.sqlite3'), use_inotify=False)
+        search = SearchIndex(index, timeout=10)
+        if args.files:
+            seconds = build_real(index, share, args.files)
+            count = args.files
+        else:
+            seconds = build_synthetic(index, search, args.synthetic)
+            count = args.synthetic
+        size_mb = os.path.getsize(index.db_path) / 1024 ** 2
+        print(f'{count} 条路径，建立索引 {seconds:.2f} 秒，数据库 {size_mb:.0f} MB')
+
+        print(f"{'查询':<12}{'结果数':>8}{'p50(ms)':>10}{'p99(ms)':>10}")
+        for label, params in QUERIES:
+            timings = []
+            found = 0
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                results, _cursor, _truncated = search.search(limit=args.limit, **params)
+                timings.append((time.perf_counter() - started) * 1000)
+                found = len(results)
+            print(f'{label:<12}{found:>8}{percentile(timings, 0.5):>10.2f}{percentile(timings, 0.99):>10.2f}')
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,540 @@
+"""文件服务器综合基准测试
+
+生成合成的共享目录树，用 serve.py 启动服务器，多个客户端进程通过 keep-alive 连接对各场景施加负载，
+报告吞吐量、延迟（p50/p90/p99）以及服务器进程（含所有工作进程）的 CPU 时间和内存（RSS），
+结果保存为 JSON，可用 --compare 与以前的结果对比。
+
+目录树（随机数种子固定，同样的参数每次生成相同的内容）：
+  small/      大量小文件，每个目录 100 个，1–16 KB
+  huge/       少数大文件
+  wide/       一个含大量条目（默认 10 万）的目录
+
+场景：
+  listing        随机请求 small/ 下的一个目录列表页
+  listing_wide   随机请求 wide/ 的某一页
+  download       完整下载随机的小文件
+  download_huge  完整下载大文件
+  range          对大文件随机请求 64 KB 的范围
+  upload         并发上传（multipart 表单）
+  churn          上传一个小文件、重命名、再删除，循环进行
+
+CPU 和 RSS 取自 /proc，只在 Linux 上报告；客户端与服务器在同一台机器上运行，会互相争用 CPU。
+用 --tree 指定目录可以保留生成的目录树，参数相同时下次直接复用。
+
+用法:
+    python benchmarks/bench_suite.py --quick
+    python benchmarks/bench_suite.py --tree /data/bench-tree --workers 4 --duration 20
+    python benchmarks/bench_suite.py --scenarios listing range --compare benchmarks/results/上次的结果.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+SCENARIOS = ('listing', 'listing_wide', 'download', 'download_huge', 'range', 'upload', 'churn')
+
+FILES_PER_DIR = 100
+RANGE_SIZE = 64 * 1024
+LISTING_PAGE_SIZE = 500  # 与 file_server.LISTING_PAGE_SIZE 一致
+BOUNDARY = 'benchsuiteboundary9f3a1c'
+# 请求成功的状态码（上传、重命名、删除成功后重定向）
+OK_STATUS = {200, 206, 302}
+
+TREE_MARKER = '.bench_tree.json'
+
+
+# 目录树
+
+def tree_spec(args):
+    return {
+        'seed': args.seed,
+        'small_files': args.small_files,
+        'huge_files': args.huge_files,
+        'huge_mb': args.huge_mb,
+        'wide_entries': args.wide_entries,
+    }
+
+
+def small_file_path(index):
+    return f'small/d{index // FILES_PER_DIR:04d}/f{index:06d}.txt'
+
+
+def build_tree(share, spec):
+    """按 spec 生成目录树；share 中已有相同 spec 生成的树时直接复用"""
+    marker = os.path.join(share, TREE_MARKER)
+    if os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == spec:
+                print(f'复用已有的目录树 {share}')
+                return 0.0
+        raise SystemExit(f'{share} 中的目录树参数不同，请换一个目录或删除它')
+    if os.path.exists(share) and os.listdir(share):
+        raise SystemExit(f'{share} 不是空目录')
+
+    started = time.perf_counter()
+    rng = random.Random(spec['seed'])
+    block = rng.randbytes(1024 * 1024)
+    for i in range(spec['small_files']):
+        path = os.path.join(share, small_file_path(i))
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = rng.randint(1024, 16 * 1024)
+        offset = rng.randrange(len(block) - size)
+        with open(path, 'wb') as f:
+            f.write(block[offset:offset + size])
+
+    os.makedirs(os.path.join(share, 'huge'), exist_ok=True)
+    for i in range(spec['huge_files']):
+        with open(os.path.join(share, 'huge', f'huge_{i}.bin'), 'wb') as f:
+            for _ in range(spec['huge_mb']):
+                f.write(block)
+
+    wide = os.path.join(share, 'wide')
+    os.makedirs(wide, exist_ok=True)
+    for i in range(spec['wide_entries']):
+        open(os.path.join(wide, f'entry_{i:07d}.dat'), 'wb').close()
+
+    for name in ('uploads', 'churn'):
+        os.makedirs(os.path.join(share, name), exist_ok=True)
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+    return time.perf_counter() - started
+
+
+# 服务器进程的资源占用（Linux）
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _proc_stat(pid):
+    """返回 (父进程号, 用户态+内核态 CPU 秒数, RSS 字节)，进程不存在时返回 None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    # fields[0] 是原文第 3 个字段（状态），ppid 为第 4 个，utime/stime 为第 14、15 个，rss 为第 24 个
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+def process_tree_usage(root_pid):
+    """root_pid 及其所有子孙进程的 (CPU 秒数, RSS 字节)；不是 Linux 时返回 (None, None)
+
+    已退出的子进程的 CPU 时间计入父进程的 cutime，这里不含，工作进程在测试期间不应退出。
+    """
+    if not os.path.isdir('/proc'):
+        return None, None
+    stats = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            stat = _proc_stat(int(name))
+            if stat is not None:
+                stats[int(name)] = stat
+    if root_pid not in stats:
+        return None, None
+    tree = {root_pid}
+    changed = True
+    while changed:
+        changed = False
+        for pid, (ppid, _cpu, _rss) in stats.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                changed = True
+    return sum(stats[pid][1] for pid in tree), sum(stats[pid][2] for pid in tree)
+
+
+class UsageSampler:
+    """场景进行期间定期采样服务器进程树的 RSS，记录峰值"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.cpu_start, _rss = process_tree_usage(self.pid)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            _cpu, rss = process_tree_usage(self.pid)
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        cpu_end, self.end_rss = process_tree_usage(self.pid)
+        self.wall_seconds = time.perf_counter() - self.started
+        self.cpu_seconds = cpu_end - self.cpu_start if cpu_end is not None and self.cpu_start is not None else None
+
+
+# 客户端
+
+def multipart_body(filename, data):
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+    return head + data + f'\r\n--{BOUNDARY}--\r\n'.encode('ascii')
+
+
+def quote(path):
+    return urllib.parse.quote(path)
+
+
+class Client:
+    """一条 keep-alive 连接，request() 返回 (状态码, 收到的正文字节数)"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            received = 0
+            while True:
+                data = response.read(1024 * 1024)
+                if not data:
+                    break
+                received += len(data)
+            if response.will_close:
+                self.close()
+            return response.status, received
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def scenario_step(name, client, rng, spec, tag, counter):
+    """执行一次场景操作，返回 [(操作, 延迟秒数, 状态码, 发送字节, 接收字节), ...]"""
+    results = []
+
+    def call(op, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        status, received = client.request(method, path, body, headers)
+        results.append((op, time.perf_counter() - started, status, len(body or b''), received))
+        return status
+
+    if name == 'listing':
+        directory = rng.randrange(max((spec['small_files'] + FILES_PER_DIR - 1) // FILES_PER_DIR, 1))
+        call('listing', 'GET', f'/files/small/d{directory:04d}/')
+    elif name == 'listing_wide':
+        pages = max((spec['wide_entries'] + LISTING_PAGE_SIZE - 1) // LISTING_PAGE_SIZE, 1)
+        call('listing_wide', 'GET', f'/files/wide/?page={rng.randint(1, pages)}')
+    elif name == 'download':
+        call('download', 'GET', '/files/' + small_file_path(rng.randrange(spec['small_files'])))
+    elif name == 'download_huge':
+        call('download_huge', 'GET', f'/files/huge/huge_{rng.randrange(spec["huge_files"])}.bin')
+    elif name == 'range':
+        size = spec['huge_mb'] * 1024 * 1024
+        start = rng.randrange(size - RANGE_SIZE)
+        call('range', 'GET', f'/files/huge/huge_{rng.randrange(spec["huge_files"])}.bin',
+             headers={'Range': f'bytes={start}-{start + RANGE_SIZE - 1}'})
+    elif name == 'upload':
+        body = multipart_body(f'{tag}-{counter}.bin', rng.randbytes(256 * 1024))
+        call('upload', 'POST', '/files/uploads/upload', body,
+             {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}', 'Referer': '/files/uploads/'})
+    elif name == 'churn':
+        name_a, name_b = f'{tag}-{counter}.txt', f'{tag}-{counter}-renamed.txt'
+        form = {'Content-Type': 'application/x-www-form-urlencoded', 'Referer': '/files/churn/'}
+        call('create', 'POST', '/files/churn/upload', multipart_body(name_a, rng.randbytes(4096)),
+             {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}', 'Referer': '/files/churn/'})
+        call('rename', 'POST', f'/files/churn/{quote(name_a)}/rename',
+             urllib.parse.urlencode({'new_name': name_b}).encode('ascii'), form)
+        call('delete', 'POST', f'/files/churn/{quote(name_b)}/delete', b'', form)
+    else:
+        raise ValueError(f'未知的场景: {name}')
+    return results
+
+
+def client_process(port, name, spec, connections, warmup, duration, seed, results):
+    """一个客户端进程：connections 个线程各自用一条 keep-alive 连接循环执行场景操作"""
+    records = []
+    errors = []
+    lock = threading.Lock()
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+
+    def loop(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(port)
+        tag = f'c{os.getpid()}-{index}'
+        counter = 0
+        while time.monotonic() < deadline:
+            counter += 1
+            try:
+                step = scenario_step(name, client, rng, spec, tag, counter)
+            except (OSError, http.client.HTTPException) as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            if time.monotonic() >= measure_from:
+                with lock:
+                    records.extend(step)
+        client.close()
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((records, errors))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else None
+
+
+def latency_summary(latencies):
+    return {
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p90_ms': percentile(latencies, 0.9) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'max_ms': max(latencies) * 1000 if latencies else None,
+    }
+
+
+def run_scenario(name, port, server_pid, spec, args):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client_process,
+                                       args=(port, name, spec, args.connections, args.warmup, args.duration,
+                                             args.seed + i, results))
+               for i in range(args.clients)]
+    for process in clients:
+        process.start()
+    # 预热结束后才开始统计服务器资源
+    time.sleep(args.warmup)
+    with UsageSampler(server_pid) as usage:
+        collected = [results.get() for _ in clients]
+    for process in clients:
+        process.join()
+
+    # 统计窗口内开始的操作都计入，吞吐量按窗口长度计算；CPU 按实际采样时长计算（含等待最后一批请求完成）
+    elapsed = args.duration
+    records = [record for part, _errors in collected for record in part]
+    errors = [error for _records, part in collected for error in part]
+    failed = [record for record in records if record[2] not in OK_STATUS]
+    statuses = {}
+    for record in failed:
+        statuses[str(record[2])] = statuses.get(str(record[2]), 0) + 1
+    result = {
+        'requests': len(records),
+        'errors': len(errors) + len(failed),
+        'error_status': statuses,
+        'error_samples': errors[:5],
+        'requests_per_second': len(records) / elapsed,
+        'sent_mb_per_second': sum(record[3] for record in records) / elapsed / 1024 ** 2,
+        'received_mb_per_second': sum(record[4] for record in records) / elapsed / 1024 ** 2,
+        **latency_summary([record[1] for record in records]),
+        'server_cpu_seconds': usage.cpu_seconds,
+        'server_cpu_percent': usage.cpu_seconds / usage.wall_seconds * 100 if usage.cpu_seconds is not None else None,
+        'server_rss_peak_mb': usage.peak_rss / 1024 ** 2 if usage.peak_rss else None,
+        'server_rss_end_mb': usage.end_rss / 1024 ** 2 if usage.end_rss else None,
+    }
+    operations = sorted({record[0] for record in records})
+    if len(operations) > 1:
+        result['operations'] = {op: {'requests': sum(1 for record in records if record[0] == op),
+                                     **latency_summary([record[1] for record in records if record[0] == op])}
+                                for op in operations}
+    return result
+
+
+# 服务器
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout):
+    """等到服务器能响应、且元数据索引建立完成"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/stats')
+            stats = json.loads(conn.getresponse().read())
+            conn.close()
+            if not stats.get('metadata_index') or stats['metadata_index'].get('ready'):
+                return
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('服务器没有按时启动')
+
+
+def start_server(args, share, state):
+    # 所有客户端都来自 127.0.0.1，取消单客户端的并发限制
+    with open(os.path.join(state, 'transfer_limits.json'), 'w', encoding='utf-8') as f:
+        json.dump({'max_transfers_per_client': 0}, f)
+    port = free_port()
+    env = dict(os.environ, FILE_SERVER_SHARE_FOLDER=share, FILE_SERVER_STATE_FOLDER=state)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--backend', args.backend, '--host', '127.0.0.1',
+         '--port', str(port), '--workers', str(args.workers), '--threads', str(args.threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, args.startup_timeout)
+    except BaseException:
+        stop_server(server)
+        raise
+    return server, port
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+# 结果
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, previous=None):
+    header = f"{'场景':<14}{'req/s':>10}{'MB/s':>9}{'p50(ms)':>10}{'p99(ms)':>10}{'CPU%':>8}{'RSS(MB)':>9}{'错误':>6}"
+    print(header)
+    for name, result in results.items():
+        mbps = max(result['sent_mb_per_second'], result['received_mb_per_second'])
+        cpu = result['server_cpu_percent']
+        rss = result['server_rss_peak_mb']
+        print(f"{name:<14}{result['requests_per_second']:>10.1f}{mbps:>9.1f}"
+              f"{result['p50_ms'] or 0:>10.2f}{result['p99_ms'] or 0:>10.2f}"
+              f"{cpu if cpu is not None else float('nan'):>8.0f}{rss if rss is not None else float('nan'):>9.0f}"
+              f"{result['errors']:>6}")
+        old = (previous or {}).get(name)
+        if old:
+            def change(key):
+                if not old.get(key) or result.get(key) is None:
+                    return '   -  '
+                return f'{(result[key] / old[key] - 1) * 100:+6.1f}%'
+            print(f"{'  对比上次':<12}{change('requests_per_second'):>10}{'':>9}{change('p50_ms'):>10}"
+                  f"{change('p99_ms'):>10}{change('server_cpu_percent'):>8}{change('server_rss_peak_mb'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件服务器综合基准测试')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--tree', help='目录树的存放位置（保留以便复用），默认使用临时目录')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--small-files', type=int, default=20000, help='small/ 中的文件数')
+    parser.add_argument('--huge-files', type=int, default=2, help='huge/ 中的文件数')
+    parser.add_argument('--huge-mb', type=int, default=256, help='每个大文件的大小(MB)')
+    parser.add_argument('--wide-entries', type=int, default=100000, help='wide/ 中的条目数')
+    parser.add_argument('--backend', default='builtin', choices=('builtin', 'gunicorn', 'asyncio'))
+    parser.add_argument('--workers', type=int, default=2, help='服务器工作进程数')
+    parser.add_argument('--threads', type=int, default=16, help='每个工作进程的线程数')
+    parser.add_argument('--clients', type=int, default=2, help='客户端进程数')
+    parser.add_argument('--connections', type=int, default=8, help='每个客户端进程的并发连接数')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的统计时长(秒)')
+    parser.add_argument('--warmup', type=float, default=2, help='每个场景开始统计前的预热时长(秒)')
+    parser.add_argument('--startup-timeout', type=float, default=300, help='等待服务器和索引就绪的最长时间(秒)')
+    parser.add_argument('--quick', action='store_true', help='小规模快速运行，用于检查脚本本身')
+    parser.add_argument('--output', help='结果 JSON 的路径，默认 benchmarks/results/<时间>-<提交>.json')
+    parser.add_argument('--compare', help='与以前的结果 JSON 对比')
+    args = parser.parse_args()
+    if args.quick:
+        args.small_files, args.huge_files, args.huge_mb, args.wide_entries = 2000, 1, 16, 5000
+        args.duration, args.warmup, args.clients, args.connections = 3, 0.5, 1, 4
+
+    spec = tree_spec(args)
+    work = tempfile.mkdtemp()
+    share = os.path.abspath(args.tree) if args.tree else os.path.join(work, 'share')
+    state = os.path.join(work, 'state')
+    os.makedirs(share, exist_ok=True)
+    os.makedirs(state)
+    try:
+        build_seconds = build_tree(share, spec)
+        if build_seconds:
+            print(f'生成目录树 {build_seconds:.1f} 秒')
+        server, port = start_server(args, share, state)
+        try:
+            _cpu, idle_rss = process_tree_usage(server.pid)
+            results = {}
+            for name in args.scenarios:
+                results[name] = run_scenario(name, port, server.pid, spec, args)
+                print(f"{name}: {results[name]['requests_per_second']:.1f} req/s，"
+                      f"p99 {results[name]['p99_ms'] or 0:.2f} ms")
+        finally:
+            stop_server(server)
+    finally:
+        if args.tree:
+            # 保留目录树，只清掉测试中上传的文件
+            for name in ('uploads', 'churn'):
+                shutil.rmtree(os.path.join(share, name), ignore_errors=True)
+                os.makedirs(os.path.join(share, name), exist_ok=True)
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'tree': spec,
+        'settings': {key: getattr(args, key) for key in ('backend', 'workers', 'threads', 'clients', 'connections',
+                                                         'duration', 'warmup')},
+        'server_idle_rss_mb': idle_rss / 1024 ** 2 if idle_rss else None,
+        'scenarios': results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['revision'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('tree') != spec or previous.get('settings') != report['settings']:
+            print('注意：对比的结果使用了不同的目录树或负载参数')
+        previous = previous.get('scenarios')
+    print()
+    print_table(results, previous)
+    print(f'\n结果已保存到 {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""上传路径基准测试
+
+对比两种上传写入方式的吞吐量和磁盘写放大：
+  legacy     request.files + file.save()（werkzeug 先落临时文件，save 再复制一次）
+  streaming  upload_file 当前的流式写入（解析请求体直接写入目标目录）
+
+写放大 = 进程写入字节数 / 上传文件字节数，取自 /proc/self/io：
+  wchar        write 系列系统调用写出的字节数（不论是否最终落盘）
+  write_bytes  实际提交给块设备层的字节数（tmpfs 上恒为 0）
+非 Linux 平台只报告吞吐量。
+
+用法:
+    python benchmarks/bench_upload.py --size-mb 512 --repeat 3 --dir /data/tmp
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request  # noqa: E402
+
+BOUNDARY = 'benchboundary7MA4YWxkTrZu0gW'
+
+
+def proc_io():
+    """读取 /proc/self/io，不可用时返回 None"""
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return None
+
+
+def make_body(path, size_mb):
+    """生成只含一个文件字段的 multipart 请求体"""
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        f.write(f'--{BOUNDARY}\r\n'
+                'Content-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        for _ in range(size_mb):
+            f.write(block)
+        f.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+    return os.path.getsize(path)
+
+
+def legacy_app(upload_dir):
+    app = Flask('legacy_upload')
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        for file in request.files.getlist('file'):
+            file.save(os.path.join(upload_dir, file.filename))
+        return ''
+
+    return app
+
+
+def streaming_app(upload_dir, fsync_policy):
+    import file_server
+    file_server.config.share_folder = upload_dir
+    file_server.UPLOAD_FSYNC_POLICY = fsync_policy
+    file_server.app.config['TESTING'] = True
+    return file_server.app
+
+
+def post(app, body_path, body_size, url):
+    """直接调用 WSGI 应用，请求体从磁盘文件读取，避免在内存中构造"""
+    with open(body_path, 'rb') as body:
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': url,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+            'CONTENT_LENGTH': str(body_size),
+            'HTTP_REFERER': '/files/',
+        }
+        status = []
+        result = app(environ, lambda s, h, exc_info=None: status.append(s))
+        for _ in result:
+            pass
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
+
+
+def run(name, app, url, body_path, body_size, upload_dir, file_size, repeat):
+    best = None
+    amplification = None
+    for _ in range(repeat):
+        before = proc_io()
+        started = time.perf_counter()
+        status = post(app, body_path, body_size, url)
+        elapsed = time.perf_counter() - started
+        after = proc_io()
+        if not status.startswith(('200', '302')):
+            raise RuntimeError(f'{name} 上传失败: {status}')
+        if best is None or elapsed < best:
+            best = elapsed
+            if before and after:
+                amplification = {key: (after[key] - before[key]) / file_size for key in ('wchar', 'write_bytes')}
+        for item in os.listdir(upload_dir):
+            os.remove(os.path.join(upload_dir, item))
+
+    line = f"{name:<10} {file_size / best / 1024 ** 2:>10.1f} MB/s"
+    if amplification:
+        line += f"  wchar x{amplification['wchar']:.2f}  write_bytes x{amplification['write_bytes']:.2f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传路径基准测试')
+    parser.add_argument('--size-mb', type=int, default=256, help='上传文件大小(MB)')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式重复次数，取最好成绩')
+    parser.add_argument('--dir', default=None, help='测试目录，应位于被测磁盘上，默认系统临时目录')
+    parser.add_argument('--fsync', default='never', choices=('never', 'file', 'always'),
+                        help='streaming 使用的 fsync 策略；legacy 从不 fsync，默认 never 便于对比')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(dir=args.dir)
+    # werkzeug 的临时文件也放到被测磁盘上
+    tempfile.tempdir = work
+    try:
+        body_path = os.path.join(work, 'body.multipart')
+        body_size = make_body(body_path, args.size_mb)
+        upload_dir = os.path.join(work, 'uploads')
+        os.makedirs(upload_dir)
+        file_size = args.size_mb * 1024 * 1024
+
+        print(f"文件大小: {args.size_mb} MB，重复 {args.repeat} 次，streaming fsync 策略: {args.fsync}")
+        run('legacy', legacy_app(upload_dir), '/upload', body_path, body_size, upload_dir, file_size, args.repeat)
+        run('streaming', streaming_app(upload_dir, args.fsync), '/files/upload', body_path, body_size, upload_dir,
+            file_size, args.repeat)
+    finally:
+        tempfile.tempdir = None
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
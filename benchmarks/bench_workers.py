@@ -0,0 +1,164 @@
+"""多进程服务器负载测试
+
+用 serve.py 分别以不同的工作进程数启动服务器，多个客户端进程通过 keep-alive 连接持续请求，
+报告每种工作进程数下的吞吐量（请求/秒）和相对单进程的加速比。
+场景：
+  listing   请求一个含 --entries 个文件的目录列表页（主要消耗 CPU，能看出多进程的扩展性）
+  download  下载一个 --file-kb 大小的小文件
+
+用法:
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --clients 4 --connections 8 --duration 10
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'listing': '/files/listing/',
+    'download': '/files/small.bin',
+}
+
+
+def make_share(share, entries, file_kb):
+    listing_dir = os.path.join(share, 'listing')
+    os.makedirs(listing_dir)
+    for i in range(entries):
+        with open(os.path.join(listing_dir, f'file_{i:06d}.txt'), 'wb') as f:
+            f.write(b'x' * (i % 4096))
+    with open(os.path.join(share, 'small.bin'), 'wb') as f:
+        f.write(os.urandom(file_kb * 1024))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/files/small.bin')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器没有按时启动')
+
+
+def client(port, path, connections, duration, results):
+    """一个客户端进程：connections 个线程各自用一条 keep-alive 连接循环请求"""
+    counts = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def loop():
+        count = 0
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                count += 1
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(repr(e))
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        counts.append(count)
+
+    threads = [threading.Thread(target=loop) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((sum(counts), len(errors)))
+
+
+def run(workers, args, share, state):
+    port = free_port()
+    env = dict(os.environ, FILE_SERVER_SHARE_FOLDER=share, FILE_SERVER_STATE_FOLDER=state)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--backend', args.backend, '--host', '127.0.0.1',
+         '--port', str(port), '--workers', str(workers), '--threads', str(args.threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port)
+        rates = {}
+        for name in args.scenarios:
+            results = multiprocessing.Queue()
+            clients = [multiprocessing.Process(target=client,
+                                               args=(port, SCENARIOS[name], args.connections, args.duration, results))
+                       for _ in range(args.clients)]
+            started = time.perf_counter()
+            for process in clients:
+                process.start()
+            totals = [results.get() for _ in clients]
+            for process in clients:
+                process.join()
+            elapsed = time.perf_counter() - started
+            requests = sum(count for count, _errors in totals)
+            errors = sum(errors for _count, errors in totals)
+            rates[name] = (requests / elapsed, errors)
+        return rates
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程服务器负载测试')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='依次测试的工作进程数')
+    parser.add_argument('--threads', type=int, default=8, help='每个工作进程的线程数')
+    parser.add_argument('--backend', default='builtin', choices=('builtin', 'gunicorn'))
+    parser.add_argument('--clients', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--connections', type=int, default=8, help='每个客户端进程的并发连接数')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的持续时间(秒)')
+    parser.add_argument('--entries', type=int, default=200, help='listing 场景目录中的文件数')
+    parser.add_argument('--file-kb', type=int, default=64, help='download 场景的文件大小(KB)')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    try:
+        share = os.path.join(work, 'share')
+        state = os.path.join(work, 'state')
+        os.makedirs(state)
+        make_share(share, args.entries, args.file_kb)
+        print(f"CPU 核数: {os.cpu_count()}，客户端 {args.clients} 进程 x {args.connections} 连接，"
+              f"每个场景 {args.duration:g} 秒")
+        baseline = {}
+        for workers in args.workers:
+            rates = run(workers, args, share, state)
+            for name, (rate, errors) in rates.items():
+                baseline.setdefault(name, rate)
+                line = f"workers={workers:<3} {name:<9} {rate:>10.1f} req/s  x{rate / baseline[name]:.2f}"
+                if errors:
+                    line += f"  错误 {errors}"
+                print(line)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
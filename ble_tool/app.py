@@ -2,18 +2,21 @@ import asyncio
 import json
 import logging
 import os
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask import request
-from bleak import BleakScanner, BleakClient
+from bleak import BleakScanner
 import json
 import threading
+import time
 import uuid
 
+from ble_worker import BleWorker
+from notification_stream import NotificationStream
+
 app = Flask(__name__)
 
 # 全局变量
 connected_device = None
-connected_client = None
 found_devices = []
 device_services = []
 scan_thread = None
@@ -23,6 +26,31 @@ is_scanning = False
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# BLE 操作的超时时间（秒）
+CONNECT_TIMEOUT = 30
+OPERATION_TIMEOUT = 10
+
+# 通知推送配置
+# 每个特征缓存的最近通知条数，读取者跟不上时最旧的通知被覆盖并计入 dropped
+NOTIFY_BUFFER_SIZE = 1024
+# 每个 SSE 事件最多携带的通知数
+STREAM_MAX_BATCH = 256
+# 两个事件之间至少间隔的秒数，期间到达的通知合并到下一个事件
+STREAM_BATCH_INTERVAL = 0.05
+# 没有通知时发送保活注释的间隔（秒）
+STREAM_KEEPALIVE = 15
+
+
+def on_device_disconnected(address):
+    global connected_device, device_services
+    connected_device = None
+    device_services = []  # 清空服务信息
+
+
+# 所有连接、读写、通知都在这个工作线程的事件循环中执行
+ble_worker = BleWorker(on_disconnect=on_device_disconnected)
+notification_stream = NotificationStream(NOTIFY_BUFFER_SIZE)
+
 
 # 主页路由 - 传统BLE版本
 @app.route('/')
@@ -68,59 +96,51 @@ def get_devices():
 # 连接设备
 @app.route('/connect', methods=['POST'])
 def connect_device():
-    global connected_device, connected_client
-
     data = request.get_json()
     device_address = data.get('address')
 
     if not device_address:
         return jsonify({'status': 'error', 'message': '设备地址不能为空'}), 400
 
-    # 在单独的线程中运行连接
-    connect_thread = threading.Thread(target=run_connect, args=(device_address,))
-    connect_thread.start()
+    error = run_connect(device_address)
+    if error:
+        return jsonify({'status': 'error', 'message': f'连接设备失败: {error}'}), 500
 
-    return jsonify({'status': 'success', 'message': '正在连接设备'})
+    return jsonify({'status': 'success', 'message': '设备已连接'})
 
 
 # 断开连接
 @app.route('/disconnect', methods=['POST'])
 def disconnect_device():
-    global connected_device, connected_client
-
-    if connected_client and connected_client.is_connected:
-        disconnect_thread = threading.Thread(target=run_disconnect)
-        disconnect_thread.start()
-        return jsonify({'status': 'success', 'message': '正在断开连接'})
-    else:
+    if not ble_worker.is_connected:
         return jsonify({'status': 'error', 'message': '当前没有连接的设备'}), 400
 
+    error = run_disconnect()
+    if error:
+        return jsonify({'status': 'error', 'message': f'断开连接时出错: {error}'}), 500
+
+    return jsonify({'status': 'success', 'message': '设备已断开连接'})
+
 
 # 获取服务和特征
 @app.route('/services', methods=['GET'])
 def get_services():
-    global connected_client, device_services
-
-    if not connected_client or not connected_client.is_connected:
+    if not ble_worker.is_connected:
         return jsonify({'status': 'error', 'message': '设备未连接'}), 400
 
     # 如果已经获取过服务信息，直接返回
-    if device_services:
-        return jsonify({'status': 'success', 'services': device_services})
+    if not device_services:
+        error = run_get_services()
+        if error:
+            return jsonify({'status': 'error', 'message': f'获取服务信息失败: {error}'}), 500
 
-    # 在单独的线程中获取服务
-    services_thread = threading.Thread(target=run_get_services)
-    services_thread.start()
-
-    return jsonify({'status': 'success', 'message': '正在获取服务信息'})
+    return jsonify({'status': 'success', 'services': device_services})
 
 
 # 为指定特征启动通知
 @app.route('/start_notify', methods=['POST'])
 def start_notify():
-    global connected_client
-
-    if not connected_client or not connected_client.is_connected:
+    if not ble_worker.is_connected:
         return jsonify({'status': 'error', 'message': '设备未连接'}), 400
 
     data = request.get_json()
@@ -129,21 +149,16 @@ def start_notify():
     if not characteristic_uuid:
         return jsonify({'status': 'error', 'message': '特征UUID不能为空'}), 400
 
-    # 在单独的线程中启动通知
-    notify_thread = threading.Thread(
-        target=run_start_notifications,
-        args=(characteristic_uuid,)
-    )
-    notify_thread.start()
+    error = run_start_notifications(characteristic_uuid)
+    if error:
+        return jsonify({'status': 'error', 'message': f'启动通知失败: {error}'}), 500
 
-    return jsonify({'status': 'success', 'message': '正在启动通知监听'})
+    return jsonify({'status': 'success', 'message': '已启动通知监听'})
 
 
 # 发送数据
 @app.route('/send', methods=['POST'])
 def send_data():
-    global connected_client
-
     data = request.get_json()
     service_uuid = data.get('service_uuid')
     characteristic_uuid = data.get('characteristic_uuid')
@@ -153,17 +168,70 @@ def send_data():
     if not all([service_uuid, characteristic_uuid, text_data]):
         return jsonify({'status': 'error', 'message': '缺少必要参数'}), 400
 
-    if not connected_client or not connected_client.is_connected:
+    if not ble_worker.is_connected:
         return jsonify({'status': 'error', 'message': '设备未连接'}), 400
 
-    # 在单独的线程中发送数据
-    send_thread = threading.Thread(
-        target=run_send_data,
-        args=(service_uuid, characteristic_uuid, text_data, data_format)
-    )
-    send_thread.start()
-
-    return jsonify({'status': 'success', 'message': '正在发送数据'})
+    error = run_send_data(service_uuid, characteristic_uuid, text_data, data_format)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    return jsonify({'status': 'success', 'message': '数据已发送'})
+
+
+# 解析 SSE 的 Last-Event-ID（"epoch;特征UUID:序号,..."），用于断线重连后继续读取
+# epoch 与当前不同说明服务器重启过，旧的序号没有意义，从缓冲区中最早的通知开始
+def parse_stream_cursor(value):
+    cursors = {}
+    epoch, _, value = value.partition(';')
+    if epoch != notification_stream.epoch:
+        return cursors
+    for item in value.split(','):
+        uuid_part, _, seq = item.rpartition(':')
+        if uuid_part and seq.isdigit():
+            cursors[uuid_part] = int(seq)
+    return cursors
+
+
+# 以 Server-Sent Events 推送通知
+@app.route('/notifications/stream')
+def notification_events():
+    last_event_id = request.headers.get('Last-Event-ID')
+    # 新连接从当前位置开始，重连时从上次收到的位置继续
+    cursors = parse_stream_cursor(last_event_id) if last_event_id else notification_stream.cursor()
+
+    def generate():
+        yield 'retry: 2000\n\n'
+        while True:
+            packets, dropped = notification_stream.read(cursors, STREAM_MAX_BATCH, STREAM_KEEPALIVE)
+            if not packets and not dropped:
+                yield ': keepalive\n\n'
+                continue
+            payload = {'packets': [], 'dropped': dropped}
+            for characteristic_uuid, seq, timestamp, data in packets:
+                try:
+                    text_data = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    text_data = None
+                payload['packets'].append({
+                    'characteristic': characteristic_uuid,
+                    'seq': seq,
+                    'timestamp': timestamp,
+                    'hex': data.hex(),
+                    'text': text_data
+                })
+            event_id = notification_stream.epoch + ';' + ','.join(f'{key}:{value}' for key, value in cursors.items())
+            # 客户端读得慢时 yield 会阻塞在发送上，期间的通知留在环形缓冲区里，覆盖的部分下次计入 dropped
+            yield f'id: {event_id}\nevent: notifications\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+            time.sleep(STREAM_BATCH_INTERVAL)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# 通知统计
+@app.route('/notifications/stats')
+def notification_stats():
+    return jsonify({'status': 'success', 'stats': notification_stream.stats()})
 
 
 # 健康检查端点
@@ -215,51 +283,43 @@ def run_scan():
         is_scanning = False
 
 
-# 异步运行连接的函数
+# 以下 run_* 函数在请求线程中调用，把操作交给 BLE 工作线程并等待完成，成功返回 None，失败返回错误信息
+
+# 连接设备
 def run_connect(device_address):
-    global connected_device, connected_client
+    global connected_device, device_services
 
     try:
-        # 创建客户端并连接
-        connected_client = BleakClient(device_address)
-        asyncio.run(connected_client.connect())
+        ble_worker.connect(device_address, timeout=CONNECT_TIMEOUT)
         connected_device = device_address
+        device_services = []
         logger.info(f"成功连接到设备: {device_address}")
     except Exception as e:
-        logger.error(f"连接设备时出错: {str(e)}")
-        connected_client = None
+        # 超时等异常的 str() 为空，退回异常类型名
+        error = str(e) or type(e).__name__
+        logger.error(f"连接设备时出错: {error}")
         connected_device = None
+        return error
 
 
-# 异步运行断开连接的函数
+# 断开连接
 def run_disconnect():
-    global connected_device, connected_client
-
     try:
-        if connected_client and connected_client.is_connected:
-            asyncio.run(connected_client.disconnect())
+        if ble_worker.disconnect(timeout=OPERATION_TIMEOUT):
             logger.info("设备已断开连接")
         else:
             logger.warning("没有连接的设备")
     except Exception as e:
         logger.error(f"断开连接时出错: {str(e)}")
-    finally:
-        connected_client = None
-        connected_device = None
-        device_services = []  # 清空服务信息
+        return str(e) or type(e).__name__
 
 
-# 异步获取服务信息
+# 获取服务信息（连接时已完成服务发现）
 def run_get_services():
-    global connected_client
+    global device_services
 
     try:
-        # 等待一段时间确保服务发现完成
-        import time
-        time.sleep(2)
-
-        # 直接访问已发现的服务
-        services = connected_client.services
+        services = ble_worker.services(timeout=OPERATION_TIMEOUT)
 
         services_data = []
         for service in services:
@@ -278,7 +338,6 @@ def run_get_services():
             services_data.append(service_info)
 
         # 将服务信息保存到全局变量，供后续使用
-        global device_services
         device_services = services_data
 
         logger.info(f"获取到 {len(services_data)} 个服务")
@@ -288,12 +347,11 @@ def run_get_services():
                 logger.info(f"  特征: {char['uuid']}, 属性: {char['properties']}")
     except Exception as e:
         logger.error(f"获取服务信息时出错: {str(e)}")
+        return str(e) or type(e).__name__
 
 
-# 异步发送数据
+# 发送数据
 def run_send_data(service_uuid, characteristic_uuid, text_data, data_format):
-    global connected_client
-
     try:
         # 根据格式转换数据
         if data_format == 'hex':
@@ -302,44 +360,30 @@ def run_send_data(service_uuid, characteristic_uuid, text_data, data_format):
         else:
             # 将文本转换为UTF-8字节
             byte_data = text_data.encode('utf-8')
-
-        # 发送数据
-        asyncio.run(connected_client.write_gatt_char(characteristic_uuid, byte_data))
-        logger.info(f"成功发送数据到特征 {characteristic_uuid}")
     except ValueError as e:
         logger.error(f"数据格式错误: {str(e)}")
+        return f"数据格式错误: {str(e)}"
+
+    try:
+        ble_worker.write(characteristic_uuid, byte_data, timeout=OPERATION_TIMEOUT)
+        logger.info(f"成功发送数据到特征 {characteristic_uuid}")
     except Exception as e:
         logger.error(f"发送数据时出错: {str(e)}")
+        return f"发送数据时出错: {str(e) or type(e).__name__}"
 
 
-# 异步启动通知
+# 启动通知；通知在断开连接前一直有效
 def run_start_notifications(characteristic_uuid):
-    global connected_client
-
     try:
         def notification_handler(sender, data):
-            # 在单独的线程中处理通知，避免阻塞
-            threading.Thread(target=handle_notification, args=(sender, data)).start()
+            # 在 BLE 工作线程中调用，只写入环形缓冲区，由 SSE 连接推送给页面
+            notification_stream.publish(characteristic_uuid, data)
 
-        asyncio.run(connected_client.start_notify(characteristic_uuid, notification_handler))
+        ble_worker.start_notify(characteristic_uuid, notification_handler, timeout=OPERATION_TIMEOUT)
         logger.info(f"已启动对特征 {characteristic_uuid} 的通知监听")
     except Exception as e:
         logger.error(f"启动通知时出错: {str(e)}")
-
-
-# 处理通知数据
-def handle_notification(sender, data):
-    try:
-        # 尝试解码为UTF-8文本
-        try:
-            text_data = data.decode('utf-8')
-            logger.info(f"收到来自特征 {sender} 的通知: {text_data}")
-        except UnicodeDecodeError:
-            # 如果无法解码为文本，则以十六进制显示
-            hex_data = data.hex()
-            logger.info(f"收到来自特征 {sender} 的通知 (hex): {hex_data}")
-    except Exception as e:
-        logger.error(f"处理通知数据时出错: {str(e)}")
+        return str(e) or type(e).__name__
 
 
 if __name__ == '__main__':
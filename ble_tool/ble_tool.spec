@@ -12,6 +12,8 @@ a = Analysis(
     datas=[
         ('templates', 'templates'),
         ('app.py', '.'),
+        ('ble_worker.py', '.'),
+        ('notification_stream.py', '.'),
     ],
     hiddenimports=[
         'win32gui',
@@ -22,6 +24,8 @@ a = Analysis(
         'pywebview',
         'pywebview.platforms',
         'pywebview.platforms.winforms',
+        'ble_worker',
+        'notification_stream',
         'flask',
         'bleak',
         'jinja2',
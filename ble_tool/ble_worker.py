@@ -0,0 +1,187 @@
+"""BLE 工作线程
+
+所有 BLE 操作都在同一个后台线程的同一个事件循环中执行。
+BleakClient 绑定在连接时的事件循环上，每次操作都 asyncio.run 一个新的事件循环既有额外开销，
+通知回调也会随着 asyncio.run 返回而失效；这里事件循环和客户端一直存在，直到 stop()。
+
+Flask 处理函数通过 submit() 把协程函数放入命令队列，得到 concurrent.futures.Future，
+或用 call() 直接等待结果。命令按提交顺序逐个执行，同一时刻只有一个 GATT 操作在进行。
+通知回调和断开回调都在工作线程中调用，不能阻塞。
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from bleak import BleakClient
+
+logger = logging.getLogger(__name__)
+
+
+class NotConnectedError(Exception):
+    pass
+
+
+class BleWorker:
+    def __init__(self, on_disconnect=None):
+        # on_disconnect(address)：设备断开（包括设备主动断开）后在工作线程中调用
+        self.on_disconnect = on_disconnect
+        self.client = None
+        self.address = None
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        """启动工作线程（已启动时直接返回）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name='ble-worker', daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout=10):
+        """断开设备并结束工作线程"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self.call(self._disconnect, timeout=timeout)
+        except Exception as e:
+            logger.error(f"停止 BLE 工作线程时断开连接出错: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        thread.join(timeout)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        dispatcher = loop.create_task(self._dispatch())
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            dispatcher.cancel()
+            loop.run_until_complete(asyncio.gather(dispatcher, return_exceptions=True))
+            loop.close()
+
+    async def _dispatch(self):
+        """依次执行命令队列中的命令，把结果或异常交给对应的 Future"""
+        while True:
+            func, args, future = await self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = await func(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, func, *args):
+        """把协程函数 func(*args) 放入命令队列，返回 concurrent.futures.Future"""
+        self.start()
+        future = concurrent.futures.Future()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (func, args, future))
+        return future
+
+    def call(self, func, *args, timeout=None):
+        """提交命令并等待结果；超时后尚未开始执行的命令会被取消，已开始的会继续执行完"""
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    @property
+    def is_connected(self):
+        client = self.client
+        return client is not None and client.is_connected
+
+    def _require_client(self):
+        if not self.is_connected:
+            raise NotConnectedError('设备未连接')
+        return self.client
+
+    def _on_disconnected(self, client):
+        if client is not self.client:
+            return
+        address = self.address
+        self.client = None
+        self.address = None
+        logger.info(f"设备已断开: {address}")
+        if self.on_disconnect is not None:
+            self.on_disconnect(address)
+
+    async def _connect(self, address):
+        if self.client is not None:
+            if self.client.is_connected and self.address == address:
+                return
+            await self._disconnect()
+        client = BleakClient(address, disconnected_callback=self._on_disconnected)
+        await client.connect()
+        self.client = client
+        self.address = address
+
+    async def _disconnect(self):
+        client = self.client
+        if client is None:
+            return False
+        try:
+            if client.is_connected:
+                await client.disconnect()
+        finally:
+            # 断开回调可能已经清理过
+            if self.client is client:
+                self._on_disconnected(client)
+        return True
+
+    async def _write(self, characteristic_uuid, data):
+        await self._require_client().write_gatt_char(characteristic_uuid, data)
+
+    async def _start_notify(self, characteristic_uuid, callback):
+        await self._require_client().start_notify(characteristic_uuid, callback)
+
+    async def _stop_notify(self, characteristic_uuid):
+        await self._require_client().stop_notify(characteristic_uuid)
+
+    async def _services(self):
+        return self._require_client().services
+
+    def connect(self, address, timeout=None):
+        """连接设备；已连接其他设备时先断开
+
+        超时时连接可能仍在工作线程中进行，稍后才连上；这里随即排入一个断开命令，
+        它在连接命令之后执行，保证调用方认为连接失败时设备最终也处于未连接状态。
+        """
+        future = self.submit(self._connect, address)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                self.submit(self._disconnect)
+            raise
+
+    def disconnect(self, timeout=None):
+        """断开当前设备，没有连接的设备时返回 False"""
+        return self.call(self._disconnect, timeout=timeout)
+
+    def write(self, characteristic_uuid, data, timeout=None):
+        return self.call(self._write, characteristic_uuid, data, timeout=timeout)
+
+    def start_notify(self, characteristic_uuid, callback, timeout=None):
+        """启动通知，callback(sender, data) 在工作线程中调用，直到断开或 stop_notify"""
+        return self.call(self._start_notify, characteristic_uuid, callback, timeout=timeout)
+
+    def stop_notify(self, characteristic_uuid, timeout=None):
+        return self.call(self._stop_notify, characteristic_uuid, timeout=timeout)
+
+    def services(self, timeout=None):
+        """已发现的服务（BleakGATTServiceCollection），连接时已完成服务发现"""
+        return self.call(self._services, timeout=timeout)
@@ -0,0 +1,99 @@
+"""BLE 通知的环形缓冲区
+
+通知回调（在 BLE 工作线程中）调用 publish()，只做一次加锁追加，不创建线程、不做 IO。
+每个特征一个固定容量的环形缓冲区，每条通知带该特征内递增的序号和收到时的时间戳，
+缓冲区满时覆盖最旧的通知，内存占用与通知频率和读取者数量无关。
+
+读取者（SSE 连接）各自记录每个特征读到的序号，read() 返回之后的通知；
+读取者跟不上时（例如浏览器网络慢，发送阻塞），被覆盖的通知按特征计入 dropped，
+而不是在服务器上为它无限排队。
+另有一个跨特征的全局到达序号，合并多个特征的通知时按它排序（time.time() 可能回拨，不用于排序）。
+每个实例有随机的 epoch，读取者保存的位置来自另一个实例（服务器重启）时应从头读取。
+"""
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class NotificationStream:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.epoch = uuid.uuid4().hex[:12]
+        # 特征 UUID -> deque[(seq, order, timestamp, data)]
+        self._buffers = {}
+        # 特征 UUID -> 最新序号
+        self._seq = {}
+        # 所有特征共用的到达序号
+        self._order = 0
+        self._condition = threading.Condition()
+        self.received = 0
+        self.overwritten = 0
+
+    def publish(self, characteristic_uuid, data):
+        """记录一条通知（通知回调中调用，不阻塞）"""
+        with self._condition:
+            buffer = self._buffers.get(characteristic_uuid)
+            if buffer is None:
+                buffer = self._buffers[characteristic_uuid] = deque(maxlen=self.capacity)
+            if len(buffer) == self.capacity:
+                self.overwritten += 1
+            seq = self._seq.get(characteristic_uuid, 0) + 1
+            self._seq[characteristic_uuid] = seq
+            self._order += 1
+            buffer.append((seq, self._order, time.time(), bytes(data)))
+            self.received += 1
+            self._condition.notify_all()
+
+    def cursor(self):
+        """当前各特征的最新序号，从此刻开始读取时使用"""
+        with self._condition:
+            return dict(self._seq)
+
+    def _pending(self, cursors):
+        # 比当前最新序号还大的位置来自之前的实例或已失效，视为 0，否则会一直等不到新通知
+        for char_uuid, last in list(cursors.items()):
+            if last > self._seq.get(char_uuid, 0):
+                cursors[char_uuid] = 0
+        return any(seq > cursors.get(char_uuid, 0) for char_uuid, seq in self._seq.items())
+
+    def read(self, cursors, max_packets=256, timeout=None):
+        """等待并返回 cursors 之后的通知
+
+        cursors 为 {特征 UUID: 已读到的序号}，会被原地更新；大于该特征当前最新序号的位置按 0 处理。
+        返回 (packets, dropped)：packets 为 [(特征 UUID, seq, timestamp, data)]，按到达顺序排列，最多 max_packets 条；
+        dropped 为 {特征 UUID: 被覆盖而未读到的条数}。超时时两者都为空。
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending(cursors), timeout):
+                return [], {}
+            packets = []
+            dropped = {}
+            for char_uuid, buffer in self._buffers.items():
+                last = cursors.get(char_uuid, 0)
+                if not buffer or buffer[-1][0] <= last:
+                    continue
+                oldest = buffer[0][0]
+                if oldest > last + 1:
+                    dropped[char_uuid] = oldest - last - 1
+                # 序号连续，可直接算出第一条未读通知的位置
+                start = max(last + 1 - oldest, 0)
+                packets.extend((order, char_uuid, seq, timestamp, data)
+                               for seq, order, timestamp, data in itertools.islice(buffer, start, None))
+            packets.sort(key=lambda packet: packet[0])
+            packets = [packet[1:] for packet in packets[:max_packets]]
+            for char_uuid in dropped:
+                cursors[char_uuid] = max(cursors.get(char_uuid, 0), self._buffers[char_uuid][0][0] - 1)
+            for char_uuid, seq, _, _ in packets:
+                cursors[char_uuid] = max(cursors.get(char_uuid, 0), seq)
+            return packets, dropped
+
+    def stats(self):
+        with self._condition:
+            return {
+                'received': self.received,
+                'overwritten': self.overwritten,
+                'buffered': {uuid: len(buffer) for uuid, buffer in self._buffers.items()},
+                'capacity': self.capacity,
+            }
@@ -0,0 +1,332 @@
+"""内容寻址的去重存储
+
+共享文件夹中内容相同的文件只在存储目录中保存一份（以 SHA-256 命名的 blob），
+目录树中的文件通过硬链接或 reflink 指向它：
+  hardlink  与 blob 共享 inode，不占额外空间；blob 设为只读，防止原地修改波及所有副本
+  reflink   写时复制克隆（btrfs/xfs 等），各副本可独立修改
+  auto      优先 reflink，文件系统不支持时退回 hardlink
+
+引用关系保存在 SQLite 中（相对路径 -> 摘要），blob 的引用计数就是引用它的路径数，
+计数降为 0 时删除 blob。删除、重命名通过 fs_events 保持引用正确；
+文件在存储之外被覆盖时（inode 或修改时间变化）其引用会被释放。
+
+存储目录必须与共享文件夹在同一文件系统上，否则无法建立链接，文件保持原样。
+"""
+import errno
+import hashlib
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，只能使用硬链接
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# linux/fs.h: FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+LINK_MODES = ('auto', 'hardlink', 'reflink')
+
+# 查询某个目录下的所有引用，参数由 _like_prefix 生成
+_SELECT_CHILDREN = "SELECT path FROM refs WHERE path LIKE ? ESCAPE '\\'"
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def reflink(src, dst):
+    """用 FICLONE 把 src 克隆到新文件 dst，不支持时抛出 OSError"""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+class ContentStore:
+    def __init__(self, share_root, store_root, link_mode='auto'):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f'未知的链接方式: {link_mode}')
+        self.share_root = os.path.abspath(share_root)
+        self.store_root = os.path.abspath(store_root)
+        self.link_mode = link_mode
+        self._reflink_supported = link_mode != 'hardlink' and fcntl is not None
+        self._lock = threading.RLock()
+        self._dedup_thread = None
+        self.dedup_progress = {}
+        os.makedirs(os.path.join(self.store_root, 'blobs'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.store_root, 'refs.sqlite3'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS refs ('
+                         'path TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'ino INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, mode TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS refs_digest ON refs(digest)')
+        self._db.commit()
+
+    # 路径与 blob
+
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.share_root).replace(os.sep, '/')
+
+    def _absolute(self, relative_path):
+        return os.path.join(self.share_root, *relative_path.split('/'))
+
+    def blob_path(self, digest):
+        return os.path.join(self.store_root, 'blobs', digest[:2], digest)
+
+    def _tmp_path(self, directory):
+        return os.path.join(directory, f'.cas-{uuid.uuid4().hex}.tmp')
+
+    # 入库
+
+    def ingest(self, path, digest=None):
+        """让 path 指向内容相同的 blob，必要时先把它存为新 blob；返回是否成功
+
+        digest 为文件的 SHA-256（十六进制），上传时已在线计算好的可直接传入，省去再读一遍。
+        """
+        path = os.path.abspath(path)
+        if digest is None:
+            digest = hash_file(path)
+        blob = self.blob_path(digest)
+        with self._lock:
+            try:
+                mode = self._link(path, blob)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    logger.warning(f"文件 {path} 去重失败: {e}")
+                return False
+            st = os.stat(path)
+            relative_path = self._relative(path)
+            old = self._db.execute('SELECT digest FROM refs WHERE path = ?', (relative_path,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?, ?)',
+                             (relative_path, digest, st.st_size, st.st_ino, st.st_mtime_ns, mode))
+            if old is not None and old[0] != digest:
+                self._release_blob_if_unused(old[0])
+            self._db.commit()
+        return True
+
+    def _link(self, path, blob):
+        """确保 blob 存在并让 path 指向它，返回实际使用的链接方式"""
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if self._reflink_supported:
+            try:
+                if not os.path.exists(blob):
+                    tmp = self._tmp_path(os.path.dirname(blob))
+                    reflink(path, tmp)
+                    os.replace(tmp, blob)
+                else:
+                    tmp = self._tmp_path(os.path.dirname(path))
+                    reflink(blob, tmp)
+                    os.replace(tmp, path)
+                return 'reflink'
+            except OSError as e:
+                if self.link_mode == 'reflink':
+                    raise
+                if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS):
+                    # 文件系统不支持 reflink，之后直接使用硬链接
+                    self._reflink_supported = False
+                else:
+                    raise
+
+        if not os.path.exists(blob):
+            try:
+                os.link(path, blob)
+            except FileExistsError:
+                pass
+            # 硬链接共享 inode，设为只读避免通过任一路径原地修改所有副本
+            os.chmod(blob, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        if os.stat(blob).st_ino != os.stat(path).st_ino:
+            tmp = self._tmp_path(os.path.dirname(path))
+            os.link(blob, tmp)
+            os.replace(tmp, path)
+        return 'hardlink'
+
+    # 引用维护
+
+    def _release(self, relative_path):
+        """删除一条引用，blob 不再被引用时删除 blob；调用方持有锁"""
+        row = self._db.execute('SELECT digest FROM refs WHERE path = ?', (relative_path,)).fetchone()
+        if row is None:
+            return
+        self._db.execute('DELETE FROM refs WHERE path = ?', (relative_path,))
+        self._release_blob_if_unused(row[0])
+
+    def _release_blob_if_unused(self, digest):
+        if self._db.execute('SELECT 1 FROM refs WHERE digest = ? LIMIT 1', (digest,)).fetchone() is None:
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _is_current(self, relative_path):
+        """引用记录是否仍与磁盘上的文件一致"""
+        row = self._db.execute('SELECT ino, mtime_ns FROM refs WHERE path = ?', (relative_path,)).fetchone()
+        if row is None:
+            return False
+        try:
+            st = os.stat(self._absolute(relative_path))
+        except OSError:
+            return False
+        return (st.st_ino, st.st_mtime_ns) == tuple(row)
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调"""
+        relative_path = self._relative(path)
+        if relative_path.startswith('..'):
+            return
+        with self._lock:
+            if event == 'deleted':
+                self._release(relative_path)
+                for (child,) in self._db.execute(_SELECT_CHILDREN, (_like_prefix(relative_path),)).fetchall():
+                    self._release(child)
+            elif event == 'renamed':
+                self._rename(relative_path, self._relative(dest_path))
+            elif event in ('created', 'modified'):
+                # 被新内容覆盖的文件不再指向原 blob
+                if not self._is_current(relative_path):
+                    self._release(relative_path)
+            self._db.commit()
+
+    def _rename(self, src, dst):
+        if src == dst:
+            return
+        self._release(dst)
+        for (child,) in self._db.execute(_SELECT_CHILDREN, (_like_prefix(dst),)).fetchall():
+            self._release(child)
+        self._db.execute('UPDATE refs SET path = ? WHERE path = ?', (dst, src))
+        for (child,) in self._db.execute(_SELECT_CHILDREN, (_like_prefix(src),)).fetchall():
+            self._db.execute('UPDATE refs SET path = ? WHERE path = ?', (dst + child[len(src):], child))
+
+    # 统计与后台去重
+
+    def stats(self):
+        with self._lock:
+            refs, logical = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM refs').fetchone()
+            blobs, physical = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size '
+                'FROM refs GROUP BY digest)').fetchone()
+        return {
+            'refs': refs,
+            'blobs': blobs,
+            'logical_bytes': logical,
+            'stored_bytes': physical,
+            'saved_bytes': logical - physical,
+            'dedup_running': self.dedup_running(),
+            'dedup_progress': dict(self.dedup_progress),
+        }
+
+    def dedup_running(self):
+        return self._dedup_thread is not None and self._dedup_thread.is_alive()
+
+    def start_dedup(self, exclude=()):
+        """在后台线程中对整个共享文件夹去重，已在运行时返回 False"""
+        with self._lock:
+            if self.dedup_running():
+                return False
+            self._dedup_thread = threading.Thread(target=self._safe_dedup, args=(exclude,),
+                                                  name='cas-dedup', daemon=True)
+            self._dedup_thread.start()
+            return True
+
+    def _safe_dedup(self, exclude):
+        try:
+            self.dedup_tree(exclude)
+        except Exception:
+            logger.exception("后台去重失败")
+
+    def dedup_tree(self, exclude=()):
+        """对已有文件去重
+
+        先清理失效引用和无引用的 blob；再按大小分组，只有与其他文件或已有 blob 大小相同的文件才需要计算摘要。
+        exclude 为不参与去重的绝对路径前缀（如上传会话目录）。
+        """
+        progress = self.dedup_progress
+        progress.clear()
+        progress.update({'scanned': 0, 'hashed': 0, 'linked': 0, 'released': 0})
+        exclude = tuple(os.path.abspath(p) for p in exclude) + (self.store_root,)
+
+        with self._lock:
+            for (relative_path,) in self._db.execute('SELECT path FROM refs').fetchall():
+                if not self._is_current(relative_path):
+                    self._release(relative_path)
+                    progress['released'] += 1
+            self._db.commit()
+            known = {path for (path,) in self._db.execute('SELECT path FROM refs')}
+            blob_sizes = {size for (size,) in self._db.execute('SELECT DISTINCT size FROM refs')}
+        self._sweep_orphan_blobs()
+
+        by_size = {}
+        for directory, dirnames, filenames in os.walk(self.share_root):
+            dirnames[:] = [d for d in dirnames if not os.path.join(directory, d).startswith(exclude)]
+            for name in filenames:
+                path = os.path.join(directory, name)
+                if name.startswith(('.upload-', '.cas-', '.batch-')) or self._relative(path) in known:
+                    continue
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                    continue
+                by_size.setdefault(st.st_size, []).append(path)
+                progress['scanned'] += 1
+
+        for size, paths in by_size.items():
+            if len(paths) < 2 and size not in blob_sizes:
+                continue
+            for path in paths:
+                try:
+                    digest = hash_file(path)
+                    progress['hashed'] += 1
+                    if self.ingest(path, digest):
+                        progress['linked'] += 1
+                except OSError as e:
+                    logger.warning(f"去重时跳过 {path}: {e}")
+        logger.info(f"去重完成: {progress}")
+        return progress
+
+    def _sweep_orphan_blobs(self):
+        blobs_root = os.path.join(self.store_root, 'blobs')
+        for directory, _dirnames, filenames in os.walk(blobs_root):
+            for digest in filenames:
+                with self._lock:
+                    used = self._db.execute('SELECT 1 FROM refs WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+                    if used is None:
+                        try:
+                            os.remove(os.path.join(directory, digest))
+                        except OSError:
+                            pass
+
+
+def _like_prefix(relative_path):
+    escaped = relative_path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='对共享文件夹中已有的重复文件去重')
+    parser.add_argument('share_root', help='共享文件夹')
+    parser.add_argument('store_root', help='存储目录，须与共享文件夹在同一文件系统上')
+    parser.add_argument('--link-mode', default='auto', choices=LINK_MODES)
+    args = parser.parse_args()
+    result = ContentStore(args.share_root, args.store_root, args.link_mode).dedup_tree()
+    print(result)
@@ -0,0 +1,308 @@
+"""响应压缩：内容协商、流式编码器和预压缩旁路缓存
+
+  - 根据 Accept-Encoding（含 q 值）在 zstd、br、gzip 中选择编码；
+    gzip 总是可用，br、zstd 分别需要安装 brotli、zstandard 库
+  - 只压缩文本类 MIME 类型，图片、压缩包等已压缩的内容原样发送
+  - 热点文件在后台压缩一次存入旁路缓存目录，键中包含源文件大小和修改时间，
+    源文件变化后自然失效；缓存按总大小 LRU 淘汰。命中缓存的编码响应本身就是普通文件，
+    可以走 sendfile，也能正确处理范围请求（范围针对编码后的字节）
+  - 未命中缓存时在线流式压缩，此时无法支持范围请求，调用方应退回原始内容
+"""
+import hashlib
+import logging
+import os
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 256 * 1024
+
+# 除 text/* 外可压缩的 MIME 类型
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'application/x-ndjson', 'application/sql', 'application/x-sh', 'application/x-yaml',
+    'application/yaml', 'application/toml', 'image/svg+xml', 'application/rtf',
+}
+# mimetypes 识别不了、但通常是文本的扩展名
+COMPRESSIBLE_EXTENSIONS = {'log', 'csv', 'tsv', 'md', 'ini', 'cfg', 'conf', 'yml', 'yaml', 'toml', 'jsonl', 'ndjson'}
+
+# 同为最高 q 值时的优先顺序
+PREFERENCE = ('zstd', 'br', 'gzip')
+
+# 后缀用于区分不同编码的 ETag
+ETAG_SUFFIXES = {'gzip': 'gz', 'br': 'br', 'zstd': 'zst'}
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+# 编码 -> (编码器, 在线压缩级别, 预压缩级别)；在线压缩要快，预压缩只做一次可以慢一些
+ENCODERS = {'gzip': (_GzipEncoder, 6, 9)}
+if brotli is not None:
+    ENCODERS['br'] = (_BrotliEncoder, 4, 9)
+if zstandard is not None:
+    ENCODERS['zstd'] = (_ZstdEncoder, 3, 15)
+
+
+def make_encoder(encoding, precompress=False):
+    encoder, online_level, offline_level = ENCODERS[encoding]
+    return encoder(offline_level if precompress else online_level)
+
+
+def is_compressible(mimetype, filename):
+    if mimetype and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+                     or mimetype.endswith(('+json', '+xml'))):
+        return True
+    return filename.rsplit('.', 1)[-1].lower() in COMPRESSIBLE_EXTENSIONS if '.' in filename else False
+
+
+def negotiate(accept_encoding, encodings=None):
+    """按 Accept-Encoding 选择编码，没有可用编码时返回 None（即 identity）"""
+    if not accept_encoding:
+        return None
+    encodings = ENCODERS if encodings is None else encodings
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name == 'x-gzip':
+            name = 'gzip'
+        weights[name] = q
+
+    best = None
+    best_q = 0.0
+    for name in PREFERENCE:
+        if name not in encodings:
+            continue
+        q = weights.get(name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def encoded_etag(etag, encoding):
+    """给某种编码的表示生成独立的 ETag"""
+    if etag is None or encoding is None:
+        return etag
+    return f'{etag[:-1]}-{ETAG_SUFFIXES[encoding]}"'
+
+
+def compress_chunks(chunks, encoding):
+    """流式压缩字节块迭代器"""
+    encoder = make_encoder(encoding)
+    for chunk in chunks:
+        data = encoder.compress(chunk)
+        if data:
+            yield data
+    tail = encoder.finish()
+    if tail:
+        yield tail
+
+
+def compress_bytes(data, encoding):
+    encoder = make_encoder(encoding)
+    return encoder.compress(data) + encoder.finish()
+
+
+def compress_file_chunks(path, encoding):
+    """在线压缩整个文件，逐块产生压缩数据"""
+    def read():
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                yield block
+    return compress_chunks(read(), encoding)
+
+
+class PrecompressedCache:
+    """磁盘上的预压缩变体缓存
+
+    文件名为 <源路径的sha1>-<大小>-<修改时间ns>.<编码>，同一源文件的旧变体在生成新变体时删除。
+    """
+
+    def __init__(self, cache_root, max_bytes=1024 ** 3, max_file_size=256 * 1024 ** 2, workers=2):
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self._entries = OrderedDict()  # 文件名 -> 大小，按最近使用排序
+        self._total = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='precompress')
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+        self.evicted = 0
+        os.makedirs(cache_root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """启动时按修改时间恢复 LRU 顺序，清掉上次残留的临时文件"""
+        entries = []
+        for name in os.listdir(self.cache_root):
+            path = os.path.join(self.cache_root, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _mtime, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _prefix(source_path):
+        return hashlib.sha1(os.path.abspath(source_path).encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _name(self, source_path, st, encoding):
+        return f'{self._prefix(source_path)}-{st.st_size:x}-{st.st_mtime_ns:x}.{encoding}'
+
+    def lookup(self, source_path, st, encoding, build=True):
+        """返回 (变体路径, 变体大小)，没有缓存时返回 None 并（按需）在后台生成"""
+        name = self._name(source_path, st, encoding)
+        with self._lock:
+            size = self._entries.get(name)
+            if size is not None:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return os.path.join(self.cache_root, name), size
+            self.misses += 1
+            if not build or st.st_size > self.max_file_size or name in self._pending:
+                return None
+            self._pending.add(name)
+        self._executor.submit(self._build, source_path, st, encoding, name)
+        return None
+
+    def _build(self, source_path, st, encoding, name):
+        tmp = os.path.join(self.cache_root, f'{uuid.uuid4().hex}.tmp')
+        try:
+            encoder = make_encoder(encoding, precompress=True)
+            with open(source_path, 'rb') as src, open(tmp, 'wb') as dst:
+                for block in iter(lambda: src.read(READ_SIZE), b''):
+                    dst.write(encoder.compress(block))
+                dst.write(encoder.finish())
+            # 压缩期间源文件被修改，结果作废
+            now = os.stat(source_path)
+            if (now.st_size, now.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                os.remove(tmp)
+                return
+            size = os.path.getsize(tmp)
+            os.replace(tmp, os.path.join(self.cache_root, name))
+            with self._lock:
+                self._drop_other_variants(name)
+                self._entries[name] = size
+                self._total += size
+                self.built += 1
+                self._evict()
+        except Exception:
+            logger.exception(f"预压缩 {source_path} 失败")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def _drop_other_variants(self, name):
+        """删除同一源文件的过时变体（其他大小/修改时间），同一版本的其他编码保留"""
+        prefix, version = name.split('-', 1)
+        version = version.rsplit('.', 1)[0]
+        for other in [n for n in self._entries if n.startswith(prefix + '-')]:
+            if other.split('-', 1)[1].rsplit('.', 1)[0] != version:
+                self._remove(other)
+
+    def _remove(self, name):
+        size = self._entries.pop(name, None)
+        if size is None:
+            return
+        self._total -= size
+        try:
+            os.remove(os.path.join(self.cache_root, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and self._total > self.max_bytes:
+            name = next(iter(self._entries))
+            self._remove(name)
+            self.evicted += 1
+
+    def invalidate(self, source_path):
+        """删除某个源文件的所有变体"""
+        prefix = self._prefix(source_path) + '-'
+        with self._lock:
+            for name in [n for n in self._entries if n.startswith(prefix)]:
+                self._remove(name)
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：删除、改名、覆盖后尽早释放过时变体占用的空间"""
+        self.invalidate(path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'built': self.built,
+                'evicted': self.evicted,
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'encodings': sorted(ENCODERS),
+            }
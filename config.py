@@ -0,0 +1,99 @@
+"""服务器配置
+
+所有配置集中在 ServerConfig 中，默认值适合在本机直接运行，
+部署时通过环境变量覆盖（变量名为 FILE_SERVER_ 加大写的字段名，例如 FILE_SERVER_PORT=8080）。
+
+  share_folder      共享文件夹
+  state_folder      上传会话、去重存储、压缩缓存等内部数据的存放目录（不对外共享），默认为代码目录下的 state/
+  host / port       监听地址和端口
+  secret_key        flash 消息等会话签名用的密钥；未设置时随机生成，重启后旧会话失效，
+                    多进程部署时由 serve.py 在主进程生成一次，所有工作进程共用
+  debug             开发服务器的调试模式，生产环境不要打开
+  workers           工作进程数
+  threads           每个工作进程处理请求的线程数
+  keepalive         keep-alive 连接两次请求之间的最长空闲秒数
+  timeout           请求超时秒数：读取请求、发送响应时单次等待客户端的最长时间
+  graceful_timeout  平滑重载/停止时等待正在处理的请求完成的最长秒数
+  backlog           监听队列长度
+"""
+import os
+import secrets
+
+ENV_PREFIX = 'FILE_SERVER_'
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _default_workers():
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def _parse_bool(value):
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f'无法识别的布尔值: {value}')
+
+
+class ServerConfig:
+    """服务器配置，字段见模块说明"""
+
+    # 字段名 -> 从环境变量字符串转换的函数
+    FIELDS = {
+        'share_folder': str,
+        'state_folder': str,
+        'host': str,
+        'port': int,
+        'secret_key': str,
+        'debug': _parse_bool,
+        'workers': int,
+        'threads': int,
+        'keepalive': float,
+        'timeout': float,
+        'graceful_timeout': float,
+        'backlog': int,
+    }
+
+    def __init__(self, share_folder=None, state_folder=None, host='0.0.0.0', port=12345, secret_key=None,
+                 debug=False, workers=None, threads=16, keepalive=5.0, timeout=60.0, graceful_timeout=30.0,
+                 backlog=2048):
+        self.share_folder = os.path.abspath(share_folder or os.path.join(BASE_DIR, 'file_storage'))
+        self.state_folder = os.path.abspath(state_folder or os.path.join(BASE_DIR, 'state'))
+        self.host = host
+        self.port = port
+        self.secret_key = secret_key or secrets.token_hex(32)
+        self.debug = debug
+        self.workers = workers or _default_workers()
+        self.threads = threads
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        if self.workers < 1 or self.threads < 1:
+            raise ValueError('workers 和 threads 必须大于 0')
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides):
+        """从环境变量读取配置，overrides 中不为 None 的值优先（用于命令行参数）"""
+        environ = os.environ if environ is None else environ
+        values = {}
+        for name, convert in cls.FIELDS.items():
+            raw = environ.get(ENV_PREFIX + name.upper())
+            if raw is None:
+                continue
+            try:
+                values[name] = convert(raw)
+            except ValueError:
+                raise ValueError(f'环境变量 {ENV_PREFIX + name.upper()} 的值无效: {raw!r}') from None
+        values.update({name: value for name, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    def to_env(self):
+        """转换为环境变量，子进程据此得到相同的配置"""
+        return {ENV_PREFIX + name.upper(): str(getattr(self, name)) for name in self.FIELDS}
+
+    def to_dict(self):
+        """配置内容，密钥除外"""
+        return {name: getattr(self, name) for name in self.FIELDS if name != 'secret_key'}
@@ -0,0 +1,123 @@
+"""增量同步的参考客户端
+
+把本地文件同步到服务器上的同名路径，只上传变化的块：
+
+    python delta_client.py http://127.0.0.1:5000 ./disk.img images/disk.img
+
+服务器上还没有该文件时上传整个文件（同样走增量接口，全部为新数据）。
+增量先写入临时文件（小于 64MB 时在内存中），再以固定长度的请求体上传。
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from delta_sync import VERSION, default_block_size, generate_delta, parse_signature
+
+READ_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+class SyncError(Exception):
+    pass
+
+
+def _connect(base_url):
+    parts = urllib.parse.urlsplit(base_url)
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.netloc, timeout=300), parts.path.rstrip('/')
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def sync(base_url, local_path, remote_path, block_size=None, search_window=None):
+    """同步一个文件，返回统计信息（各阶段耗时、上传的字节数等）"""
+    conn, prefix = _connect(base_url)
+    url = f"{prefix}/api/delta/{urllib.parse.quote(remote_path.lstrip('/'))}"
+    stats = {'size': os.path.getsize(local_path)}
+    try:
+        started = time.perf_counter()
+        conn.request('GET', url + (f'?block_size={block_size}' if block_size else ''))
+        response = conn.getresponse()
+        body = response.read()
+        if response.status == 200:
+            header, records = parse_signature(body)
+            base = {'size': header['size'], 'mtime_ns': header['mtime_ns']}
+        elif response.status == 404:
+            header = {'block_size': block_size or default_block_size(stats['size']), 'size': 0}
+            records, base = [], None
+        else:
+            raise SyncError(f'获取签名失败: {response.status} {body[:200]!r}')
+        stats['signature_bytes'] = len(body)
+        stats['signature_seconds'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sha256 = _file_sha256(local_path)
+        with tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE) as delta, open(local_path, 'rb') as f:
+            request_header = {'version': VERSION, 'block_size': header['block_size'], 'base': base,
+                              'size': stats['size'], 'sha256': sha256}
+            delta.write(json.dumps(request_header).encode() + b'\n')
+            if stats['size']:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    writer = generate_delta(data, (header, records), delta, search_window)
+            else:
+                writer = generate_delta(b'', (header, records), delta, search_window)
+            delta_size = delta.tell()
+            stats['delta_seconds'] = time.perf_counter() - started
+            stats['delta_bytes'] = delta_size
+            stats['copied_blocks'] = writer.copied_blocks
+            stats['literal_bytes'] = writer.literal_bytes
+
+            started = time.perf_counter()
+            delta.seek(0)
+            conn.putrequest('POST', url)
+            conn.putheader('Content-Type', 'application/octet-stream')
+            conn.putheader('Content-Length', str(delta_size))
+            conn.endheaders()
+            for chunk in iter(lambda: delta.read(READ_SIZE), b''):
+                conn.send(chunk)
+            response = conn.getresponse()
+            result = json.loads(response.read() or b'{}')
+            stats['upload_seconds'] = time.perf_counter() - started
+        if response.status != 200:
+            raise SyncError(f"上传增量失败: {response.status} {result.get('message')}")
+        stats['result'] = result
+        return stats
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把本地文件增量同步到文件服务器')
+    parser.add_argument('server', help='服务器地址，如 http://127.0.0.1:5000')
+    parser.add_argument('local_path')
+    parser.add_argument('remote_path', help='相对共享文件夹的路径')
+    parser.add_argument('--block-size', type=int, help='块大小，默认由服务器按文件大小选择')
+    parser.add_argument('--search-window', type=int, help='未命中时最多逐字节滚动的字节数，默认一个块')
+    args = parser.parse_args()
+    try:
+        stats = sync(args.server, args.local_path, args.remote_path, args.block_size, args.search_window)
+    except (SyncError, OSError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    sent = stats['delta_bytes'] + stats['signature_bytes']
+    print(f"文件 {stats['size']} 字节，传输 {sent} 字节（{sent / max(stats['size'], 1):.2%}），"
+          f"复制 {stats['copied_blocks']} 块，新数据 {stats['literal_bytes']} 字节")
+    print(f"签名 {stats['signature_seconds']:.2f}s，计算增量 {stats['delta_seconds']:.2f}s，"
+          f"上传 {stats['upload_seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+"""块级增量同步（rsync 式）
+
+流程：
+  1. 客户端取得服务器上旧版本的签名：文件按 block_size 分块，每块一个弱校验（Adler-32，可滚动计算）
+     和一个强校验（BLAKE2b-128）；签名按文件缓存在签名目录中，文件大小、修改时间、inode 不变时不再重新读取
+  2. 客户端在新版本上滚动计算弱校验，弱校验命中的位置再比较强校验，得到由"复制旧文件的第 i 块起 n 块"
+     和"新数据"组成的配方（generate_delta）
+  3. 客户端上传配方和新数据；服务器在旧文件所在目录的临时文件中按配方重建新版本（apply_delta），
+     校验大小和 SHA-256、确认旧文件在此期间没有被修改后，用 os.replace 原子替换，
+     同时顺便算出新版本的签名存入缓存，下一次同步不必重新读取
+
+签名格式：一行 JSON 头 {"version", "block_size", "size", "mtime_ns", "ino", "blocks"}，
+之后每块 20 字节（大端 4 字节弱校验 + 16 字节强校验）。缓存文件与接口返回的内容完全相同。
+
+增量格式：一行 JSON 头 {"version", "block_size", "base": {"size", "mtime_ns"} 或 null, "size", "sha256"}，
+之后是一串操作：
+  b'C' + 8 字节起始块号 + 8 字节块数    复制旧文件中连续的若干块
+  b'L' + 4 字节长度 + 数据              新数据
+  b'E'                                  结束
+"""
+import glob
+import hashlib
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+import upload_stream
+
+VERSION = 1
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
+# 重建时每次从请求体或旧文件读取的字节数
+READ_SIZE = 1024 * 1024
+# 客户端每条 L 记录的最大长度
+MAX_LITERAL = 1024 * 1024
+
+RECORD = struct.Struct('>I16s')
+COPY = struct.Struct('>QQ')
+LITERAL = struct.Struct('>I')
+
+ADLER_MOD = 65521
+
+
+class DeltaError(Exception):
+    """增量同步失败，status 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def default_block_size(size):
+    """约为文件大小的平方根，取 2 的幂：1GB 文件约 32KB 一块，签名约为文件大小的万分之六"""
+    if size <= MIN_BLOCK_SIZE ** 2:
+        return MIN_BLOCK_SIZE
+    return min(1 << math.ceil(math.log2(math.isqrt(size))), MAX_BLOCK_SIZE)
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class SignatureBuilder:
+    """按顺序喂入文件内容，按块计算签名"""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.records = []
+        self._pending = b''
+
+    def update(self, data):
+        if self._pending:
+            data = self._pending + bytes(data)
+            self._pending = b''
+        view = memoryview(data)
+        n = self.block_size
+        full = len(view) - len(view) % n
+        for offset in range(0, full, n):
+            block = view[offset:offset + n]
+            self.records.append(RECORD.pack(zlib.adler32(block), strong_checksum(block)))
+        self._pending = bytes(view[full:])
+
+    def finish(self, st):
+        if self._pending:
+            block = self._pending
+            self.records.append(RECORD.pack(zlib.adler32(block), strong_checksum(block)))
+            self._pending = b''
+        header = {'version': VERSION, 'block_size': self.block_size, 'size': st.st_size,
+                  'mtime_ns': st.st_mtime_ns, 'ino': st.st_ino, 'blocks': len(self.records)}
+        return json.dumps(header).encode() + b'\n' + b''.join(self.records)
+
+
+def compute_signature(path, block_size):
+    """读取整个文件计算签名；读取期间文件被修改时抛出 DeltaError"""
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        # 读取大小取块大小的整数倍，SignatureBuilder 不必拼接残余数据
+        read_size = max(READ_SIZE // block_size, 1) * block_size
+        builder = SignatureBuilder(block_size)
+        for data in iter(lambda: f.read(read_size), b''):
+            builder.update(data)
+        after = os.fstat(f.fileno())
+    if after.st_size != st.st_size or after.st_mtime_ns != st.st_mtime_ns:
+        raise DeltaError('文件在计算签名期间被修改，请重试', 409)
+    return builder.finish(st)
+
+
+def parse_signature(data):
+    """解析签名，返回 (头, [(弱校验, 强校验), ...])"""
+    line, _, body = data.partition(b'\n')
+    header = json.loads(line)
+    if header.get('version') != VERSION:
+        raise DeltaError('不支持的签名版本')
+    records = [RECORD.unpack_from(body, offset) for offset in range(0, len(body), RECORD.size)]
+    if len(records) != header['blocks']:
+        raise DeltaError('签名不完整')
+    return header, records
+
+
+class SignatureCache:
+    """签名的磁盘缓存，每个 (文件, 块大小) 一个文件；总大小超过 max_bytes 时删除最旧的"""
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _prefix(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(path).encode('utf-8', 'surrogateescape'))
+                            .hexdigest())
+
+    def _cache_path(self, path, block_size):
+        return f'{self._prefix(path)}-{block_size}.sig'
+
+    def _valid(self, cache_path, st):
+        try:
+            with open(cache_path, 'rb') as f:
+                header = json.loads(f.readline())
+        except (OSError, ValueError):
+            return False
+        return (header.get('version') == VERSION and header.get('size') == st.st_size
+                and header.get('mtime_ns') == st.st_mtime_ns and header.get('ino') == st.st_ino)
+
+    def get(self, path, block_size):
+        """返回与文件当前内容一致的签名缓存文件路径，没有时计算并写入"""
+        st = os.stat(path)
+        cache_path = self._cache_path(path, block_size)
+        if self._valid(cache_path, st):
+            with self._lock:
+                self.hits += 1
+            return cache_path
+        with self._lock:
+            self.misses += 1
+        self.store(path, compute_signature(path, block_size))
+        return cache_path
+
+    def store(self, path, signature):
+        """写入 path 的签名（签名头中的块大小决定缓存文件名）"""
+        header = json.loads(signature.partition(b'\n')[0])
+        cache_path = self._cache_path(path, header['block_size'])
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.sig-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(signature)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._trim()
+
+    def invalidate(self, path):
+        for cache_path in glob.glob(glob.escape(self._prefix(path)) + '-*.sig'):
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：删除、改名后释放空间；覆盖时旧签名按大小和修改时间自然失效，
+        不能在这里删除，否则会删掉 apply_delta 刚为新版本写入的签名"""
+        if event in ('deleted', 'renamed'):
+            self.invalidate(path)
+
+    def _trim(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.sig'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, cache_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(cache_path)
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# 服务器端：按配方重建
+
+def _read_exact(stream, size):
+    parts = []
+    while size > 0:
+        data = stream.read(min(size, READ_SIZE))
+        if not data:
+            raise DeltaError('请求体不完整')
+        parts.append(data)
+        size -= len(data)
+    return b''.join(parts)
+
+
+def _read_line(stream, limit=64 * 1024):
+    """逐字节读取一行（限速包装后的请求体没有 readline），头只有一两百字节"""
+    line = bytearray()
+    while len(line) < limit:
+        char = stream.read(1)
+        if not char:
+            break
+        line += char
+        if char == b'\n':
+            break
+    return bytes(line)
+
+
+def _read_header(stream):
+    line = _read_line(stream)
+    if not line.endswith(b'\n'):
+        raise DeltaError('缺少增量头')
+    try:
+        header = json.loads(line)
+    except ValueError:
+        raise DeltaError('增量头不是有效的JSON')
+    if not isinstance(header, dict) or header.get('version') != VERSION:
+        raise DeltaError('不支持的增量版本')
+    block_size, size, sha256 = header.get('block_size'), header.get('size'), header.get('sha256')
+    if not isinstance(block_size, int) or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise DeltaError('无效的块大小')
+    if not isinstance(size, int) or size < 0:
+        raise DeltaError('无效的文件大小')
+    if not isinstance(sha256, str) or len(sha256) != 64:
+        raise DeltaError('缺少新版本的 sha256')
+    return header
+
+
+def apply_delta(stream, target_path, fsync_policy='file'):
+    """从 stream 读取增量，在 target_path 旁重建新版本并原子替换
+
+    返回 (新版本的 SHA-256, 新版本的签名, 复制的字节数, 新数据的字节数)。
+    增量头中的 base 与 target_path 当前的大小、修改时间不一致时抛出 412；
+    base 为 null 表示新建文件，此时增量中只能有新数据。
+    """
+    header = _read_header(stream)
+    block_size, size, base = header['block_size'], header['size'], header.get('base')
+    target_dir = os.path.dirname(target_path)
+    if not os.path.isdir(target_dir):
+        raise DeltaError('目标目录不存在', 404)
+
+    base_file = None
+    if base is not None:
+        try:
+            base_file = open(target_path, 'rb')
+        except FileNotFoundError:
+            raise DeltaError('旧版本已不存在', 412)
+        except IsADirectoryError:
+            raise DeltaError('目标是目录', 409)
+    try:
+        if base_file is not None:
+            base_st = os.fstat(base_file.fileno())
+            if base_st.st_size != base.get('size') or base_st.st_mtime_ns != base.get('mtime_ns'):
+                raise DeltaError('服务器上的文件已变化，请重新获取签名', 412)
+            base_blocks = (base_st.st_size + block_size - 1) // block_size
+        elif os.path.lexists(target_path):
+            raise DeltaError('文件已存在，请先获取签名', 412)
+
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix='.upload-', suffix='.delta')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                digest = hashlib.sha256()
+                signature = SignatureBuilder(block_size)
+                written = copied = literal = 0
+
+                def emit(data):
+                    nonlocal written
+                    written += len(data)
+                    if written > size:
+                        raise DeltaError('重建结果超过声明的大小')
+                    digest.update(data)
+                    signature.update(data)
+                    out.write(data)
+
+                while True:
+                    op = stream.read(1)
+                    if op == b'E':
+                        break
+                    if op == b'C':
+                        first, count = COPY.unpack(_read_exact(stream, COPY.size))
+                        if base_file is None or count <= 0 or first + count > base_blocks:
+                            raise DeltaError('复制的块超出旧版本范围')
+                        base_file.seek(first * block_size)
+                        remaining = min(count * block_size, base_st.st_size - first * block_size)
+                        while remaining > 0:
+                            data = base_file.read(min(remaining, max(READ_SIZE // block_size, 1) * block_size))
+                            if not data:
+                                raise DeltaError('服务器上的文件已变化，请重新获取签名', 412)
+                            emit(data)
+                            remaining -= len(data)
+                            copied += len(data)
+                    elif op == b'L':
+                        (length,) = LITERAL.unpack(_read_exact(stream, LITERAL.size))
+                        while length > 0:
+                            data = stream.read(min(length, READ_SIZE))
+                            if not data:
+                                raise DeltaError('请求体不完整')
+                            emit(data)
+                            length -= len(data)
+                            literal += len(data)
+                    elif not op:
+                        raise DeltaError('请求体不完整')
+                    else:
+                        raise DeltaError(f'未知的操作 {op!r}')
+
+                if written != size:
+                    raise DeltaError(f'重建结果为 {written} 字节，与声明的 {size} 字节不符', 460)
+                if digest.hexdigest() != header['sha256'].lower():
+                    raise DeltaError('重建结果的 sha256 与声明的不符', 460)
+                out.flush()
+                if fsync_policy != 'never':
+                    os.fsync(out.fileno())
+            # 改名不改变修改时间和 inode，签名头可以使用临时文件的 stat
+            new_st = os.stat(tmp_path)
+            if base_file is not None:
+                current = os.stat(target_path)
+                if current.st_ino != base_st.st_ino or current.st_mtime_ns != base_st.st_mtime_ns:
+                    raise DeltaError('服务器上的文件在同步期间被修改', 412)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if fsync_policy == 'always':
+            upload_stream.fsync_directory(target_dir)
+    finally:
+        if base_file is not None:
+            base_file.close()
+    return digest.hexdigest(), signature.finish(new_st), copied, literal
+
+
+# 客户端：生成增量
+
+def _roll(a, b, out_byte, in_byte, n):
+    a = (a - out_byte + in_byte) % ADLER_MOD
+    b = (b - n * out_byte + a - 1) % ADLER_MOD
+    return a, b
+
+
+class DeltaWriter:
+    """把复制和新数据编码为增量格式，相邻的复制合并为一条"""
+
+    def __init__(self, out):
+        self.out = out
+        self.copy_start = None
+        self.copy_count = 0
+        self.copied_blocks = 0
+        self.literal_bytes = 0
+
+    def copy(self, index):
+        if self.copy_start is not None and index == self.copy_start + self.copy_count:
+            self.copy_count += 1
+        else:
+            self._flush_copy()
+            self.copy_start, self.copy_count = index, 1
+        self.copied_blocks += 1
+
+    def literal(self, data):
+        self._flush_copy()
+        view = memoryview(data)
+        for offset in range(0, len(view), MAX_LITERAL):
+            chunk = view[offset:offset + MAX_LITERAL]
+            self.out.write(b'L' + LITERAL.pack(len(chunk)))
+            self.out.write(chunk)
+        self.literal_bytes += len(view)
+
+    def _flush_copy(self):
+        if self.copy_start is not None:
+            self.out.write(b'C' + COPY.pack(self.copy_start, self.copy_count))
+            self.copy_start = None
+
+    def finish(self):
+        self._flush_copy()
+        self.out.write(b'E')
+
+
+def generate_delta(data, signature, out, search_window=None):
+    """对比新版本 data（bytes 或 mmap）与旧版本的签名，把配方写入 out，返回 DeltaWriter（含统计）
+
+    先在块边界上用 zlib.adler32 整块计算弱校验（C 实现，未修改的区域很快），
+    不命中时逐字节滚动，最多滚动 search_window 字节（默认一个块），以找到插入或删除后错位的块；
+    仍未找到时这一段作为新数据，从滚动停下的位置继续。滚动是纯 Python 循环，变化的区域越大越慢。
+    """
+    header, records = parse_signature(signature) if isinstance(signature, bytes) else signature
+    n = header['block_size']
+    # 没有旧版本（新建文件）时不必滚动
+    window = 0 if not records else n if search_window is None else search_window
+    size = len(data)
+    weak_index = {}
+    for index, (weak, strong) in enumerate(records):
+        weak_index.setdefault(weak, []).append(index)
+    last_length = header['size'] - (len(records) - 1) * n if records else 0
+
+    writer = DeltaWriter(out)
+    expected = 0  # 上一次命中的下一块，弱校验冲突时优先选它
+
+    def match(weak, start):
+        candidates = weak_index.get(weak)
+        if not candidates:
+            return None
+        strong = None
+        ordered = sorted(candidates, key=lambda index: index != expected)
+        for index in ordered:
+            length = n if index < len(records) - 1 else last_length
+            if length != n and start + length != size:
+                continue
+            if strong is None or strong[0] != length:
+                strong = (length, strong_checksum(data[start:start + length]))
+            if strong[1] == records[index][1]:
+                return index
+        return None
+
+    pos = literal_start = 0
+    while pos < size:
+        length = min(n, size - pos)
+        weak = zlib.adler32(data[pos:pos + length])
+        index = match(weak, pos)
+        if index is None and length == n:
+            # 逐字节滚动寻找错位的块
+            a, b = weak & 0xffff, weak >> 16
+            start = pos
+            limit = min(pos + window, size - n)
+            while pos < limit:
+                a, b = _roll(a, b, data[pos], data[pos + n], n)
+                pos += 1
+                if (b << 16 | a) in weak_index:
+                    index = match(b << 16 | a, pos)
+                    if index is not None:
+                        break
+            if index is None:
+                # pos 已前进到滚动停下的位置，这一段都是新数据；不滚动时整块作为新数据；滚到末尾时剩余部分也是新数据
+                if pos == start:
+                    pos += n
+                if pos >= size - n:
+                    pos = size
+                continue
+        elif index is None:
+            # 末尾不足一块且不匹配
+            pos = size
+            continue
+        if literal_start < pos:
+            writer.literal(data[literal_start:pos])
+        writer.copy(index)
+        expected = index + 1
+        pos += n if index < len(records) - 1 else last_length
+        literal_start = pos
+    if literal_start < size:
+        writer.literal(data[literal_start:size])
+    writer.finish()
+    return writer
@@ -0,0 +1,230 @@
+"""热点文件缓存
+
+两级：
+  - 内存层：不超过 memory_max_file_size 的小文件整个读入内存（bytes），按 LRU 淘汰，总字节数不超过 memory_max_bytes
+  - mmap 层：不超过 mmap_max_file_size 的中等文件用 mmap 映射，所有请求共享同一映射，
+    范围请求直接在 memoryview 上切片，不再 open / seek / read；映射数和映射总字节数有上限，按 LRU 淘汰
+
+准入按访问频率（TinyLFU 的简化版）：每个路径记录近期访问次数，达到 admit_after 次才缓存，
+只访问一次的文件不会挤掉热点文件；内存层满时，新文件的访问次数要多于被淘汰的文件才会替换它。
+访问计数每 sample_size 次访问减半一次，过去的热点会逐渐冷却。
+
+失效：
+  - 每次命中都 stat 一次，大小或修改时间与缓存时不同即丢弃（也能发现其他进程的修改）
+  - 上传、删除、重命名通过 fs_events 主动失效（目录事件使其下所有条目失效）
+
+mmap 层假定文件不会被原地截短：本服务的上传、分块上传、批量操作都是写临时文件后 rename，
+已映射的旧 inode 不受影响；其他进程原地截短已映射的文件时，读取被截掉的部分会触发 SIGBUS。
+淘汰的映射不需要显式关闭，最后一个引用它的 memoryview 释放后自动解除映射。
+"""
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+TIERS = ('memory', 'mmap')
+
+
+class CachedFile:
+    """一次命中的结果：buffer 为整个文件的内容（bytes 或 mmap），size 为缓存时的文件大小"""
+
+    __slots__ = ('path', 'tier', 'buffer', 'size', 'mtime_ns')
+
+    def __init__(self, path, tier, buffer, size, mtime_ns):
+        self.path = path
+        self.tier = tier
+        self.buffer = buffer
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def view(self, start=0, length=None):
+        """文件 [start, start + length) 区间的 memoryview，不复制数据"""
+        stop = self.size if length is None else start + length
+        return memoryview(self.buffer)[start:stop]
+
+
+class FileCache:
+    def __init__(self, memory_max_bytes=64 * 1024 ** 2, memory_max_file_size=256 * 1024,
+                 mmap_max_file_size=64 * 1024 ** 2, mmap_max_bytes=1024 ** 3, mmap_max_files=256,
+                 admit_after=2, sample_size=10000):
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_file_size = memory_max_file_size
+        self.mmap_max_file_size = mmap_max_file_size
+        self.mmap_max_bytes = mmap_max_bytes
+        self.mmap_max_files = mmap_max_files
+        self.admit_after = admit_after
+        self.sample_size = sample_size
+        # 路径 -> CachedFile，按最近使用排序
+        self._tiers = {tier: OrderedDict() for tier in TIERS}
+        self._bytes = {tier: 0 for tier in TIERS}
+        # 路径 -> 近期访问次数
+        self._frequency = {}
+        self._accesses = 0
+        self._lock = threading.Lock()
+        self.hits = {tier: 0 for tier in TIERS}
+        self.misses = 0
+        self.admitted = {tier: 0 for tier in TIERS}
+        self.rejected = 0
+        self.evicted = {tier: 0 for tier in TIERS}
+        self.invalidated = 0
+
+    def _tier_for(self, size, allow_mmap):
+        if size <= 0:
+            return None
+        if size <= self.memory_max_file_size:
+            return 'memory'
+        if allow_mmap and size <= self.mmap_max_file_size:
+            return 'mmap'
+        return None
+
+    def _touch(self, path):
+        """记录一次访问，返回近期访问次数"""
+        count = self._frequency.get(path, 0) + 1
+        self._frequency[path] = count
+        self._accesses += 1
+        if self._accesses >= self.sample_size:
+            self._accesses = 0
+            self._frequency = {key: value // 2 for key, value in self._frequency.items() if value > 1}
+        return count
+
+    def lookup(self, path, size, allow_mmap=False):
+        """返回 path 的 CachedFile，未缓存且不宜缓存时返回 None
+
+        size 为调用方据以计算 Content-Length 的大小，与文件当前大小或缓存内容不一致时不返回缓存；
+        allow_mmap 为 False 时中等文件不走 mmap 层（整文件下载交给 sendfile 更快）。
+        """
+        tier = self._tier_for(size, allow_mmap)
+        if tier is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        with self._lock:
+            frequency = self._touch(path)
+            cached = self._tiers[tier].get(path)
+            if cached is not None:
+                if cached.size == st.st_size == size and cached.mtime_ns == st.st_mtime_ns:
+                    self._tiers[tier].move_to_end(path)
+                    self.hits[tier] += 1
+                    return cached
+                self._discard(tier, path)
+                self.invalidated += 1
+            self.misses += 1
+            if frequency < self.admit_after or st.st_size != size:
+                return None
+            if tier == 'memory' and not self._make_room(size, frequency):
+                self.rejected += 1
+                return None
+        cached = self._load(path, tier, st)
+        if cached is None:
+            return None
+        with self._lock:
+            if tier == 'memory' and not self._make_room(size, frequency):
+                self.rejected += 1
+                return cached
+            old = self._tiers[tier].pop(path, None)
+            if old is not None:
+                self._bytes[tier] -= old.size
+            self._tiers[tier][path] = cached
+            self._bytes[tier] += size
+            self.admitted[tier] += 1
+            if tier == 'mmap':
+                self._trim_maps()
+        return cached
+
+    def _load(self, path, tier, st):
+        """读入或映射文件；读取期间文件被修改（大小或修改时间变化）时放弃"""
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_ino != st.st_ino:
+                    return None
+                if tier == 'memory':
+                    buffer = f.read(st.st_size + 1)
+                    if len(buffer) != st.st_size:
+                        return None
+                else:
+                    buffer = mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ)
+                    if hasattr(buffer, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+                        buffer.madvise(mmap.MADV_WILLNEED)
+                after = os.fstat(f.fileno())
+        except (OSError, ValueError):
+            return None
+        if after.st_size != st.st_size or after.st_mtime_ns != st.st_mtime_ns:
+            return None
+        return CachedFile(path, tier, buffer, st.st_size, st.st_mtime_ns)
+
+    def _make_room(self, size, frequency):
+        """为内存层腾出 size 字节；需要淘汰的文件比新文件更常用时放弃，返回是否有足够空间（持有锁时调用）"""
+        if size > self.memory_max_bytes:
+            return False
+        entries = self._tiers['memory']
+        victims = []
+        free = self.memory_max_bytes - self._bytes['memory']
+        for path, cached in entries.items():
+            if free >= size:
+                break
+            if self._frequency.get(path, 0) >= frequency:
+                return False
+            victims.append(path)
+            free += cached.size
+        if free < size:
+            return False
+        for path in victims:
+            self._discard('memory', path)
+            self.evicted['memory'] += 1
+        return True
+
+    def _trim_maps(self):
+        entries = self._tiers['mmap']
+        while entries and (len(entries) > self.mmap_max_files or self._bytes['mmap'] > self.mmap_max_bytes):
+            path = next(iter(entries))
+            self._discard('mmap', path)
+            self.evicted['mmap'] += 1
+
+    def _discard(self, tier, path):
+        cached = self._tiers[tier].pop(path, None)
+        if cached is not None:
+            self._bytes[tier] -= cached.size
+
+    def invalidate(self, path):
+        """丢弃 path 以及（path 为目录时）其下所有文件的缓存"""
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for tier in TIERS:
+                stale = [key for key in self._tiers[tier] if key == path or key.startswith(prefix)]
+                for key in stale:
+                    self._discard(tier, key)
+                self.invalidated += len(stale)
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：上传覆盖、删除、改名后立即丢弃缓存"""
+        self.invalidate(path)
+        if dest_path is not None:
+            self.invalidate(dest_path)
+
+    def clear(self):
+        with self._lock:
+            for tier in TIERS:
+                self._tiers[tier].clear()
+                self._bytes[tier] = 0
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                'hits': dict(self.hits),
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'admitted': dict(self.admitted),
+                'rejected': self.rejected,
+                'evicted': dict(self.evicted),
+                'invalidated': self.invalidated,
+                'entries': {tier: len(entries) for tier, entries in self._tiers.items()},
+                'bytes': dict(self._bytes),
+                'memory_max_bytes': self.memory_max_bytes,
+                'mmap_max_bytes': self.mmap_max_bytes,
+                'tracked_paths': len(self._frequency),
+            }
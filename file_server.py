@@ -1,24 +1,250 @@
 import os
+import re
+import time
 import mimetypes
-from flask import Flask, request, Response, send_file, abort, redirect, url_for, flash
+from flask import Flask, request, Response, send_file, abort, redirect, url_for, flash, make_response, session, jsonify, get_flashed_messages, g
 from werkzeug.exceptions import NotFound
 import urllib.parse
 from werkzeug.utils import secure_filename
+import fs_events
+from archive_stream import FORMATS as ARCHIVE_FORMATS, stream_tar, stream_zip
+from batch_ops import BatchOperations
+from cas_store import ContentStore
+from compression import (PrecompressedCache, compress_bytes, compress_chunks, compress_file_chunks, encoded_etag,
+                         is_compressible, negotiate)
+from config import ServerConfig
+from delta_sync import (MAX_BLOCK_SIZE as DELTA_MAX_BLOCK_SIZE, MIN_BLOCK_SIZE as DELTA_MIN_BLOCK_SIZE, DeltaError,
+                        SignatureCache, apply_delta, default_block_size)
+from download_engine import add_reader_wrapper, file_response
+from file_cache import FileCache
+from integrity import IntegrityScrubber, repr_digest_headers
+from listing_api import InvalidCursor, decode_cursor, entry_to_dict, list_entries, make_filter
+from listing_cache import SORT_KEYS, DirectoryEntry, ListingCache, iter_directory, page_entries
+from metadata_index import MetadataIndex, stat_entry
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, SamplingProfiler, StreamTracker, Timer
+from range_engine import (RangeNotSatisfiable, if_range_matches, multipart_byteranges_response,
+                          parse_range_header, range_not_satisfiable_response)
+from resumable_upload import UploadError, UploadSessionManager, parse_upload_checksum
+from search_index import MODES as SEARCH_MODES, SearchIndex
+from thumbnails import BROKEN_SVG, PENDING, PLACEHOLDER_SVG, READY, ThumbnailCache, thumbnail_kind
+from transfer_scheduler import TooManyTransfers, TransferScheduler, shape_file, shape_iterable
+from upload_stream import ingest_multipart
+from validators import (cache_control_for, file_etag, is_not_modified, not_modified_response,
+                        precondition_failed, precondition_failed_response, set_validators)
+
+# 共享文件夹、监听地址、密钥等配置，见config.py，可用FILE_SERVER_*环境变量覆盖
+config = ServerConfig.from_env()
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key'  # 添加密钥用于flash消息
+app.secret_key = config.secret_key  # 添加密钥用于flash消息
 
-# 指定要共享的文件夹路径
-SHARE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'file_storage')
-print(f"共享文件夹路径: {SHARE_FOLDER}")
+print(f"共享文件夹路径: {config.share_folder}")
 
-# 确保共享文件夹存在
-if not os.path.exists(SHARE_FOLDER):
-    os.makedirs(SHARE_FOLDER)
+# 确保共享文件夹和内部数据目录存在
+if not os.path.exists(config.share_folder):
+    os.makedirs(config.share_folder)
+os.makedirs(config.state_folder, exist_ok=True)
 
 # 允许的文件扩展名（如果需要限制上传文件类型）
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'zip', 'rar', 'doc', 'docx', 'avi'}
 
+# 上传文件的fsync策略：never / file / always，见upload_stream
+UPLOAD_FSYNC_POLICY = 'file'
+
+# 分块上传会话的临时目录，放在共享文件夹之外，避免出现在目录列表中
+# 与共享文件夹位于同一文件系统时，完成上传只需一次rename
+UPLOAD_SESSION_FOLDER = os.path.join(config.state_folder, 'upload_sessions')
+upload_sessions = UploadSessionManager(UPLOAD_SESSION_FOLDER)
+
+# 内容寻址去重存储（可选）：启用后内容相同的文件只保存一份，目录树中的文件为指向它的硬链接或reflink
+# 存储目录必须与共享文件夹位于同一文件系统
+CAS_ENABLED = False
+CAS_FOLDER = os.path.join(config.state_folder, 'cas_store')
+CAS_LINK_MODE = 'auto'  # auto / hardlink / reflink
+content_store = None
+if CAS_ENABLED:
+    content_store = ContentStore(config.share_folder, CAS_FOLDER, CAS_LINK_MODE)
+    fs_events.subscribe(content_store.on_fs_event)
+
+# 批量文件操作（/api/batch）：意图日志放在状态目录，启动时处理上次中断的批次，见batch_ops
+BATCH_JOURNAL_FOLDER = os.path.join(config.state_folder, 'batch_journal')
+BATCH_MAX_OPERATIONS = 10000  # 单个请求最多的条目数
+BATCH_WORKERS = 8
+batch_operations = BatchOperations(config.share_folder, BATCH_JOURNAL_FOLDER, BATCH_WORKERS,
+                                   fsync=UPLOAD_FSYNC_POLICY != 'never')
+batch_operations.recover()
+
+# 块级增量同步（/api/delta）：大文件只上传变化的块，签名按文件缓存在状态目录，见delta_sync
+DELTA_SIGNATURE_FOLDER = os.path.join(config.state_folder, 'delta_signatures')
+DELTA_SIGNATURE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+signature_cache = SignatureCache(DELTA_SIGNATURE_FOLDER, DELTA_SIGNATURE_CACHE_MAX_BYTES)
+fs_events.subscribe(signature_cache.on_fs_event)
+
+# 响应压缩：文本类文件和目录列表按Accept-Encoding压缩
+# 热点文件在后台压缩一次存入缓存目录，之后像普通文件一样发送
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024  # 小于该字节数的文件不压缩
+COMPRESSION_CACHE_FOLDER = os.path.join(config.state_folder, 'compression_cache')
+COMPRESSION_CACHE_MAX_BYTES = 1024 ** 3  # 缓存目录总大小上限
+COMPRESSION_CACHE_MAX_FILE_SIZE = 256 * 1024 ** 2  # 超过该大小的文件只在线压缩
+compression_cache = PrecompressedCache(COMPRESSION_CACHE_FOLDER, COMPRESSION_CACHE_MAX_BYTES,
+                                       COMPRESSION_CACHE_MAX_FILE_SIZE)
+fs_events.subscribe(compression_cache.on_fs_event)
+
+# 图片/视频缩略图：在进程池中生成，缓存到磁盘（需要安装Pillow；视频需要ffmpeg）
+THUMBNAILS_ENABLED = True
+THUMBNAIL_CACHE_FOLDER = os.path.join(config.state_folder, 'thumbnail_cache')
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 ** 2
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_SIZE = 128  # 目录列表中的缩略图
+PREVIEW_SIZE = 1024  # 点击"预览"打开的大图
+thumbnail_cache = None
+if THUMBNAILS_ENABLED:
+    thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_FOLDER, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WORKERS)
+    fs_events.subscribe(thumbnail_cache.on_fs_event)
+
+# 目录列表缓存，上传、删除、重命名时通过fs_events失效
+listing_cache = ListingCache()
+fs_events.subscribe(listing_cache.on_fs_event)
+
+# 热点文件缓存：多次下载的小文件保存在内存中，中等文件的范围请求从共享的mmap映射切片，见file_cache
+# 每次命中仍会stat一次，文件大小或修改时间变化即失效
+FILE_CACHE_ENABLED = True
+FILE_CACHE_MEMORY_MAX_BYTES = 64 * 1024 ** 2  # 内存层总大小上限
+FILE_CACHE_MEMORY_MAX_FILE_SIZE = 256 * 1024  # 不超过该大小的文件放入内存层
+FILE_CACHE_MMAP_MAX_FILE_SIZE = 64 * 1024 ** 2  # 不超过该大小的文件的范围请求使用mmap层
+FILE_CACHE_MMAP_MAX_FILES = 256
+FILE_CACHE_ADMIT_AFTER = 2  # 近期被访问该次数后才缓存
+file_cache = None
+if FILE_CACHE_ENABLED:
+    file_cache = FileCache(FILE_CACHE_MEMORY_MAX_BYTES, FILE_CACHE_MEMORY_MAX_FILE_SIZE, FILE_CACHE_MMAP_MAX_FILE_SIZE,
+                           mmap_max_files=FILE_CACHE_MMAP_MAX_FILES, admit_after=FILE_CACHE_ADMIT_AFTER)
+    fs_events.subscribe(file_cache.on_fs_event)
+
+# 共享文件夹的元数据索引（SQLite）：启动时后台并行扫描，之后按fs_events和inotify增量更新
+# 目录列表和下载从索引读取大小、修改时间，不再逐个stat；目录显示递归总大小和文件数
+METADATA_INDEX_ENABLED = True
+METADATA_INDEX_PATH = os.path.join(config.state_folder, 'metadata.sqlite3')
+METADATA_SCAN_WORKERS = 8
+metadata_index = None
+if METADATA_INDEX_ENABLED:
+    def on_metadata_change(directory):
+        # 子目录大小变化会影响所有上级目录的列表
+        if directory is None:
+            listing_cache.clear()
+        else:
+            listing_cache.invalidate(directory)
+    
+    metadata_index = MetadataIndex(config.share_folder, METADATA_INDEX_PATH, scan_workers=METADATA_SCAN_WORKERS,
+                                   on_change=on_metadata_change)
+    listing_cache.loader = metadata_index.listing
+    fs_events.subscribe(metadata_index.on_fs_event)
+
+# 文件名搜索：在元数据索引的数据库中建立FTS5三字索引，随索引增量更新（需要启用元数据索引）
+SEARCH_ENABLED = True
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 1000
+search_index = None
+if SEARCH_ENABLED and metadata_index is not None:
+    search_index = SearchIndex(metadata_index)
+
+if metadata_index is not None:
+    metadata_index.start()
+
+# 完整性巡检：后台计算缺少的SHA-256摘要，并定期重新读取文件与摘要比较，发现静默损坏（需要启用元数据索引）
+# 摘要保存在元数据索引中，核对记录和发现的不一致保存在单独的数据库中，见integrity
+INTEGRITY_ENABLED = True
+INTEGRITY_DB_PATH = os.path.join(config.state_folder, 'integrity.sqlite3')
+INTEGRITY_WORKERS = 2
+INTEGRITY_RATE = 50 * 1024 ** 2  # 巡检的总读取速率（字节/秒），0 表示不限
+INTEGRITY_VERIFY_INTERVAL = 7 * 86400  # 同一文件两次核对的最短间隔（秒）
+INTEGRITY_PASS_INTERVAL = 3600  # 两轮巡检之间的间隔（秒）
+INTEGRITY_INLINE_MAX_BYTES = 64 * 1024 ** 2  # /api/checksum 对不超过该大小的文件当场计算，更大的排队计算
+integrity_scrubber = None
+if INTEGRITY_ENABLED and metadata_index is not None:
+    integrity_scrubber = IntegrityScrubber(metadata_index, INTEGRITY_DB_PATH, INTEGRITY_WORKERS, INTEGRITY_RATE,
+                                           INTEGRITY_VERIFY_INTERVAL, INTEGRITY_PASS_INTERVAL)
+    integrity_scrubber.start()
+
+# 传输调度：大文件下载、打包下载和上传的限速、带宽公平分配和单客户端并发限制，见transfer_scheduler
+# 限制保存在状态目录的JSON文件中，可通过 /admin/limits 在运行时修改
+TRANSFER_LIMITS_PATH = os.path.join(config.state_folder, 'transfer_limits.json')
+# 不超过该字节数的下载和上传视为交互式请求，不限速也不计入并发数
+TRANSFER_INTERACTIVE_MAX_BYTES = 1024 * 1024
+transfer_scheduler = TransferScheduler(TRANSFER_LIMITS_PATH)
+
+# 允许访问 /admin/ 管理接口的客户端地址
+ADMIN_ADDRESSES = {'127.0.0.1', '::1'}
+
+# 运行指标：GET /metrics 以Prometheus文本格式输出，见metrics
+metrics = MetricsRegistry()
+request_duration = metrics.histogram('http_request_duration_seconds', '路由处理耗时（到生成响应头为止）',
+                                     ('route', 'method', 'status'))
+requests_in_progress = metrics.gauge('http_requests_in_progress', '正在处理的请求数')
+received_bytes = metrics.counter('http_received_bytes_total', '请求体字节数', ('route',))
+sent_bytes = metrics.counter('http_sent_bytes_total', '响应正文字节数（有Content-Length时按其计数）', ('route',))
+active_streams = metrics.gauge('http_active_streams', '正在发送正文的响应数', ('kind',))
+file_downloads = metrics.counter('file_downloads_total',
+                                 '文件下载请求，kind: full/range/multirange/compressed/not_modified', ('kind',))
+file_sent_bytes = metrics.counter('file_sent_bytes_total', '下载发送的文件字节数（含命中页缓存的部分）')
+listing_enumerate = metrics.histogram('listing_enumerate_seconds', '目录列表取得条目的耗时（含缓存命中）', ('view',))
+listing_render = metrics.histogram('listing_render_seconds', '目录列表排序、分页和生成页面的耗时', ('view',))
+stream_tracker = StreamTracker(active_streams, sent_bytes)
+add_reader_wrapper(stream_tracker.wrap_file)
+# 各子系统已有的统计信息在抓取时读取
+metrics.add_stats('listing_cache', listing_cache.stats, counters=('hits', 'misses', 'invalidations'),
+                  gauges=('directories', 'entries'))
+metrics.add_stats('compression_cache', compression_cache.stats, counters=('hits', 'misses', 'built', 'evicted'),
+                  gauges=('entries', 'bytes'))
+if thumbnail_cache is not None:
+    metrics.add_stats('thumbnail_cache', thumbnail_cache.stats,
+                      counters=('hits', 'misses', 'generated', 'failures', 'rejected', 'evicted'),
+                      gauges=('pending', 'entries', 'bytes'))
+if metadata_index is not None:
+    # 不用stats()，它要统计整个索引
+    metrics.add_stats('metadata_index', lambda: {'hits': metadata_index.hits, 'misses': metadata_index.misses,
+                                                 'ready': metadata_index.ready},
+                      counters=('hits', 'misses'), gauges=('ready',))
+if search_index is not None:
+    metrics.add_stats('search', search_index.stats, counters=('queries', 'truncated'))
+metrics.add_stats('transfers', transfer_scheduler.stats, counters=('started', 'rejected', 'bytes', 'throttled_seconds'),
+                  gauges=('active', 'active_clients'))
+if file_cache is not None:
+    metrics.add_stats('file_cache', file_cache.stats,
+                      counters=('hits', 'misses', 'admitted', 'rejected', 'evicted', 'invalidated'),
+                      gauges=('hit_rate', 'entries', 'bytes'))
+if integrity_scrubber is not None:
+    metrics.add_stats('integrity', integrity_scrubber.stats,
+                      counters=('passes', 'computed', 'verified', 'mismatches', 'skipped', 'errors', 'bytes_read'),
+                      gauges=('open_mismatches', 'running'))
+metrics.add_stats('batch', batch_operations.stats, counters=('batches', 'operations', 'failures', 'recovered'))
+
+# 采样分析器：默认关闭，通过 POST /admin/profile 开启一段时间，期间每隔PROFILER_INTERVAL秒抓取一次所有线程的调用栈
+PROFILER_INTERVAL = 0.01
+PROFILER_MAX_SECONDS = 600
+profiler = SamplingProfiler(PROFILER_INTERVAL)
+
+# 目录列表每页默认条目数和允许的最大值
+LISTING_PAGE_SIZE = 500
+LISTING_MAX_PAGE_SIZE = 5000
+
+# JSON接口每页默认条目数和允许的最大值
+API_PAGE_SIZE = 1000
+API_MAX_PAGE_SIZE = 10000
+
+# 下载的缓存策略：(通配符, Cache-Control)，按顺序第一条匹配的生效
+# 不含'/'的通配符只匹配文件名，含'/'的匹配相对于共享文件夹的完整路径
+CACHE_CONTROL_RULES = [
+    ('*.png', 'public, max-age=3600'),
+    ('*.jpg', 'public, max-age=3600'),
+    ('*.jpeg', 'public, max-age=3600'),
+    ('*.gif', 'public, max-age=3600'),
+]
+# 未匹配任何规则的文件：允许缓存，但每次使用前先用ETag验证
+DEFAULT_CACHE_CONTROL = 'no-cache'
+# 目录列表随时可能变化，总是重新验证
+LISTING_CACHE_CONTROL = 'no-cache'
+
 
 def get_file_size(file_path):
     """获取文件大小"""
@@ -27,6 +253,12 @@ def get_file_size(file_path):
     except OSError:
         return 0
 
+def lookup_path(full_path):
+    """返回路径的元数据（IndexEntry），不存在时返回None；启用元数据索引时通常不需要stat"""
+    if metadata_index is not None:
+        return metadata_index.lookup(full_path)
+    return stat_entry(full_path)
+
 def human_readable_size(size_bytes):
     """将字节大小转换为人类可读格式"""
     if size_bytes == 0:
@@ -40,155 +272,421 @@ def human_readable_size(size_bytes):
     
     return f"{size_bytes:.1f} {size_names[i]}"
 
+def make_safe_filename(original_filename):
+    """清理上传文件名：保留中文，替换路径分隔符等不安全字符，统一扩展名为小写"""
+    # 保留原始文件名的扩展名
+    filename, ext = os.path.splitext(original_filename)
+    ext = ext.lower()  # 统一扩展名大小写
+    
+    # 使用自定义逻辑保留中文和安全字符，不依赖secure_filename过滤中文
+    # 只保留字母、数字、下划线、中文和常见的文件名符号（如空格、点、括号等）
+    # 过滤掉绝对不安全的字符，如斜杠、反斜杠、冒号、星号、问号、引号、尖括号、竖线
+    safe_filename = re.sub(r'[\\/:*?"<>|]', '_', filename)
+    if not safe_filename or safe_filename in ('.', '..'):
+        # 如果过滤后文件名为空，使用时间戳
+        safe_filename = f"file_{int(time.time())}"
+    return f"{safe_filename}{ext}"
+
 def allowed_file(filename):
     """检查文件扩展名是否被允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_directory_listing(directory_path, relative_path):
-    """生成目录列表页面"""
-    # 获取目录中的所有项目
-    try:
-        items = os.listdir(directory_path)
-    except PermissionError:
-        abort(403)
-        return
+# 目录列表页面模板，首次使用时编译一次，之后每次请求只做渲染
+LISTING_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>文件列表</title>
+<style>
+body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+h1 { color: #333; }
+ul { list-style-type: none; padding: 0; }
+li { margin: 8px 0; padding: 10px; background-color: white; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+a { text-decoration: none; color: #0066cc; margin-right: 10px; }
+a:hover { text-decoration: underline; }
+.dir::before { content: "📁 "; }
+.file::before { content: "📄 "; }
+.size { color: #666; font-size: 0.9em; margin-left: 10px; }
+.actions { float: right; }
+.btn { padding: 5px 10px; margin-left: 5px; border: none; border-radius: 3px; cursor: pointer; font-size: 0.8em; }
+.btn-delete { background-color: #ff4444; color: white; }
+.btn-rename { background-color: #ff9800; color: white; }
+.btn-upload { background-color: #4CAF50; color: white; padding: 10px 15px; margin-bottom: 20px; }
+.upload-form { margin-bottom: 20px; padding: 15px; background-color: white; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+.rename-form { display: inline; }
+.flash-message { padding: 10px; margin: 10px 0; border-radius: 5px; }
+.flash-success { background-color: #d4edda; color: #155724; }
+.flash-error { background-color: #f8d7da; color: #721c24; }
+.pager { margin: 10px 0; color: #666; }
+.pager .current { font-weight: bold; }
+.thumb { width: 64px; height: 64px; object-fit: cover; vertical-align: middle; margin-right: 10px; border-radius: 4px; }
+</style>
+</head>
+<body>
+<h1>文件管理系统</h1>
+{% for category, message in messages %}
+  <div class="flash-message flash-{{ category }}">{{ message }}</div>
+{% endfor %}
+<div class="upload-form">
+<form method="post" action="{{ upload_url }}" enctype="multipart/form-data">
+    <input type="file" name="file" multiple>
+    <button type="submit" class="btn btn-upload">上传文件</button>
+</form>
+</div>
+{% if search_url %}
+<div class="upload-form">
+<form method="get" action="{{ search_url }}">
+    <input type="search" name="q" placeholder="搜索文件名" style="width: 240px; padding: 5px;">
+    <select name="mode"><option value="substring">包含</option><option value="prefix">开头为</option></select>
+    <input type="text" name="ext" placeholder="扩展名，如 jpg,png" style="width: 140px; padding: 5px;">
+    {% if search_path %}<label><input type="checkbox" name="path" value="{{ search_path }}" checked>只搜索当前目录</label>{% endif %}
+    <button type="submit" class="btn">搜索</button>
+</form>
+</div>
+{% endif %}
+{% if parent_url %}
+<p><a href="{{ parent_url }}">📁 ..</a></p>
+{% endif %}
+<p>打包下载：<a href="{{ archive_url }}?format=zip">ZIP</a><a href="{{ archive_url }}?format=tar">TAR</a></p>
+{% if pager %}
+<div class="pager">
+    排序：{% for key, label, url in pager.sort_links %}<a href="{{ url }}"{% if key == pager.sort %} class="current"{% endif %}>{{ label }}</a>{% endfor %}
+    <span>共 {{ pager.total }} 项，第 {{ pager.page }}/{{ pager.pages }} 页</span>
+    {% if pager.prev_url %}<a href="{{ pager.prev_url }}">上一页</a>{% endif %}
+    {% if pager.next_url %}<a href="{{ pager.next_url }}">下一页</a>{% endif %}
+    <a href="{{ pager.stream_url }}">全部显示</a>
+</div>
+{% endif %}
+<ul>
+{% for file in entries %}
+{% if file.is_dir %}
+<li><a class="dir" href="{{ file.url }}">{{ file.name }}/</a>{% if file.size %}<span class="size">({{ file.size }}，{{ file.file_count }} 个文件)</span>{% endif %}</li>
+{% else %}
+<li>
+    {% if file.thumb_url %}<img class="thumb" src="{{ placeholder_url }}" data-src="{{ file.thumb_url }}" alt="">{% endif %}
+    <a class="file" href="{{ file.url }}" target="_blank">{{ file.name }}</a><span class="size">({{ file.size }})</span>
+    {% if file.preview_url %}<a href="{{ file.preview_url }}" target="_blank">预览</a>{% endif %}
+    <div class="actions">
+        <form method="post" action="{{ file.url }}/delete" style="display: inline;">
+            <button type="submit" class="btn btn-delete" onclick='return confirm({{ ("确定要删除文件 " ~ file.name ~ " 吗？")|tojson }})'>删除</button>
+        </form>
+        <button class="btn btn-rename" onclick="showRenameForm('rename-form-{{ loop.index0 }}')">重命名</button>
+        <form method="post" action="{{ file.url }}/rename" class="rename-form" id="rename-form-{{ loop.index0 }}" style="display: none;">
+            <input type="text" name="new_name" value="{{ file.name }}" style="width: 200px; padding: 5px; margin-right: 5px;">
+            <button type="submit" class="btn btn-rename">确认</button>
+            <button type="button" class="btn" onclick="hideRenameForm('rename-form-{{ loop.index0 }}')">取消</button>
+        </form>
+    </div>
+</li>
+{% endif %}
+{% endfor %}
+</ul>
+<script>
+function showRenameForm(formId) {
+    document.getElementById(formId).style.display = "inline";
+}
+function hideRenameForm(formId) {
+    document.getElementById(formId).style.display = "none";
+}
+// 缩略图进入可视区域时才请求；还在生成时服务器返回202，稍后重试
+function loadThumb(img, attempt) {
+    fetch(img.dataset.src).then(function (response) {
+        if (response.status === 202 && attempt < 20) {
+            var delay = (parseInt(response.headers.get("Retry-After"), 10) || 1) * 1000;
+            setTimeout(function () { loadThumb(img, attempt + 1); }, delay);
+        } else if (response.ok) {
+            return response.blob().then(function (blob) { img.src = URL.createObjectURL(blob); });
+        }
+    });
+}
+var thumbs = document.querySelectorAll("img.thumb");
+if ("IntersectionObserver" in window) {
+    var observer = new IntersectionObserver(function (items) {
+        items.forEach(function (item) {
+            if (item.isIntersecting) {
+                observer.unobserve(item.target);
+                loadThumb(item.target, 0);
+            }
+        });
+    }, {rootMargin: "200px"});
+    thumbs.forEach(function (img) { observer.observe(img); });
+} else {
+    thumbs.forEach(function (img) { loadThumb(img, 0); });
+}
+</script>
+</body>
+</html>
+'''
+
+# 搜索结果页面模板
+SEARCH_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>搜索：{{ query }}</title>
+<style>
+body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+ul { list-style-type: none; padding: 0; }
+li { margin: 8px 0; padding: 10px; background-color: white; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+a { text-decoration: none; color: #0066cc; margin-right: 10px; }
+a:hover { text-decoration: underline; }
+.dir::before { content: "📁 "; }
+.file::before { content: "📄 "; }
+.size, .folder, .notice { color: #666; font-size: 0.9em; margin-left: 10px; }
+</style>
+</head>
+<body>
+<h1>搜索结果</h1>
+<form method="get" action="/search">
+    <input type="search" name="q" value="{{ query }}" style="width: 240px; padding: 5px;">
+    <select name="mode">{% for value, label in (('substring', '包含'), ('prefix', '开头为')) %}<option value="{{ value }}"{% if value == mode %} selected{% endif %}>{{ label }}</option>{% endfor %}</select>
+    <input type="text" name="ext" value="{{ ext }}" placeholder="扩展名，如 jpg,png" style="width: 140px; padding: 5px;">
+    {% if within %}<input type="hidden" name="path" value="{{ within }}">{% endif %}
+    <button type="submit">搜索</button>
+</form>
+<p><a href="{{ back_url }}">返回{% if within %} /{{ within }}{% else %}文件列表{% endif %}</a></p>
+{% if indexing %}<p class="notice">索引正在建立，结果可能不完整</p>{% endif %}
+{% if truncated %}<p class="notice">搜索超时，只显示了部分结果</p>{% endif %}
+<ul>
+{% for item in results %}
+<li><a class="{{ 'dir' if item.is_dir else 'file' }}" href="{{ item.url }}"{% if not item.is_dir %} target="_blank"{% endif %}>{{ item.name }}</a><span class="size">({{ item.size }})</span><a class="folder" href="{{ item.folder_url }}">/{{ item.folder }}</a></li>
+{% else %}
+<li>没有找到匹配的文件</li>
+{% endfor %}
+</ul>
+{% if next_url %}<p><a href="{{ next_url }}">下一页</a></p>{% endif %}
+</body>
+</html>
+'''
+
+_listing_template = None
+_search_template = None
+
+
+def get_listing_template():
+    """返回编译好的目录列表模板"""
+    global _listing_template
+    if _listing_template is None:
+        _listing_template = app.jinja_env.from_string(LISTING_TEMPLATE)
+    return _listing_template
+
+
+def get_search_template():
+    """返回编译好的搜索结果模板"""
+    global _search_template
+    if _search_template is None:
+        _search_template = app.jinja_env.from_string(SEARCH_TEMPLATE)
+    return _search_template
+
+
+def listing_rows(entries, relative_path):
+    """把目录条目逐个转换为模板使用的行，惰性生成，流式输出时不必先构造整页"""
+    quoted_path = urllib.parse.quote(relative_path)
+    file_prefix = f'/files/{quoted_path}{"/" if relative_path else ""}'
+    for entry in entries:
+        if entry.is_dir:
+            row = {
+                'is_dir': True,
+                'name': entry.name,
+                'url': f'/files/{quoted_path}{urllib.parse.quote(entry.name)}/',
+            }
+            if entry.file_count is not None:
+                # 来自元数据索引的递归总大小和文件数
+                row['size'] = human_readable_size(entry.size)
+                row['file_count'] = entry.file_count
+            yield row
+        else:
+            # 大小直接取扫描结果，不再逐个stat
+            row = {
+                'is_dir': False,
+                'name': entry.name,
+                'url': file_prefix + urllib.parse.quote(entry.name),
+                'size': human_readable_size(entry.size),
+            }
+            if thumbnail_cache is not None and thumbnail_kind(entry.name):
+                # URL中带上修改时间，文件变化后URL随之变化，缩略图可以长期缓存
+                thumb_url = f'/thumbs/{quoted_path}{"/" if relative_path else ""}{urllib.parse.quote(entry.name)}'
+                row['thumb_url'] = f'{thumb_url}?v={entry.mtime_ns:x}&s={THUMBNAIL_SIZE}'
+                row['preview_url'] = f'{thumb_url}?v={entry.mtime_ns:x}&s={PREVIEW_SIZE}'
+            yield row
+
+def parse_listing_args(args):
+    """解析目录列表的排序、分页和流式参数"""
+    sort = args.get('sort', 'name')
+    if sort not in SORT_KEYS:
+        sort = 'name'
+    descending = args.get('order') == 'desc'
+    page = max(args.get('page', 1, type=int) or 1, 1)
+    per_page = args.get('per_page', LISTING_PAGE_SIZE, type=int) or LISTING_PAGE_SIZE
+    per_page = min(max(per_page, 1), LISTING_MAX_PAGE_SIZE)
+    stream = args.get('stream') == '1'
+    return sort, descending, page, per_page, stream
+
+def build_pager(total, page, per_page, sort, descending):
+    """构造分页和排序链接，超出范围的页码按最后一页处理"""
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, pages)
     
-    # 分离文件和文件夹
-    directories = []
-    files = []
+    def url(**changes):
+        params = {'sort': sort, 'order': 'desc' if descending else 'asc', 'page': page, 'per_page': per_page}
+        params.update(changes)
+        return '?' + urllib.parse.urlencode(params)
     
-    for item in items:
-        item_path = os.path.join(directory_path, item)
-        if os.path.isdir(item_path):
-            directories.append(item)
-        else:
-            files.append(item)
-    
-    # 排序
-    directories.sort()
-    files.sort()
-    
-    # 构造HTML页面
-    html = [
-        '<!DOCTYPE html>',
-        '<html>',
-        '<head>',
-        '<meta charset="utf-8">',
-        '<meta name="viewport" content="width=device-width, initial-scale=1">',
-        '<title>文件列表</title>',
-        '<style>',
-        'body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }',
-        'h1 { color: #333; }',
-        'ul { list-style-type: none; padding: 0; }',
-        'li { margin: 8px 0; padding: 10px; background-color: white; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }',
-        'a { text-decoration: none; color: #0066cc; margin-right: 10px; }',
-        'a:hover { text-decoration: underline; }',
-        '.dir::before { content: "📁 "; }',
-        '.file::before { content: "📄 "; }',
-        '.size { color: #666; font-size: 0.9em; margin-left: 10px; }',
-        '.actions { float: right; }',
-        '.btn { padding: 5px 10px; margin-left: 5px; border: none; border-radius: 3px; cursor: pointer; font-size: 0.8em; }',
-        '.btn-delete { background-color: #ff4444; color: white; }',
-        '.btn-rename { background-color: #ff9800; color: white; }',
-        '.btn-upload { background-color: #4CAF50; color: white; padding: 10px 15px; margin-bottom: 20px; }',
-        '.upload-form { margin-bottom: 20px; padding: 15px; background-color: white; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }',
-        '.rename-form { display: inline; }',
-        '.flash-message { padding: 10px; margin: 10px 0; border-radius: 5px; }',
-        '.flash-success { background-color: #d4edda; color: #155724; }',
-        '.flash-error { background-color: #f8d7da; color: #721c24; }',
-        '</style>',
-        '</head>',
-        '<body>',
-        '<h1>文件管理系统</h1>'
-    ]
-    
-    # 添加消息闪现区域
-    html.append('{% with messages = get_flashed_messages(with_categories=true) %}')
-    html.append('  {% if messages %}')
-    html.append('    {% for category, message in messages %}')
-    html.append('      <div class="flash-message flash-{{ category }}">{{ message }}</div>')
-    html.append('    {% endfor %}')
-    html.append('  {% endif %}')
-    html.append('{% endwith %}')
-    
-    # 添加上传文件表单
+    sort_links = []
+    for key, label in (('name', '名称'), ('size', '大小'), ('mtime', '修改时间')):
+        # 点击当前排序字段时切换升降序
+        order = 'asc' if key != sort or descending else 'desc'
+        sort_links.append((key, label, url(sort=key, order=order, page=1)))
+    
+    return {
+        'sort': sort,
+        'page': page,
+        'pages': pages,
+        'total': total,
+        'sort_links': sort_links,
+        'prev_url': url(page=page - 1) if page > 1 else None,
+        'next_url': url(page=page + 1) if page < pages else None,
+        'stream_url': '?' + urllib.parse.urlencode({'sort': sort, 'order': 'desc' if descending else 'asc',
+                                                    'stream': 1}),
+    }
+
+def _batched(chunks, size=16 * 1024):
+    """把模板产生的小片段合并成较大的块再发送，减少写套接字的次数"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def generate_directory_listing(entries, relative_path, pager=None, stream=False):
+    """生成目录列表页面；stream为True时返回逐块产生HTML的迭代器"""
+    # 上传地址
     if relative_path == '':
         upload_url = '/files/upload'
     else:
         upload_url = f'/files/{urllib.parse.quote(relative_path)}upload'
-    html.append(f'<div class="upload-form">')
-    html.append(f'<form method="post" action="{upload_url}" enctype="multipart/form-data">')
-    html.append(f'    <input type="file" name="file" multiple>')
-    html.append(f'    <button type="submit" class="btn btn-upload">上传文件</button>')
-    html.append(f'</form>')
-    html.append(f'</div>')
-    
-    # 添加返回上级目录链接（如果不是根目录）
+    
+    # 返回上级目录链接（如果不是根目录）
+    parent_url = None
     if relative_path != '':
         parent_path = os.path.dirname(relative_path.rstrip('/'))
         if parent_path == '':
             parent_url = '/'
         else:
             parent_url = f'/files/{urllib.parse.quote(parent_path)}/'
-        html.append(f'<p><a href="{parent_url}">📁 ..</a></p>')
-    
-    html.append('<ul>')
-    
-    # 列出目录
-    for directory in directories:
-        encoded_dir = urllib.parse.quote(directory)
-        dir_url = f'/files/{urllib.parse.quote(relative_path)}{encoded_dir}/'
-        html.append(f'<li><a class="dir" href="{dir_url}">{directory}/</a></li>')
-    
-    # 列出文件
-    for i, file in enumerate(files):
-        encoded_file = urllib.parse.quote(file)
-        file_url = f'/files/{urllib.parse.quote(relative_path)}{"/" if relative_path else ""}{encoded_file}'
-        file_path = os.path.join(directory_path, file)
-        file_size = get_file_size(file_path)
-        readable_size = human_readable_size(file_size)
-        
-        # 删除表单
-        delete_url = f'/files/{urllib.parse.quote(relative_path)}{"/" if relative_path else ""}{encoded_file}/delete'
-        
-        # 重命名表单
-        rename_url = f'/files/{urllib.parse.quote(relative_path)}{"/" if relative_path else ""}{encoded_file}/rename'
-        
-        # 使用索引作为ID的一部分，避免文件名特殊字符问题
-        rename_form_id = f'rename-form-{i}'
-        
-        html.append(f'<li>')
-        html.append(f'    <a class="file" href="{file_url}" target="_blank">{file}</a><span class="size">({readable_size})</span>')
-        html.append(f'    <div class="actions">')
-        html.append(f'        <form method="post" action="{delete_url}" style="display: inline;">')
-        html.append(f'            <button type="submit" class="btn btn-delete" onclick="return confirm(\'确定要删除文件 {file} 吗？\')">删除</button>')
-        html.append(f'        </form>')
-        html.append(f'        <button class="btn btn-rename" onclick="showRenameForm(\'{rename_form_id}\')">重命名</button>')
-        html.append(f'        <form method="post" action="{rename_url}" class="rename-form" id="{rename_form_id}" style="display: none;">')
-        html.append(f'            <input type="text" name="new_name" value="{file}" style="width: 200px; padding: 5px; margin-right: 5px;">')
-        html.append(f'            <button type="submit" class="btn btn-rename">确认</button>')
-        html.append(f'            <button type="button" class="btn" onclick="hideRenameForm(\'{rename_form_id}\')">取消</button>')
-        html.append(f'        </form>')
-        html.append(f'    </div>')
-        html.append(f'</li>')
-    
-    html.extend([
-        '</ul>',
-        '<script>',
-        'function showRenameForm(formId) {',
-        '    document.getElementById(formId).style.display = "inline";',
-        '}',
-        'function hideRenameForm(formId) {',
-        '    document.getElementById(formId).style.display = "none";',
-        '}',
-        '</script>',
-        '</body>',
-        '</html>'
-    ])
-    
-    # 使用Flask的render_template_string来渲染模板，支持flash消息
-    from flask import render_template_string
-    return render_template_string('\n'.join(html))
+    
+    context = {
+        'upload_url': upload_url,
+        'parent_url': parent_url,
+        'archive_url': f'/archive/{urllib.parse.quote(relative_path)}',
+        'placeholder_url': '/thumbs-placeholder.svg',
+        'search_url': '/search' if search_index is not None else None,
+        'search_path': relative_path.rstrip('/'),
+        'entries': listing_rows(entries, relative_path),
+        'pager': pager,
+        # 在发送响应头之前取出flash消息，流式输出时会话已经无法再保存
+        'messages': get_flashed_messages(with_categories=True),
+    }
+    template = get_listing_template()
+    if stream:
+        return _batched(template.generate(**context))
+    return template.render(**context)
+
+def stream_directory_listing(full_path, relative_path, sort, descending):
+    """流式输出整个目录
+
+    目录已在缓存中时按要求排序输出；否则边扫描边输出（扫描顺序），
+    不等待整个目录扫描完成，首字节时间与目录大小无关。
+    """
+    listing = listing_cache.peek(full_path)
+    if listing is not None:
+        entries = page_entries(listing, sort, descending)
+    else:
+        try:
+            os.scandir(full_path).close()
+        except PermissionError:
+            abort(403)
+        entries = iter_directory(full_path)
+    
+    body = generate_directory_listing(entries, relative_path, stream=True)
+    encoding = negotiate(request.headers.get('Accept-Encoding')) if COMPRESSION_ENABLED else None
+    if encoding:
+        body = compress_chunks((chunk.encode('utf-8') for chunk in body), encoding)
+    response = Response(body, mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = LISTING_CACHE_CONTROL
+    return response
+
+def admin_forbidden():
+    """管理接口只允许本机访问，其他地址返回403响应，允许时返回None"""
+    if request.remote_addr not in ADMIN_ADDRESSES:
+        return jsonify({'status': 'error', 'message': '只允许从本机访问'}), 403
+    return None
+
+def start_transfer(direction, size=None):
+    """登记一个大块传输（size 未知时按大块处理），不超过交互式阈值时返回 None
+    
+    超过单客户端并发上限时抛出TooManyTransfers；请求结束时仍未交给响应正文的传输由release_transfers释放
+    """
+    if size is not None and size <= TRANSFER_INTERACTIVE_MAX_BYTES:
+        return None
+    transfer = transfer_scheduler.start(request.remote_addr, direction)
+    g.setdefault('transfers', []).append(transfer)
+    return transfer
+
+@app.errorhandler(TooManyTransfers)
+def too_many_transfers(error):
+    response = jsonify({'status': 'error', 'message': f'同时进行的传输过多（上限 {error.limit} 个），请稍后再试'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    requests_in_progress.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录路由耗时和字节数；流式正文在发送完毕（关闭）时才从活动数中减去"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_duration.observe(time.perf_counter() - g.pop('request_started', time.perf_counter()),
+                             route=route, method=request.method, status=response.status_code)
+    if request.content_length:
+        received_bytes.inc(request.content_length, route=route)
+    length = response.content_length
+    if length is not None and request.method != 'HEAD':
+        sent_bytes.inc(length, route=route)
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = stream_tracker.wrap_iterable(response.response, route=route, count_bytes=length is None)
+    return response
+
+@app.after_request
+def note_interactive(response):
+    """没有登记大块传输的请求都是交互式请求，调度器据此为它们保留带宽"""
+    if not g.get('transfers'):
+        transfer_scheduler.note_interactive()
+    return response
+
+@app.teardown_request
+def finish_request(exc=None):
+    requests_in_progress.dec()
+
+@app.teardown_request
+def release_transfers(exc=None):
+    for transfer in g.get('transfers', ()):
+        if not transfer.attached:
+            transfer.close()
 
 @app.route('/')
 def index():
@@ -203,92 +701,147 @@ def list_files(filepath=''):
     """列出文件或提供文件下载"""
     # 构造实际文件系统路径
     safe_filepath = filepath.lstrip('/')
-    full_path = os.path.join(SHARE_FOLDER, safe_filepath)
+    full_path = os.path.join(config.share_folder, safe_filepath)
     
     # 防止目录遍历攻击
-    if not os.path.abspath(full_path).startswith(os.path.abspath(SHARE_FOLDER)):
+    if not os.path.abspath(full_path).startswith(os.path.abspath(config.share_folder)):
         abort(403)
     
-    # 检查路径是否存在
-    if not os.path.exists(full_path):
+    # 一次查询得到类型、大小和修改时间（索引可用时不访问文件系统）
+    st = lookup_path(full_path)
+    if st is None:
         abort(404)
     
     # 如果是目录，则显示目录列表
-    if os.path.isdir(full_path):
-        return generate_directory_listing(full_path, filepath)
+    if st.is_dir:
+        sort, descending, page, per_page, stream = parse_listing_args(request.args)
+        if stream:
+            return stream_directory_listing(full_path, filepath, sort, descending)
+        
+        try:
+            with Timer(listing_enumerate, view='html'):
+                listing = listing_cache.get(full_path)
+        except PermissionError:
+            abort(403)
+        encoding = negotiate(request.headers.get('Accept-Encoding')) if COMPRESSION_ENABLED else None
+        etag, last_modified = encoded_etag(listing.etag, encoding), listing.last_modified
+        # 有待显示的flash消息时页面内容不同，不能返回304
+        if '_flashes' not in session and is_not_modified(request.headers, etag, last_modified):
+            response = not_modified_response(etag, last_modified, LISTING_CACHE_CONTROL)
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+        
+        # 只取出当前页的条目
+        with Timer(listing_render, view='html'):
+            pager = build_pager(len(listing), page, per_page, sort, descending)
+            page = pager['page']
+            entries = page_entries(listing, sort, descending, (page - 1) * per_page, per_page)
+            html = generate_directory_listing(entries, filepath, pager)
+        if encoding:
+            response = make_response(compress_bytes(html.encode('utf-8'), encoding))
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = make_response(html)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return set_validators(response, etag, last_modified, LISTING_CACHE_CONTROL)
     
     # 如果是文件，则提供下载
-    if os.path.isfile(full_path):
-        # 获取文件大小
-        file_size = get_file_size(full_path)
+    if not st.is_dir:
+        # 大小、修改时间和验证器都来自上面的查询，条件请求命中时无需打开文件
+        file_size = st.st_size
+        mtime = st.st_mtime
+        cache_control = cache_control_for(safe_filepath, CACHE_CONTROL_RULES, DEFAULT_CACHE_CONTROL)
+        
+        # 获取文件MIME类型
+        mime_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        
+        # 选择要发送的表示：原始文件、预压缩缓存中的变体，或在线压缩
+        send_path, send_size = full_path, file_size
+        encoding = None
+        compressible = (COMPRESSION_ENABLED and file_size >= COMPRESSION_MIN_SIZE
+                        and is_compressible(mime_type, full_path))
+        if compressible:
+            encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding:
+            variant = compression_cache.lookup(full_path, st, encoding)
+            if variant is not None:
+                send_path, send_size = variant
+            elif request.headers.get('Range'):
+                # 在线压缩的长度未知，无法满足范围请求，退回原始内容以便断点续传
+                encoding = None
+        etag = encoded_etag(file_etag(st), encoding)
         
-        # 处理范围请求
+        if precondition_failed(request.headers, etag, mtime):
+            return precondition_failed_response(etag, mtime)
+        if is_not_modified(request.headers, etag, mtime):
+            file_downloads.inc(kind='not_modified')
+            response = not_modified_response(etag, mtime, cache_control)
+            if compressible:
+                response.headers['Vary'] = 'Accept-Encoding'
+            return response
+        
+        if encoding and send_path == full_path:
+            # 在线流式压缩，长度未知，不支持范围请求
+            transfer = start_transfer('download', file_size)
+            file_downloads.inc(kind='compressed')
+            file_sent_bytes.inc(file_size)
+            response = Response(shape_iterable(compress_file_chunks(full_path, encoding), transfer), 200,
+                                mimetype=mime_type)
+            response.headers['Content-Encoding'] = encoding
+            response.headers['Vary'] = 'Accept-Encoding'
+            response.headers.add('Content-Disposition', f'inline; filename="{os.path.basename(full_path)}"')
+            return set_validators(response, etag, mtime, cache_control)
+        
+        # 处理范围请求，If-Range 不匹配时按普通下载处理；对编码后的表示，范围针对编码后的字节
+        ranges = None
         range_header = request.headers.get('Range', None)
-        if range_header:
-            # 解析范围请求
-            byte_range = range_header.replace('bytes=', '').split('-')
-            start = int(byte_range[0]) if byte_range[0] else 0
-            end = int(byte_range[1]) if byte_range[1] else file_size - 1
-            
-            # 限制结束位置不超过文件大小
-            end = min(end, file_size - 1)
-            
-            # 计算长度
+        if range_header and if_range_matches(request.headers.get('If-Range'), etag, mtime):
+            try:
+                ranges = parse_range_header(range_header, send_size)
+            except RangeNotSatisfiable:
+                return range_not_satisfiable_response(send_size)
+        
+        # 大文件（或大范围）登记到传输调度器，按分配的速率发送
+        send_length = sum(end - start + 1 for start, end in ranges) if ranges else send_size
+        transfer = start_transfer('download', send_length)
+        file_downloads.inc(kind='full' if not ranges else 'range' if len(ranges) == 1 else 'multirange')
+        file_sent_bytes.inc(send_length)
+        
+        # 热点小文件从内存发送；中等文件只有范围请求走mmap，整个文件的下载交给sendfile更快
+        cached = None
+        if file_cache is not None:
+            cached = file_cache.lookup(send_path, send_size, allow_mmap=bool(ranges))
+        
+        if ranges and len(ranges) > 1:
+            # 多段范围，以 multipart/byteranges 返回
+            response = multipart_byteranges_response(send_path, ranges, send_size, mime_type, transfer, cached)
+        elif ranges:
+            start, end = ranges[0]
             length = end - start + 1
             
-            # 打开文件并定位到起始位置
-            def generate():
-                with open(full_path, 'rb') as f:
-                    f.seek(start)
-                    remaining = length
-                    while remaining > 0:
-                        chunk_size = min(4096, remaining)
-                        data = f.read(chunk_size)
-                        if not data:
-                            break
-                        yield data
-                        remaining -= len(data)
-            
-            # 创建范围响应
-            response = Response(
-                generate(),
-                206,  # Partial Content
-                mimetype=mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
-            )
+            # 创建范围响应，文件交给下载引擎发送
+            response = file_response(request.environ, send_path, start, length, 206, mime_type, transfer, cached)
             
             # 设置响应头
-            response.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
+            response.headers.add('Content-Range', f'bytes {start}-{end}/{send_size}')
             response.headers.add('Accept-Ranges', 'bytes')
-            response.headers.add('Content-Length', str(length))
-            
-            return response
         else:
-            # 处理普通下载请求
-            def generate():
-                with open(full_path, 'rb') as f:
-                    while True:
-                        chunk = f.read(4096)
-                        if not chunk:
-                            break
-                        yield chunk
-            
-            # 获取文件MIME类型
-            mime_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
-            
-            # 创建响应
-            response = Response(
-                generate(),
-                200,
-                mimetype=mime_type
-            )
+            # 处理普通下载请求，文件交给下载引擎发送
+            response = file_response(request.environ, send_path, 0, send_size, 200, mime_type, transfer, cached)
             
             # 设置响应头
             filename = os.path.basename(full_path)
-            response.headers.add('Content-Length', str(file_size))
             response.headers.add('Accept-Ranges', 'bytes')
             response.headers.add('Content-Disposition', f'inline; filename="{filename}"')
-            
-            return response
+        
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        elif st.digest:
+            # 摘要针对未编码的完整内容，范围请求同样适用
+            response.headers.update(repr_digest_headers(st.digest))
+        if compressible:
+            response.headers['Vary'] = 'Accept-Encoding'
+        return set_validators(response, etag, mtime, cache_control)
 
 @app.route('/files/upload', methods=['POST'])
 @app.route('/files/<path:filepath>/upload', methods=['POST'])
@@ -296,47 +849,46 @@ def upload_file(filepath=''):
     """上传文件"""
     # 构造实际目录路径
     safe_filepath = filepath.lstrip('/')
-    upload_dir = os.path.join(SHARE_FOLDER, safe_filepath)
+    upload_dir = os.path.join(config.share_folder, safe_filepath)
     
     # 防止目录遍历攻击
-    if not os.path.abspath(upload_dir).startswith(os.path.abspath(SHARE_FOLDER)):
+    if not os.path.abspath(upload_dir).startswith(os.path.abspath(config.share_folder)):
         abort(403)
     
     # 检查目录是否存在
     if not os.path.exists(upload_dir) or not os.path.isdir(upload_dir):
         abort(404)
     
-    # 检查是否有文件被上传
-    if 'file' not in request.files:
+    # 只接受multipart表单，直接从请求体流式写入目标目录，不经过request.files
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
         flash('没有选择文件', 'error')
         return redirect(request.referrer)
     
-    files = request.files.getlist('file')
+    try:
+        transfer = start_transfer('upload', request.content_length)
+    except TooManyTransfers as e:
+        flash(f'同时进行的传输过多（上限 {e.limit} 个），请稍后再试', 'error')
+        return redirect(request.referrer)
     
-    for file in files:
-        if file.filename == '':
-            continue
-        
-        # 保留原始文件名的扩展名
-        original_filename = file.filename
-        filename, ext = os.path.splitext(original_filename)
-        ext = ext.lower()  # 统一扩展名大小写
-        
-        # 使用自定义逻辑保留中文和安全字符，不依赖secure_filename过滤中文
-        import re
-        # 只保留字母、数字、下划线、中文和常见的文件名符号（如空格、点、括号等）
-        # 过滤掉绝对不安全的字符，如斜杠、反斜杠、冒号、星号、问号、引号、尖括号、竖线
-        safe_filename = re.sub(r'[\\/:*?"<>|]', '_', filename)
-        if not safe_filename:
-            # 如果过滤后文件名为空，使用时间戳
-            import time
-            safe_filename = f"file_{int(time.time())}"
-        final_filename = f"{safe_filename}{ext}"
-        
-        # 保存文件
-        file_path = os.path.join(upload_dir, final_filename)
-        file.save(file_path)
-        flash(f'文件 "{final_filename}" 上传成功', 'success')
+    def on_file(uploaded):
+        if content_store is not None:
+            content_store.ingest(uploaded.path, uploaded.sha256)
+        fs_events.emit('created', uploaded.path)
+        if metadata_index is not None:
+            # 上传时已顺带算好摘要，记入索引
+            metadata_index.set_digest(uploaded.path, uploaded.sha256)
+        flash(f'文件 "{uploaded.filename}" 上传成功', 'success')
+    
+    try:
+        uploaded_files = ingest_multipart(shape_file(request.stream, transfer, owns_transfer=False), boundary, upload_dir, make_safe_filename,
+                                          fsync_policy=UPLOAD_FSYNC_POLICY, on_file=on_file)
+    except (ValueError, OSError) as e:
+        flash(f'上传文件失败: {str(e)}', 'error')
+        return redirect(request.referrer)
+    
+    if not uploaded_files:
+        flash('没有选择文件', 'error')
     
     return redirect(request.referrer)
 
@@ -345,10 +897,10 @@ def delete_file(filepath):
     """删除文件"""
     # 构造实际文件路径
     safe_filepath = filepath.lstrip('/')
-    file_path = os.path.join(SHARE_FOLDER, safe_filepath)
+    file_path = os.path.join(config.share_folder, safe_filepath)
     
     # 防止目录遍历攻击
-    if not os.path.abspath(file_path).startswith(os.path.abspath(SHARE_FOLDER)):
+    if not os.path.abspath(file_path).startswith(os.path.abspath(config.share_folder)):
         abort(403)
     
     # 检查文件是否存在
@@ -358,6 +910,7 @@ def delete_file(filepath):
     # 删除文件
     try:
         os.remove(file_path)
+        fs_events.emit('deleted', file_path)
         flash(f'文件 "{os.path.basename(file_path)}" 删除成功', 'success')
     except Exception as e:
         flash(f'删除文件失败: {str(e)}', 'error')
@@ -370,10 +923,10 @@ def rename_file(filepath):
     """重命名文件"""
     # 构造实际文件路径
     safe_filepath = filepath.lstrip('/')
-    file_path = os.path.join(SHARE_FOLDER, safe_filepath)
+    file_path = os.path.join(config.share_folder, safe_filepath)
     
     # 防止目录遍历攻击
-    if not os.path.abspath(file_path).startswith(os.path.abspath(SHARE_FOLDER)):
+    if not os.path.abspath(file_path).startswith(os.path.abspath(config.share_folder)):
         abort(403)
     
     # 检查文件是否存在
@@ -403,6 +956,7 @@ def rename_file(filepath):
     # 重命名文件
     try:
         os.rename(file_path, new_file_path)
+        fs_events.emit('renamed', file_path, new_file_path)
         flash(f'文件已重命名为 "{new_name}"', 'success')
     except Exception as e:
         flash(f'重命名文件失败: {str(e)}', 'error')
@@ -410,14 +964,566 @@ def rename_file(filepath):
     # 重定向回上一页
     return redirect(request.referrer)
 
+def resolve_share_path(filepath):
+    """把URL中的相对路径转换为共享文件夹内的绝对路径，越界时返回403"""
+    safe_filepath = filepath.lstrip('/')
+    full_path = os.path.abspath(os.path.join(config.share_folder, safe_filepath))
+    share_root = os.path.abspath(config.share_folder)
+    if full_path != share_root and not full_path.startswith(share_root + os.sep):
+        abort(403)
+    return safe_filepath, full_path
+
+@app.route('/archive/')
+@app.route('/archive/<path:filepath>')
+def download_archive(filepath=''):
+    """把目录打包成ZIP或TAR边生成边发送，?format=zip|tar，?compress=0时ZIP不压缩"""
+    safe_filepath, full_path = resolve_share_path(filepath)
+    if not os.path.isdir(full_path):
+        abort(404)
+    archive_format = request.args.get('format', 'zip')
+    if archive_format not in ARCHIVE_FORMATS:
+        return jsonify({'status': 'error', 'message': f'不支持的打包格式: {archive_format}'}), 400
+    
+    if archive_format == 'zip':
+        body = stream_zip(full_path, compress=request.args.get('compress') != '0')
+        mimetype = 'application/zip'
+    else:
+        body = stream_tar(full_path)
+        mimetype = 'application/x-tar'
+    
+    name = os.path.basename(safe_filepath.rstrip('/')) or 'files'
+    # 包的大小事先未知，不设置Content-Length，由服务器分块发送
+    response = Response(shape_iterable(body, start_transfer('download')), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        f"attachment; filename*=UTF-8''{urllib.parse.quote(f'{name}.{archive_format}')}"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/thumbs-placeholder.svg')
+def thumbnail_placeholder():
+    """缩略图加载前显示的占位图"""
+    response = Response(PLACEHOLDER_SVG, mimetype='image/svg+xml')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.route('/thumbs/<path:filepath>')
+def thumbnail(filepath):
+    """文件的缩略图，?s=尺寸，?v=文件修改时间（与当前文件一致时允许长期缓存）"""
+    if thumbnail_cache is None:
+        abort(404)
+    safe_filepath, full_path = resolve_share_path(filepath)
+    st = lookup_path(full_path)
+    if st is None or st.is_dir or not thumbnail_kind(full_path):
+        abort(404)
+    size = request.args.get('s', THUMBNAIL_SIZE, type=int)
+    if size not in (THUMBNAIL_SIZE, PREVIEW_SIZE):
+        size = THUMBNAIL_SIZE
+    
+    state, thumb_path = thumbnail_cache.lookup(full_path, st, size)
+    if state == PENDING:
+        # 已排队生成，客户端按Retry-After稍后重试
+        response = Response(PLACEHOLDER_SVG, 202, mimetype='image/svg+xml')
+        response.headers['Retry-After'] = '1'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    if state != READY:
+        response = Response(BROKEN_SVG, mimetype='image/svg+xml')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    etag = f'"{os.path.basename(thumb_path)}"'
+    # 只有URL中的版本与当前文件一致时才能标记为不可变
+    if request.args.get('v') == f'{st.st_mtime_ns:x}':
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+    if is_not_modified(request.headers, etag, None):
+        return not_modified_response(etag, None, cache_control)
+    thumb_size = os.path.getsize(thumb_path)
+    cached = file_cache.lookup(thumb_path, thumb_size) if file_cache is not None else None
+    response = file_response(request.environ, thumb_path, 0, thumb_size, 200, 'image/jpeg', cached=cached)
+    return set_validators(response, etag, None, cache_control)
+
+@app.route('/api/files/')
+@app.route('/api/files/<path:filepath>')
+def api_list_files(filepath=''):
+    """以JSON返回目录条目，支持游标分页、过滤和递归
+    
+    查询参数：
+      limit      每页条目数，默认1000，最大10000
+      cursor     上一页返回的next_cursor
+      glob       按名称通配符过滤，如 *.log
+      ext        按扩展名过滤，逗号分隔，如 jpg,png
+      type       只返回 file 或 dir
+      recursive  为1时递归列出子目录
+      depth      递归的最大深度，默认8，最大64
+    """
+    safe_filepath, full_path = resolve_share_path(filepath)
+    st = lookup_path(full_path)
+    if st is None:
+        return jsonify({'status': 'error', 'message': '路径不存在'}), 404
+    if not st.is_dir:
+        entry = DirectoryEntry(os.path.basename(full_path), False, st.st_size, st.st_mtime_ns)
+        return jsonify({'status': 'success', 'entry': entry_to_dict(entry, safe_filepath.rstrip('/'))})
+    
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int) or API_PAGE_SIZE, 1), API_MAX_PAGE_SIZE)
+    recursive = request.args.get('recursive') == '1'
+    depth = min(max(request.args.get('depth', 8, type=int) or 1, 1), 64) if recursive else 1
+    entry_type = request.args.get('type')
+    if entry_type not in (None, 'file', 'dir'):
+        return jsonify({'status': 'error', 'message': 'type 只能是 file 或 dir'}), 400
+    extensions = {ext.strip().lstrip('.').lower() for ext in request.args.get('ext', '').split(',') if ext.strip()}
+    accept = make_filter(request.args.get('glob'), extensions, entry_type)
+    
+    cursor_key = None
+    if request.args.get('cursor'):
+        try:
+            cursor_key = decode_cursor(request.args['cursor'])
+        except InvalidCursor:
+            return jsonify({'status': 'error', 'message': '无效的游标'}), 400
+    
+    try:
+        with Timer(listing_enumerate, view='api'):
+            entries, next_cursor = list_entries(listing_cache, config.share_folder, safe_filepath, limit, cursor_key,
+                                                accept, recursive, depth)
+    except PermissionError:
+        abort(403)
+    
+    result = {
+        'status': 'success',
+        'path': safe_filepath,
+        'entries': entries,
+        'next_cursor': next_cursor,
+    }
+    if st.total_size is not None:
+        # 元数据索引中的递归汇总
+        result['summary'] = {'total_size': st.total_size, 'file_count': st.file_count, 'dir_count': st.dir_count}
+    return jsonify(result)
+
+def parse_search_args(args):
+    """解析搜索参数，返回search_index.search的关键字参数；参数无效时抛出ValueError"""
+    mode = args.get('mode', 'substring')
+    if mode not in SEARCH_MODES:
+        raise ValueError(f'不支持的搜索方式: {mode}')
+    entry_type = args.get('type') or None
+    if entry_type not in (None, 'file', 'dir'):
+        raise ValueError('type 只能是 file 或 dir')
+    limit = args.get('limit', SEARCH_PAGE_SIZE, type=int) or SEARCH_PAGE_SIZE
+    after = None
+    if args.get('cursor'):
+        try:
+            after = int(args['cursor'])
+        except ValueError:
+            raise ValueError('无效的游标')
+    return {
+        'query': args.get('q', ''),
+        'mode': mode,
+        'extensions': [ext.strip().lstrip('.').lower() for ext in args.get('ext', '').split(',') if ext.strip()],
+        'entry_type': entry_type,
+        'within': resolve_share_path(args.get('path', ''))[0].strip('/'),
+        'limit': min(max(limit, 1), SEARCH_MAX_PAGE_SIZE),
+        'after': after,
+    }
+
+@app.route('/api/search')
+def api_search():
+    """按文件名搜索整个共享文件夹
+    
+    查询参数：
+      q       搜索词，含'/'时匹配相对路径，否则匹配名称，不区分大小写
+      mode    substring（包含，默认）或 prefix（开头为）
+      ext     按扩展名过滤，逗号分隔，如 jpg,png
+      type    只返回 file 或 dir
+      path    只在该目录（相对共享文件夹）下搜索
+      limit   每页条目数，默认100，最大1000
+      cursor  上一页返回的next_cursor
+    """
+    if search_index is None:
+        return jsonify({'status': 'error', 'message': '未启用搜索'}), 404
+    try:
+        results, next_cursor, truncated = search_index.search(**parse_search_args(request.args))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({
+        'status': 'success',
+        'results': [entry_to_dict(entry, path) for path, entry in results],
+        'next_cursor': str(next_cursor) if next_cursor is not None else None,
+        'truncated': truncated,
+        'indexing': not metadata_index.ready,
+    })
+
+@app.route('/search')
+def search_page():
+    """搜索结果页面，参数同/api/search"""
+    if search_index is None:
+        abort(404)
+    try:
+        search_args = parse_search_args(request.args)
+        results, next_cursor, truncated = search_index.search(**search_args)
+    except ValueError as e:
+        flash(f'搜索失败: {e}', 'error')
+        return redirect(request.referrer or url_for('list_files'))
+    
+    rows = []
+    for path, entry in results:
+        folder = os.path.dirname(path)
+        rows.append({
+            'is_dir': entry.is_dir,
+            'name': entry.name,
+            'url': f'/files/{urllib.parse.quote(path)}{"/" if entry.is_dir else ""}',
+            'size': human_readable_size(entry.size),
+            'folder': folder,
+            'folder_url': f'/files/{urllib.parse.quote(folder)}{"/" if folder else ""}',
+        })
+    within = search_args['within']
+    next_url = None
+    if next_cursor is not None:
+        next_url = '?' + urllib.parse.urlencode(dict(request.args.items(), cursor=next_cursor))
+    return get_search_template().render(
+        query=search_args['query'],
+        mode=search_args['mode'],
+        ext=request.args.get('ext', ''),
+        within=within,
+        back_url=f'/files/{urllib.parse.quote(within)}{"/" if within else ""}',
+        results=rows,
+        next_url=next_url,
+        truncated=truncated,
+        indexing=not metadata_index.ready,
+    )
+
+def upload_error_response(error):
+    return jsonify({'status': 'error', 'message': error.message}), error.status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """创建分块上传会话
+    
+    请求体JSON：path 目标目录（相对共享文件夹）、filename、size，
+    可选 chunk_size 期望的分块大小、sha256 整个文件的十六进制摘要（完成时校验）
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    filename = data.get('filename')
+    size = data.get('size')
+    if not filename or size is None:
+        return jsonify({'status': 'error', 'message': '缺少 filename 或 size'}), 400
+    if not isinstance(filename, str) or not isinstance(data.get('path', ''), str):
+        return jsonify({'status': 'error', 'message': 'filename 和 path 必须是字符串'}), 400
+    
+    target_dir, full_dir = resolve_share_path(data.get('path', ''))
+    if not os.path.isdir(full_dir):
+        return jsonify({'status': 'error', 'message': '目标目录不存在'}), 404
+    
+    try:
+        upload = upload_sessions.create(target_dir, make_safe_filename(filename), size,
+                                        data.get('chunk_size'), data.get('sha256'))
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    result = upload.to_dict()
+    result['status'] = 'success'
+    result['upload_url'] = url_for('upload_status', session_id=upload.id)
+    return jsonify(result), 201
+
+@app.route('/api/uploads/<session_id>', methods=['GET'])
+def upload_status(session_id):
+    """查询会话状态，received 为已收到的分块序号区间"""
+    try:
+        upload = upload_sessions.get(session_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    result = upload.to_dict()
+    result['status'] = 'success'
+    return jsonify(result)
+
+@app.route('/api/uploads/<session_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(session_id, index):
+    """上传一个分块，请求体为原始数据，Upload-Checksum: sha256 <base64摘要>"""
+    try:
+        upload = upload_sessions.get(session_id)
+        checksum = parse_upload_checksum(request.headers.get('Upload-Checksum'))
+        stream = shape_file(request.stream, start_transfer('upload', request.content_length), owns_transfer=False)
+        written = upload_sessions.write_chunk(upload, index, stream, request.content_length, checksum)
+    except UploadError as e:
+        return upload_error_response(e)
+    return jsonify({'status': 'success', 'index': index, 'size': written})
+
+@app.route('/api/uploads/<session_id>/complete', methods=['POST'])
+def complete_upload(session_id):
+    """所有分块到齐后组装文件并放入目标目录"""
+    try:
+        upload = upload_sessions.get(session_id)
+        target_dir, full_dir = resolve_share_path(upload.target_dir)
+        if not os.path.isdir(full_dir):
+            raise UploadError('目标目录不存在', 404)
+        file_path = os.path.join(full_dir, upload.filename)
+        upload_sessions.complete(upload, file_path)
+    except UploadError as e:
+        return upload_error_response(e)
+    # 只有声明并校验过整体摘要的上传可以直接入库，其余交给后台去重
+    if content_store is not None and upload.sha256:
+        content_store.ingest(file_path, upload.sha256)
+    fs_events.emit('created', file_path)
+    if metadata_index is not None and upload.sha256:
+        metadata_index.set_digest(file_path, upload.sha256)
+    return jsonify({'status': 'success', 'path': os.path.join(target_dir, upload.filename).replace(os.sep, '/')})
+
+@app.route('/api/uploads/<session_id>', methods=['DELETE'])
+def abort_upload(session_id):
+    """放弃上传，删除已收到的数据"""
+    try:
+        upload_sessions.abort(upload_sessions.get(session_id))
+    except UploadError as e:
+        return upload_error_response(e)
+    return jsonify({'status': 'success'})
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """在一个请求中执行多个文件操作
+    
+    请求体JSON：{"operations": [条目, ...]}，条目按顺序执行（互不相关的条目并发执行），路径均相对于共享文件夹：
+      {"op": "delete", "path": "a/b.txt"}（删除非空目录需要加上 "recursive": true）
+      {"op": "rename", "path": "a/b.txt", "name": "c.txt"}
+      {"op": "move", "path": "a/b.txt", "dest": "d", "name": "可选的新名称"}
+      {"op": "copy", "path": "a/b.txt", "dest": "d", "name": "可选的新名称"}
+      {"op": "mkdir", "path": "a/new"}
+    results 与 operations 一一对应；全部成功时 status 为 success，部分失败为 partial，全部失败为 error
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'status': 'error', 'message': '请求体应为 {"operations": [...]}'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'status': 'error', 'message': f'单次最多 {BATCH_MAX_OPERATIONS} 个操作'}), 413
+    batch_id, results = batch_operations.run(operations)
+    failed = sum(1 for result in results if result['status'] != 'success')
+    status = 'success' if not failed else 'error' if failed == len(results) else 'partial'
+    return jsonify({'status': status, 'batch_id': batch_id, 'succeeded': len(results) - failed, 'failed': failed,
+                    'results': results})
+
+def delta_error_response(error):
+    return jsonify({'status': 'error', 'message': error.message}), error.status
+
+@app.route('/api/delta/<path:filepath>', methods=['GET'])
+def delta_signature(filepath):
+    """文件的块签名（二进制，格式见delta_sync），?block_size= 指定块大小，默认按文件大小选择"""
+    safe_filepath, full_path = resolve_share_path(filepath)
+    if not os.path.isfile(full_path):
+        return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+    block_size = request.args.get('block_size', type=int) or default_block_size(os.path.getsize(full_path))
+    if not DELTA_MIN_BLOCK_SIZE <= block_size <= DELTA_MAX_BLOCK_SIZE:
+        return jsonify({'status': 'error', 'message': f'块大小应在 {DELTA_MIN_BLOCK_SIZE} 到 {DELTA_MAX_BLOCK_SIZE} 之间'}), 400
+    try:
+        signature_path = signature_cache.get(full_path, block_size)
+        signature_size = os.path.getsize(signature_path)
+    except DeltaError as e:
+        return delta_error_response(e)
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+    response = file_response(request.environ, signature_path, 0, signature_size, 200, 'application/octet-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/delta/<path:filepath>', methods=['POST'])
+def delta_upload(filepath):
+    """按增量（格式见delta_sync）重建文件的新版本并原子替换旧版本
+    
+    增量头中的base必须与服务器上文件当前的大小、修改时间一致，否则返回412，客户端应重新获取签名
+    """
+    safe_filepath, full_path = resolve_share_path(filepath)
+    if full_path == os.path.abspath(config.share_folder) or os.path.basename(full_path).startswith('.'):
+        return jsonify({'status': 'error', 'message': '无效的文件名'}), 400
+    existed = os.path.exists(full_path)
+    try:
+        stream = shape_file(request.stream, start_transfer('upload', request.content_length), owns_transfer=False)
+        sha256, signature, copied, literal = apply_delta(stream, full_path, UPLOAD_FSYNC_POLICY)
+    except DeltaError as e:
+        return delta_error_response(e)
+    if content_store is not None:
+        content_store.ingest(full_path, sha256)
+    fs_events.emit('created', full_path)
+    signature_cache.store(full_path, signature)
+    if metadata_index is not None:
+        metadata_index.set_digest(full_path, sha256)
+    return jsonify({'status': 'success', 'path': safe_filepath, 'created': not existed, 'sha256': sha256,
+                    'copied_bytes': copied, 'literal_bytes': literal})
+
+def integrity_unavailable():
+    return jsonify({'status': 'error', 'message': '未启用完整性巡检（需要元数据索引）'}), 404
+
+@app.route('/api/checksum/<path:filepath>')
+def file_checksum(filepath):
+    """文件的SHA-256摘要
+    
+    没有摘要时，不超过INTEGRITY_INLINE_MAX_BYTES的文件当场计算，更大的文件排队计算并返回202；
+    ?verify=1 时重新读取文件与记录的摘要比较（不受巡检速率限制），结果在verify字段中
+    """
+    if integrity_scrubber is None:
+        return integrity_unavailable()
+    safe_filepath, full_path = resolve_share_path(filepath)
+    st = lookup_path(full_path)
+    if st is None:
+        return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+    if st.is_dir:
+        return jsonify({'status': 'error', 'message': '目录没有摘要，请使用 /api/checksums/'}), 400
+    verify = request.args.get('verify') == '1'
+    result = None
+    if st.digest is None or verify:
+        if st.st_size > INTEGRITY_INLINE_MAX_BYTES and not verify:
+            integrity_scrubber.request(full_path)
+            response = jsonify({'status': 'pending', 'message': '摘要计算中，请稍后重试'})
+            response.status_code = 202
+            response.headers['Retry-After'] = '5'
+            return response
+        result = integrity_scrubber.checksum(full_path, verify)
+        st = lookup_path(full_path)
+    if st is None or st.digest is None:
+        return jsonify({'status': 'error', 'message': '文件在计算期间被修改，请重试'}), 409
+    rel = safe_filepath.rstrip('/')
+    verified_at = integrity_scrubber.verified_at(st.st_ino, st.st_size, st.st_mtime_ns)
+    body = {'status': 'success', 'path': rel, 'algorithm': 'sha256', 'sha256': st.digest, 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns, 'verified_at': verified_at, 'mismatch': integrity_scrubber.mismatch_for(rel)}
+    if verify:
+        body['verify'] = result
+    return jsonify(body)
+
+@app.route('/api/checksums/')
+@app.route('/api/checksums/<path:filepath>')
+def checksum_manifest(filepath=''):
+    """目录下所有已有摘要的文件的清单，sha256sum格式（路径相对于该目录），可直接用 sha256sum -c 校验
+    
+    还没有摘要的文件不在清单中，其数量见 X-Checksum-Pending 响应头
+    """
+    if integrity_scrubber is None:
+        return integrity_unavailable()
+    safe_filepath, full_path = resolve_share_path(filepath)
+    st = lookup_path(full_path)
+    if st is None or not st.is_dir:
+        return jsonify({'status': 'error', 'message': '目录不存在'}), 404
+    rel = safe_filepath.strip('/')
+    prefix = len(rel) + 1 if rel else 0
+    
+    def generate():
+        lines = []
+        for path, digest in integrity_scrubber.manifest(rel):
+            lines.append(f'{digest}  {path[prefix:]}\n')
+            if len(lines) >= 1000:
+                yield ''.join(lines).encode('utf-8')
+                lines = []
+        yield ''.join(lines).encode('utf-8')
+    
+    response = Response(generate(), mimetype='text/plain')
+    response.headers['X-Checksum-Pending'] = str(integrity_scrubber.pending_count(rel))
+    return response
+
+@app.route('/api/integrity', methods=['GET', 'POST'])
+def integrity_status():
+    """巡检状态和发现的不一致；POST立即开始一轮巡检（只允许本机访问）"""
+    if integrity_scrubber is None:
+        return integrity_unavailable()
+    if request.method == 'POST':
+        forbidden = admin_forbidden()
+        if forbidden is not None:
+            return forbidden
+        integrity_scrubber.trigger()
+    return jsonify({'status': 'success', 'integrity': integrity_scrubber.stats(),
+                    'mismatches': integrity_scrubber.mismatch_list()})
+
+@app.route('/api/cas')
+def cas_stats():
+    """去重存储的统计信息"""
+    if content_store is None:
+        return jsonify({'status': 'error', 'message': '未启用去重存储'}), 404
+    return jsonify({'status': 'success', 'cas': content_store.stats()})
+
+@app.route('/api/cas/dedup', methods=['POST'])
+def cas_dedup():
+    """在后台对共享文件夹中已有的文件去重"""
+    if content_store is None:
+        return jsonify({'status': 'error', 'message': '未启用去重存储'}), 404
+    if not content_store.start_dedup(exclude=[UPLOAD_SESSION_FOLDER]):
+        return jsonify({'status': 'error', 'message': '去重已在进行中'}), 409
+    return jsonify({'status': 'success', 'message': '开始后台去重'}), 202
+
+@app.route('/api/stats')
+def server_stats():
+    """缓存等内部统计信息"""
+    return jsonify({
+        'listing_cache': listing_cache.stats(),
+        'compression_cache': compression_cache.stats(),
+        'thumbnail_cache': thumbnail_cache.stats() if thumbnail_cache is not None else None,
+        'metadata_index': metadata_index.stats() if metadata_index is not None else None,
+        'search': search_index.stats() if search_index is not None else None,
+        'transfers': transfer_scheduler.stats(),
+        'batch': batch_operations.stats(),
+        'file_cache': file_cache.stats() if file_cache is not None else None,
+        'delta_signatures': signature_cache.stats(),
+        'integrity': integrity_scrubber.stats() if integrity_scrubber is not None else None,
+    })
+
+@app.route('/admin/limits', methods=['GET', 'PUT'])
+def admin_limits():
+    """查看或修改传输限制（只允许本机访问）
+    
+    PUT请求体为要修改的字段（JSON），例如 {"download_rate": 10485760, "client_download_rate": 2097152}，
+    速率单位为字节/秒，0 表示不限；修改从下一块起对正在按块发送的传输生效，
+    已经交给 sendfile 发送的未限速下载不受影响，新的限速只对之后开始的传输生效
+    """
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'status': 'error', 'message': '请求体必须是JSON对象'}), 400
+        try:
+            transfer_scheduler.set_limits(**data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    result = transfer_scheduler.stats()
+    result['status'] = 'success'
+    return jsonify(result)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus文本格式的运行指标（当前工作进程）"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE,
+                    headers={'Cache-Control': 'no-store'})
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """采样分析器（只允许本机访问）
+    
+    POST ?seconds=30 开始采样，到时自动停止；DELETE 提前停止；
+    GET 返回状态，?format=collapsed 返回折叠栈文本（可用flamegraph.pl或speedscope查看），?limit= 只取最多的若干条
+    """
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+    if request.method == 'POST':
+        seconds = request.args.get('seconds', 30, type=float)
+        if not 0 < seconds <= PROFILER_MAX_SECONDS:
+            return jsonify({'status': 'error', 'message': f'seconds 必须在 0 到 {PROFILER_MAX_SECONDS} 之间'}), 400
+        if not profiler.start(seconds):
+            return jsonify({'status': 'error', 'message': '采样已在进行中'}), 409
+    elif request.method == 'DELETE':
+        profiler.stop()
+    elif request.args.get('format') == 'collapsed':
+        return Response(profiler.report(request.args.get('limit', type=int)), mimetype='text/plain')
+    result = profiler.status()
+    result['status'] = 'success'
+    return jsonify(result)
+
 if __name__ == '__main__':
+    # 开发服务器，单进程；生产环境请用 python serve.py
     # 获取本机IP地址
     import socket
     hostname = socket.gethostname()
     local_ip = socket.gethostbyname(hostname)
     
     print(f"服务器启动中...")
-    print(f"本地访问地址: http://localhost:12345")
-    print(f"局域网访问地址: http://{local_ip}:12345")
+    print(f"本地访问地址: http://localhost:{config.port}")
+    print(f"局域网访问地址: http://{local_ip}:{config.port}")
     
-    app.run(host='0.0.0.0', port=12345, debug=True)
\ No newline at end of file
+    app.run(host=config.host, port=config.port, debug=config.debug)
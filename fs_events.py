@@ -0,0 +1,42 @@
+"""文件系统变更通知
+
+上传、删除、重命名等路由在修改共享文件夹后调用 emit()，
+缓存、索引等子系统通过 subscribe() 注册回调以便及时失效或更新。
+
+事件类型：
+  created  新建或覆盖了文件/目录        path 为其绝对路径
+  deleted  删除了文件/目录              path 为其绝对路径
+  renamed  文件/目录被重命名或移动      path 为原路径，dest_path 为新路径
+  modified 文件内容原地被修改           path 为其绝对路径
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(callback):
+    """注册回调 callback(event, path, dest_path)，返回 callback 本身便于用作装饰器"""
+    with _lock:
+        _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def emit(event, path, dest_path=None):
+    """通知所有订阅者，单个回调出错不影响其他回调和请求本身"""
+    with _lock:
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(event, path, dest_path)
+        except Exception:
+            logger.exception(f"处理文件事件 {event} {path} 时出错")
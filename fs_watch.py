@@ -0,0 +1,147 @@
+"""基于 Linux inotify 的目录监视
+
+通过 ctypes 直接调用 libc，不依赖第三方库；其他平台或调用失败时 available 为 False，
+调用方应退回到按修改时间检查。只监视目录本身（不递归），
+目录下条目的新建、删除、改名、写入和属性变化都会触发回调 callback(directory)。
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class DirectoryWatcher:
+    """监视一组目录，目录内容变化时在后台线程中回调 callback(directory)
+
+    队列溢出时无法知道哪些目录变了，会回调 overflow_callback()（未提供时对所有目录回调）。
+    """
+
+    def __init__(self, callback, overflow_callback=None):
+        self.callback = callback
+        self.overflow_callback = overflow_callback
+        self.available = False
+        self._fd = None
+        self._libc = None
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+        self._lock = threading.Lock()
+
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            logger.warning(f"inotify 初始化失败: {os.strerror(ctypes.get_errno())}")
+            return
+        self._libc = libc
+        self._fd = fd
+        self.available = True
+        threading.Thread(target=self._read_loop, name='inotify-watcher', daemon=True).start()
+
+    def watch(self, directory):
+        """开始监视目录，成功返回 True；已在监视时直接返回 True"""
+        if not self.available:
+            return False
+        with self._lock:
+            if directory in self._path_to_wd:
+                return True
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                # 常见原因是超过 fs.inotify.max_user_watches，调用方退回按修改时间检查
+                return False
+            self._wd_to_path[wd] = directory
+            self._path_to_wd[directory] = wd
+            return True
+
+    def unwatch(self, directory):
+        with self._lock:
+            wd = self._path_to_wd.pop(directory, None)
+            if wd is None:
+                return
+            self._wd_to_path.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def is_watching(self, directory):
+        with self._lock:
+            return directory in self._path_to_wd
+
+    def watched(self):
+        with self._lock:
+            return list(self._path_to_wd)
+
+    def _forget(self, wd):
+        with self._lock:
+            path = self._wd_to_path.pop(wd, None)
+            if path is not None and self._path_to_wd.get(path) == wd:
+                del self._path_to_wd[path]
+            return path
+
+    def _read_loop(self):
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except InterruptedError:
+                continue
+            except OSError:
+                logger.exception("读取 inotify 事件失败，停止监视")
+                self.available = False
+                return
+
+            changed = set()
+            overflow = False
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buf):
+                wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # 目录本身消失，监视随之失效
+                    path = self._forget(wd)
+                else:
+                    with self._lock:
+                        path = self._wd_to_path.get(wd)
+                if path is not None:
+                    changed.add(path)
+
+            if overflow:
+                if self.overflow_callback is not None:
+                    self._safe_call(self.overflow_callback)
+                else:
+                    changed.update(self.watched())
+            for path in changed:
+                self._safe_call(self.callback, path)
+
+    @staticmethod
+    def _safe_call(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("处理目录变化回调时出错")
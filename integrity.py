@@ -0,0 +1,353 @@
+"""后台完整性巡检和校验和清单
+
+摘要（SHA-256）保存在元数据索引的 digest 字段中：上传时在线计算，文件大小或修改时间变化后自动作废。
+巡检线程定期按路径顺序遍历索引中的文件，用有界线程池计算，总读取速率受 rate 限制：
+  - 没有摘要的文件（新文件、被修改过的文件、上传时没有计算的文件）：计算并存入索引
+  - 已有摘要、超过 verify_interval 没有核对过的文件：重新读取并与摘要比较；
+    大小和修改时间都没变而内容不同，即为静默损坏（位衰减、磁盘或文件系统错误），记录并报告
+核对状态和发现的不一致保存在单独的 SQLite 数据库中；核对状态按 (inode, 大小, 修改时间) 记录，
+重命名不会让已核对的文件重新核对，文件被修改后旧记录自然不再匹配，过期后清除。
+
+多个工作进程时只有拿到文件锁的进程执行巡检。
+"""
+import base64
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，多进程部署时每个进程各自巡检
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = 'sha256'
+READ_SIZE = 1024 * 1024
+# 每次从索引取出的文件数
+BATCH_SIZE = 500
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS verified ('
+    'ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, '
+    'verified_at REAL NOT NULL, PRIMARY KEY (ino, size, mtime_ns))',
+    'CREATE TABLE IF NOT EXISTS mismatches ('
+    'path TEXT PRIMARY KEY, expected TEXT NOT NULL, actual TEXT NOT NULL, size INTEGER NOT NULL, '
+    'mtime_ns INTEGER NOT NULL, detected_at REAL NOT NULL)',
+)
+
+
+def repr_digest_headers(digest):
+    """由十六进制 SHA-256 生成 Repr-Digest（RFC 9530）和旧的 Digest（RFC 3230）响应头"""
+    value = base64.b64encode(bytes.fromhex(digest)).decode('ascii')
+    return {'Repr-Digest': f'sha-256=:{value}:', 'Digest': f'SHA-256={value}'}
+
+
+class RateLimiter:
+    """令牌桶，多个线程共享；rate 为每秒字节数，0 表示不限"""
+
+    def __init__(self, rate, burst_seconds=0.5):
+        self.rate = rate
+        self.burst = rate * burst_seconds
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst) - amount
+            self._updated = now
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def hash_file(path, limiter=None):
+    """计算文件的 SHA-256，返回 (摘要, 读取前的 stat)；读取期间文件被修改时返回 (None, stat)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        before = os.fstat(f.fileno())
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            if limiter is not None:
+                limiter.consume(len(data))
+            digest.update(data)
+        after = os.fstat(f.fileno())
+    if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+        return None, before
+    return digest.hexdigest(), before
+
+
+class IntegrityScrubber:
+    """巡检元数据索引中的文件
+
+    workers 为并行读取的线程数，rate 为总读取速率（字节/秒，0 不限），
+    verify_interval 为同一文件两次核对的最短间隔（秒），pass_interval 为两轮巡检之间的间隔（秒）；
+    on_mismatch(path, expected, actual) 在发现不一致时调用。
+    """
+
+    def __init__(self, metadata_index, db_path, workers=2, rate=50 * 1024 ** 2, verify_interval=7 * 86400,
+                 pass_interval=3600, on_mismatch=None):
+        self.index = metadata_index
+        self.db_path = db_path
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.verify_interval = verify_interval
+        self.pass_interval = pass_interval
+        self.on_mismatch = on_mismatch
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='integrity')
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self.running = False
+        self.passes = 0
+        self.last_pass_at = None
+        self.last_pass_seconds = None
+        self.computed = 0
+        self.verified = 0
+        self.mismatches = 0
+        self.skipped = 0
+        self.bytes_read = 0
+        self.errors = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # 后台巡检
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='integrity-scrubber', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def trigger(self):
+        """立即开始下一轮巡检"""
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if self.index.ready:
+                try:
+                    self.run_pass()
+                except Exception:
+                    logger.exception('完整性巡检失败')
+                self._wakeup.wait(self.pass_interval)
+            else:
+                # 等元数据索引建好
+                self._wakeup.wait(5)
+            self._wakeup.clear()
+
+    @contextlib.contextmanager
+    def _pass_lock(self):
+        """其他进程正在巡检时返回 False"""
+        if fcntl is None:
+            yield True
+            return
+        with open(self.db_path + '.lock', 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def run_pass(self):
+        """巡检一轮，返回是否执行（其他进程正在巡检时不执行）"""
+        with self._pass_lock() as acquired:
+            if not acquired:
+                return False
+            self.running = True
+            started, timer = time.time(), time.perf_counter()
+            try:
+                after = None
+                while not self._stop.is_set():
+                    batch = self._next_batch(after)
+                    if not batch:
+                        break
+                    after = batch[-1][0]
+                    due = [row for row in batch if self._due(row, started)]
+                    for _ in self._pool.map(lambda row: self._check(*row), due):
+                        pass
+                self._expire(started)
+            finally:
+                self.running = False
+            self.passes += 1
+            self.last_pass_at = started
+            self.last_pass_seconds = time.perf_counter() - timer
+            return True
+
+    def _next_batch(self, after):
+        db = self.index.reader()
+        if after is None:
+            return db.execute('SELECT path, size, mtime_ns, ino, digest FROM entries WHERE is_dir = 0 '
+                              'ORDER BY path LIMIT ?', (BATCH_SIZE,)).fetchall()
+        return db.execute('SELECT path, size, mtime_ns, ino, digest FROM entries WHERE is_dir = 0 AND path > ? '
+                          'ORDER BY path LIMIT ?', (after, BATCH_SIZE)).fetchall()
+
+    def _due(self, row, now):
+        _path, size, mtime_ns, ino, digest = row
+        if digest is None:
+            return True
+        verified = self._execute('SELECT verified_at FROM verified WHERE ino = ? AND size = ? AND mtime_ns = ?',
+                                 (ino, size, mtime_ns))
+        return not verified or verified[0][0] < now - self.verify_interval
+
+    def _check(self, rel, size, mtime_ns, ino, expected, limiter=True):
+        """计算或核对一个文件，返回结果：computed / verified / mismatch / changed / error"""
+        path = os.path.join(self.index.share_root, *rel.split('/'))
+        try:
+            actual, st = hash_file(path, self.limiter if limiter else None)
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f'完整性巡检读取 {rel} 失败: {e}')
+            return 'error'
+        self.bytes_read += st.st_size
+        if actual is None or (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, ino):
+            # 文件刚被修改，索引随后会更新，下一轮再处理
+            self.skipped += 1
+            return 'changed'
+        now = time.time()
+        if expected is None or actual == expected:
+            if expected is None:
+                self.index.set_digest(path, actual)
+                self.computed += 1
+            else:
+                self.verified += 1
+            self._execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?)',
+                          (ino, size, mtime_ns, actual, now))
+            self._execute('DELETE FROM mismatches WHERE path = ?', (rel,))
+            return 'computed' if expected is None else 'verified'
+        self.mismatches += 1
+        logger.error(f'完整性巡检发现 {rel} 内容与记录的摘要不一致（大小和修改时间未变）：'
+                     f'记录 {expected}，实际 {actual}')
+        # 记为已核对，同一损坏不会每轮都重新报告；索引中的摘要保留上传时的值，下载时客户端可据此发现损坏
+        self._execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?)', (ino, size, mtime_ns, actual, now))
+        self._execute('INSERT OR REPLACE INTO mismatches VALUES (?, ?, ?, ?, ?, ?)',
+                      (rel, expected, actual, size, mtime_ns, now))
+        if self.on_mismatch is not None:
+            self.on_mismatch(path, expected, actual)
+        return 'mismatch'
+
+    def _expire(self, started):
+        """清除过期的核对记录，以及文件已不存在或已被替换的不一致记录"""
+        self._execute('DELETE FROM verified WHERE verified_at < ?', (started - 2 * self.verify_interval,))
+        db = self.index.reader()
+        for rel, size, mtime_ns in self._execute('SELECT path, size, mtime_ns FROM mismatches'):
+            row = db.execute('SELECT size, mtime_ns FROM entries WHERE path = ? AND is_dir = 0', (rel,)).fetchone()
+            if row is None or tuple(row) != (size, mtime_ns):
+                self._execute('DELETE FROM mismatches WHERE path = ?', (rel,))
+
+    # 按需
+
+    def _row(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.index.share_root).replace(os.sep, '/')
+        if rel == '.' or rel == '..' or rel.startswith('../'):
+            return None
+        return self.index.reader().execute('SELECT path, size, mtime_ns, ino, digest FROM entries '
+                                           'WHERE path = ? AND is_dir = 0', (rel,)).fetchone()
+
+    def checksum(self, path, verify=False):
+        """立即计算（没有摘要时）或核对（verify 为 True 时）一个文件，不受速率限制
+
+        返回 _check 的结果，文件不在索引中时返回 None。
+        """
+        row = self._row(path)
+        if row is None:
+            return None
+        if row[4] is not None and not verify:
+            return 'verified'
+        return self._check(*row, limiter=False)
+
+    def request(self, path):
+        """把文件排入线程池尽快计算摘要（受速率限制），已在排队时忽略"""
+        with self._pending_lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+
+        def run():
+            try:
+                row = self._row(path)
+                if row is not None and row[4] is None:
+                    self._check(*row)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(path)
+
+        self._pool.submit(run)
+
+    def verified_at(self, ino, size, mtime_ns):
+        rows = self._execute('SELECT verified_at FROM verified WHERE ino = ? AND size = ? AND mtime_ns = ?',
+                             (ino, size, mtime_ns))
+        return rows[0][0] if rows else None
+
+    def mismatch_for(self, rel):
+        rows = self._execute('SELECT expected, actual, detected_at FROM mismatches WHERE path = ?', (rel,))
+        return {'expected': rows[0][0], 'actual': rows[0][1], 'detected_at': rows[0][2]} if rows else None
+
+    def mismatch_list(self, limit=1000):
+        return [{'path': path, 'expected': expected, 'actual': actual, 'size': size, 'mtime_ns': mtime_ns,
+                 'detected_at': detected_at}
+                for path, expected, actual, size, mtime_ns, detected_at in self._execute(
+                    'SELECT * FROM mismatches ORDER BY detected_at DESC LIMIT ?', (limit,))]
+
+    @staticmethod
+    def _subtree(rel):
+        """rel 子树中文件的 SQL 条件（与元数据索引相同，用区间比较走主键索引）"""
+        if not rel:
+            return 'is_dir = 0', ()
+        return 'is_dir = 0 AND (path = ? OR (path >= ? AND path < ?))', (rel, rel + '/', rel + '0')
+
+    def manifest(self, rel=''):
+        """逐个产生 rel 子树中已有摘要的文件的 (相对路径, 摘要)，按路径排序"""
+        condition, params = self._subtree(rel)
+        yield from self.index.reader().execute(
+            f'SELECT path, digest FROM entries WHERE {condition} AND digest IS NOT NULL ORDER BY path', params)
+
+    def pending_count(self, rel=''):
+        """rel 子树中还没有摘要的文件数"""
+        condition, params = self._subtree(rel)
+        return self.index.reader().execute(
+            f'SELECT COUNT(*) FROM entries WHERE {condition} AND digest IS NULL', params).fetchone()[0]
+
+    def stats(self):
+        return {
+            'algorithm': ALGORITHM,
+            'running': self.running,
+            'passes': self.passes,
+            'last_pass_at': self.last_pass_at,
+            'last_pass_seconds': self.last_pass_seconds,
+            'computed': self.computed,
+            'verified': self.verified,
+            'mismatches': self.mismatches,
+            'open_mismatches': self._execute('SELECT COUNT(*) FROM mismatches')[0][0],
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'bytes_read': self.bytes_read,
+            'rate': self.limiter.rate,
+            'workers': self.workers,
+        }
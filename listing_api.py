@@ -0,0 +1,126 @@
+"""JSON 目录列表：游标分页、过滤和递归遍历
+
+条目顺序固定为深度优先先序：同一层目录在前、文件在后，各自按名称排序，
+目录的子孙紧跟在目录之后。每个条目的排序键是从根开始每一级 (类型, 名称) 组成的元组，
+元组比较恰好就是上述顺序，因此游标只需记住最后返回条目的排序键（键集分页），
+翻页时跳过整棵已返回的子树，期间目录增删也不会导致重复或遗漏。
+"""
+import base64
+import fnmatch
+import json
+import mimetypes
+import os
+
+# 目录排在文件前面
+_DIR = 0
+_FILE = 1
+
+
+class InvalidCursor(ValueError):
+    """游标无法解析"""
+
+
+def encode_cursor(key):
+    data = json.dumps([[kind, name] for kind, name in key], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8', 'surrogateescape')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8', 'surrogateescape'))
+        key = tuple((int(kind), str(name)) for kind, name in data)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not key or any(kind not in (_DIR, _FILE) for kind, _name in key):
+        raise InvalidCursor(cursor)
+    return key
+
+
+def make_filter(glob=None, extensions=None, entry_type=None):
+    """构造条目过滤函数；glob 匹配名称（不区分大小写），extensions 为不带点的小写扩展名集合"""
+    glob = glob.lower() if glob else None
+
+    def accept(entry):
+        if entry_type == 'file' and entry.is_dir:
+            return False
+        if entry_type == 'dir' and not entry.is_dir:
+            return False
+        name = entry.name.lower()
+        if glob and not fnmatch.fnmatchcase(name, glob):
+            return False
+        if extensions:
+            if entry.is_dir or '.' not in name or name.rsplit('.', 1)[1] not in extensions:
+                return False
+        return True
+
+    return accept
+
+
+def entry_to_dict(entry, relative_path):
+    item = {
+        'name': entry.name,
+        'path': relative_path,
+        'type': 'dir' if entry.is_dir else 'file',
+        'size': entry.size,
+        'mtime': entry.mtime_ns / 1e9,
+    }
+    if entry.file_count is not None:
+        item['file_count'] = entry.file_count
+    if not entry.is_dir:
+        item['mime'] = mimetypes.guess_type(entry.name)[0] or 'application/octet-stream'
+    return item
+
+
+def list_entries(cache, root, relative_dir, limit, cursor_key=None, accept=None,
+                 recursive=False, max_depth=1):
+    """从 root/relative_dir 开始按固定顺序返回最多 limit 个条目
+
+    返回 (条目字典列表, 下一页游标或 None)。起始目录通过 cache.get 读取（与 HTML 列表共享缓存），
+    递归时更深的目录优先使用缓存中已有的结果，否则通过 cache.loader 读取而不写入缓存，避免一次遍历挤掉热点目录；
+    与起始目录用同一个 loader，目录的 size 在各层含义一致（使用元数据索引时都是递归总大小）。
+    """
+    start_dir = os.path.join(root, relative_dir)
+    prefix = relative_dir.strip('/')
+    results = []
+    state = {'last_key': None, 'more': False}
+
+    def visit(directory, rel, key_prefix, depth, listing):
+        for kind, group in ((_DIR, listing.directories), (_FILE, listing.files)):
+            for entry in group:
+                key = key_prefix + ((kind, entry.name),)
+                entry_rel = f'{rel}/{entry.name}' if rel else entry.name
+                descend = kind == _DIR and recursive and depth < max_depth
+
+                if cursor_key is not None and key <= cursor_key:
+                    # 已返回过；只有游标位于这个目录内部时才需要进入
+                    if descend and cursor_key[:len(key)] == key:
+                        if not walk(os.path.join(directory, entry.name), entry_rel, key, depth + 1):
+                            return False
+                    continue
+
+                if accept is None or accept(entry):
+                    if len(results) >= limit:
+                        state['more'] = True
+                        return False
+                    results.append(entry_to_dict(entry, entry_rel))
+                    state['last_key'] = key
+
+                if descend:
+                    if not walk(os.path.join(directory, entry.name), entry_rel, key, depth + 1):
+                        return False
+        return True
+
+    def walk(directory, rel, key_prefix, depth):
+        listing = cache.peek(directory)
+        if listing is None:
+            try:
+                listing = cache.loader(directory)
+            except OSError:
+                # 无权限或遍历期间被删除的子目录直接跳过
+                return True
+        return visit(directory, rel, key_prefix, depth, listing)
+
+    visit(start_dir, prefix, (), 1, cache.get(start_dir))
+    next_cursor = encode_cursor(state['last_key']) if state['more'] and state['last_key'] else None
+    return results, next_cursor
@@ -0,0 +1,267 @@
+"""目录列表缓存
+
+每个目录只用一次 os.scandir 遍历得到条目（名称、类型、大小、修改时间），
+结果按目录缓存，并同时算好目录列表的 ETag 和 Last-Modified。
+
+失效方式：
+  - inotify 可用时监视已缓存的目录，目录内有任何变化立即丢弃缓存
+  - 否则退回检查目录修改时间，并给缓存设置较短的有效期
+    （目录修改时间不会因为其中文件内容变化而改变，大小可能过时）
+  - 上传、删除、重命名通过 fs_events 主动失效
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from fs_watch import DirectoryWatcher
+from validators import listing_etag
+
+# 一个目录条目；扫描得到的目录 size 为 0，来自元数据索引时为递归总大小，file_count 为其中的文件数
+DirectoryEntry = namedtuple('DirectoryEntry', ['name', 'is_dir', 'size', 'mtime_ns', 'file_count'],
+                            defaults=(None,))
+
+# 没有 inotify 时缓存的最长有效期（秒）
+FALLBACK_TTL = 2.0
+
+
+class DirectoryListing:
+    """一次扫描的结果"""
+
+    __slots__ = ('path', 'directories', 'files', 'etag', 'last_modified',
+                 'dir_mtime_ns', 'built_at', 'scan_seconds')
+
+    def __init__(self, path, directories, files, etag, last_modified, dir_mtime_ns, scan_seconds):
+        self.path = path
+        self.directories = directories
+        self.files = files
+        self.etag = etag
+        self.last_modified = last_modified
+        self.dir_mtime_ns = dir_mtime_ns
+        self.built_at = time.monotonic()
+        self.scan_seconds = scan_seconds
+
+    def __len__(self):
+        return len(self.directories) + len(self.files)
+
+
+# 支持的排序字段 -> 排序键；同值时按名称排序，保证分页稳定
+SORT_KEYS = {
+    'name': lambda entry: entry.name,
+    'size': lambda entry: (entry.size, entry.name),
+    'mtime': lambda entry: (entry.mtime_ns, entry.name),
+}
+
+
+def iter_directory(path):
+    """逐个产生目录条目（扫描顺序，不排序），用于流式输出未缓存的大目录"""
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+            except OSError:
+                continue
+            yield DirectoryEntry(entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime_ns)
+
+
+def _select(group, sort, descending, start, stop):
+    """从已按名称排序的 group 中取排序后第 [start, stop) 个条目
+
+    按名称排序时直接切片；其他字段用 heapq 只保留前 stop 个，内存与页大小相关而不是与目录大小相关。
+    """
+    if start >= stop:
+        return []
+    if sort == 'name':
+        if not descending:
+            return group[start:stop]
+        size = len(group)
+        return group[size - stop:size - start][::-1]
+    select = heapq.nlargest if descending else heapq.nsmallest
+    return select(stop, group, key=SORT_KEYS[sort])[start:]
+
+
+def page_entries(listing, sort='name', descending=False, offset=0, limit=None):
+    """按排序取出一页条目，目录总排在文件前面
+
+    目录大小未知（为 0）时，按大小排序的目录自然按名称排列。
+    """
+    total = len(listing)
+    stop = total if limit is None else min(offset + limit, total)
+    result = []
+    group_offset = 0
+    for group in (listing.directories, listing.files):
+        start = max(offset - group_offset, 0)
+        end = min(stop - group_offset, len(group))
+        if start < end:
+            result.append(_select(group, sort, descending, start, end))
+        group_offset += len(group)
+    return list(itertools.chain.from_iterable(result))
+
+
+def scan_directory(path):
+    """用一次 os.scandir 扫描目录，返回 DirectoryListing
+
+    没有权限时抛出 PermissionError，目录不存在时抛出 FileNotFoundError。
+    """
+    started = time.perf_counter()
+    dir_stat = os.stat(path)
+    directories = []
+    files = []
+    last_modified = dir_stat.st_mtime
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+            except OSError:
+                # 扫描过程中被删除或是失效的符号链接
+                continue
+            if is_dir:
+                directories.append(DirectoryEntry(entry.name, True, 0, st.st_mtime_ns))
+            else:
+                files.append(DirectoryEntry(entry.name, False, st.st_size, st.st_mtime_ns))
+            if st.st_mtime > last_modified:
+                last_modified = st.st_mtime
+    directories.sort()
+    files.sort()
+    etag = listing_etag(dir_stat, directories + files)
+    return DirectoryListing(path, directories, files, etag, last_modified,
+                            dir_stat.st_mtime_ns, time.perf_counter() - started)
+
+
+class ListingCache:
+    """按目录缓存 DirectoryListing，LRU 淘汰，总条目数有上限
+
+    loader(path) 负责在未命中时得到 DirectoryListing，默认直接扫描目录，也可以换成从元数据索引读取。
+    """
+
+    def __init__(self, max_directories=512, max_entries=2_000_000, use_inotify=True, loader=scan_directory):
+        self.loader = loader
+        self.max_directories = max_directories
+        self.max_entries = max_entries
+        self._listings = OrderedDict()
+        # 已缓存或正在扫描的目录 -> 版本号；扫描期间被失效会加一，扫描结果随之作废
+        self._versions = {}
+        self._building = {}
+        self._total_entries = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.watcher = DirectoryWatcher(self.invalidate, self.clear) if use_inotify else None
+
+    def get(self, path):
+        """返回目录的 DirectoryListing，必要时重新扫描"""
+        path = os.path.abspath(path)
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and self._is_fresh(listing):
+                self._listings.move_to_end(path)
+                self.hits += 1
+                return listing
+            self.misses += 1
+            version = self._versions.setdefault(path, 0)
+            self._building[path] = self._building.get(path, 0) + 1
+
+        try:
+            # 先建立监视再扫描，扫描期间发生的变化也能让这次结果失效；
+            # 监视失败（如超过 max_user_watches）时该目录退回按修改时间检查
+            if self.watcher is not None:
+                self.watcher.watch(path)
+            listing = self.loader(path)
+            with self._lock:
+                if self._versions.get(path) == version:
+                    self._store(path, listing)
+            return listing
+        finally:
+            with self._lock:
+                self._building[path] -= 1
+                if not self._building[path]:
+                    del self._building[path]
+                    if path not in self._listings:
+                        self._versions.pop(path, None)
+
+    def peek(self, path):
+        """只查缓存：有新鲜结果时返回 DirectoryListing，否则返回 None，不触发扫描"""
+        path = os.path.abspath(path)
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and self._is_fresh(listing):
+                self._listings.move_to_end(path)
+                self.hits += 1
+                return listing
+        return None
+
+    def _is_fresh(self, listing):
+        if self.watcher is not None and self.watcher.is_watching(listing.path):
+            return True
+        if time.monotonic() - listing.built_at > FALLBACK_TTL:
+            return False
+        try:
+            return os.stat(listing.path).st_mtime_ns == listing.dir_mtime_ns
+        except OSError:
+            return False
+
+    def _store(self, path, listing):
+        old = self._listings.pop(path, None)
+        if old is not None:
+            self._total_entries -= len(old)
+        self._listings[path] = listing
+        self._total_entries += len(listing)
+        while self._listings and (len(self._listings) > self.max_directories
+                                  or self._total_entries > self.max_entries):
+            evicted_path, evicted = self._listings.popitem(last=False)
+            self._total_entries -= len(evicted)
+            if evicted_path not in self._building:
+                self._versions.pop(evicted_path, None)
+            if self.watcher is not None:
+                self.watcher.unwatch(evicted_path)
+
+    def invalidate(self, path):
+        """丢弃某个目录的缓存"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._versions:
+                self._versions[path] += 1
+            listing = self._listings.pop(path, None)
+            if listing is not None:
+                self._total_entries -= len(listing)
+                self.invalidations += 1
+                if path not in self._building:
+                    self._versions.pop(path, None)
+                    if self.watcher is not None:
+                        self.watcher.unwatch(path)
+
+    def clear(self):
+        """丢弃全部缓存"""
+        with self._lock:
+            for path in self._versions:
+                self._versions[path] += 1
+            self.invalidations += len(self._listings)
+            self._listings.clear()
+            self._total_entries = 0
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：失效受影响的目录"""
+        for changed in (path, dest_path):
+            if changed is None:
+                continue
+            self.invalidate(os.path.dirname(os.path.abspath(changed)))
+            if event in ('deleted', 'renamed'):
+                self.invalidate(changed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'directories': len(self._listings),
+                'entries': self._total_entries,
+                'invalidation_mode': 'inotify' if self.watcher is not None and self.watcher.available else 'mtime',
+            }
@@ -0,0 +1,684 @@
+"""共享文件夹的元数据索引（SQLite）
+
+每个文件和目录一行：相对路径、类型、大小、修改时间、inode，以及缓存的内容摘要（SHA-256，
+文件大小或修改时间变化后自动作废）。目录行另外保存递归汇总的总大小、文件数和子目录数，
+任何条目变化时沿祖先链按差值更新，查看一个目录有多大不必再遍历整棵子树。
+
+保持最新：
+  - 启动时在后台用线程池并行扫描整个共享文件夹重建索引，旧索引中仍然有效的摘要会保留
+  - 上传、删除、重命名通过 fs_events 同步更新，请求返回后立即可见
+  - 所有已索引的目录用 inotify 监视，外部修改时把目录记为待核对，稍后由后台线程重新核对；
+    队列溢出时整体重建
+索引建好、所有目录都在监视中、且所在目录没有待核对的变化时，lookup() 直接返回索引中的结果，不再 stat；
+否则（重建中、没有 inotify、超过监视数上限）退回一次 os.stat，结果总是正确的。
+
+多个工作进程共用同一个数据库：重建用文件锁串行，后启动的进程发现索引在它启动之后刚建好就直接复用，
+每个进程各自监视目录，写入都在 BEGIN IMMEDIATE 事务中按数据库当前内容计算差值，重复处理同一变化不会重复计数。
+"""
+import contextlib
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，多进程重建不做互斥
+    fcntl = None
+
+from fs_watch import DirectoryWatcher
+from listing_cache import DirectoryEntry, DirectoryListing, scan_directory
+from validators import listing_etag
+
+logger = logging.getLogger(__name__)
+
+# 目录变化后等待多久再核对（秒），把写入过程中的一连串 inotify 事件合并成一次核对
+SYNC_DELAY = 0.2
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries ('
+    'path TEXT PRIMARY KEY, parent TEXT, name TEXT NOT NULL, is_dir INTEGER NOT NULL, '
+    'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, ino INTEGER NOT NULL, digest TEXT, '
+    'total_size INTEGER NOT NULL, file_count INTEGER NOT NULL, dir_count INTEGER NOT NULL, '
+    'complete INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+)
+_INSERT = 'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+_SELECT_ENTRY = ('SELECT is_dir, size, mtime_ns, ino, digest, total_size, file_count, dir_count '
+                 'FROM entries WHERE path = ?')
+
+
+class IndexEntry(namedtuple('IndexEntry', ['is_dir', 'st_size', 'st_mtime_ns', 'st_ino', 'digest',
+                                           'total_size', 'file_count', 'dir_count'])):
+    """一个文件或目录的元数据
+
+    字段名与 os.stat_result 一致，可以直接传给 file_etag、压缩缓存等接受 stat 结果的函数。
+    目录的 st_size 为 0，total_size/file_count/dir_count 为递归汇总（不在索引中时为 None）；
+    文件的 digest 为仍然有效的 SHA-256，没有时为 None。
+    """
+    __slots__ = ()
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+
+def stat_entry(path):
+    """不经过索引，用一次 os.stat 得到 IndexEntry；不存在或不是普通文件/目录时返回 None"""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        return IndexEntry(True, 0, st.st_mtime_ns, st.st_ino, None, None, None, None)
+    if stat.S_ISREG(st.st_mode):
+        return IndexEntry(False, st.st_size, st.st_mtime_ns, st.st_ino, None, st.st_size, 1, 0)
+    return None
+
+
+def _join(rel, name):
+    return f'{rel}/{name}' if rel else name
+
+
+def _parent(rel):
+    """上级目录的相对路径，根目录返回 None"""
+    return rel.rpartition('/')[0] if rel else None
+
+
+def _ancestors(rel):
+    parent = _parent(rel)
+    while parent is not None:
+        yield parent
+        parent = _parent(parent)
+
+
+def _subtree(rel):
+    """rel 的所有子孙（不含自身）的 SQL 条件和参数
+
+    用区间比较而不是 LIKE：区分大小写，也能用上主键索引（'/' 的下一个字符是 '0'）。
+    """
+    if not rel:
+        return "path != ''", ()
+    return 'path >= ? AND path < ?', (rel + '/', rel + '0')
+
+
+def _contribution(is_dir, total_size, file_count, dir_count):
+    """一个条目计入上级目录汇总的 (大小, 文件数, 目录数)"""
+    return total_size, file_count, dir_count + (1 if is_dir else 0)
+
+
+def _scan_one(root, rel, watch=None):
+    """扫描一个目录，返回 (rel, [(名称, 是否目录, stat), ...], 需要继续扫描的子目录)；无法读取时条目为 None
+
+    先建立监视再扫描，扫描期间发生的变化也会被发现。符号链接指向的目录只记录本身，不进入。
+    """
+    if watch is not None:
+        watch(rel)
+    children = []
+    subdirs = []
+    try:
+        with os.scandir(os.path.join(root, rel)) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    st = entry.stat()
+                except OSError:
+                    # 扫描过程中被删除或是失效的符号链接
+                    continue
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(_join(rel, entry.name))
+                elif not stat.S_ISREG(st.st_mode):
+                    continue
+                children.append((entry.name, is_dir, st))
+    except OSError:
+        return rel, None, []
+    return rel, children, subdirs
+
+
+def scan_tree(root, rel='', workers=8, watch=None):
+    """用线程池并行扫描 root 下 rel 整棵子树
+
+    返回 {相对目录: [(名称, 是否目录, stat), ...]}，无法读取的目录对应 None。
+    os.scandir 和 stat 都会释放 GIL，同时扫描多个目录可以把磁盘和网络文件系统的等待时间重叠起来。
+    """
+    tree = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metadata-scan') as pool:
+        pending = {pool.submit(_scan_one, root, rel, watch)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, children, subdirs = future.result()
+                tree[directory] = children
+                for subdir in subdirs:
+                    pending.add(pool.submit(_scan_one, root, subdir, watch))
+    return tree
+
+
+def _build_rows(rel, st, tree, digests):
+    """由扫描结果生成 rel 及其子孙的数据库行（第一行是 rel 本身），目录汇总自底向上计算
+
+    digests 为旧索引中的 {路径: (大小, 修改时间, 摘要)}，大小和修改时间都没变的文件沿用原摘要。
+    """
+    totals = {}
+    for directory in sorted(tree, key=lambda d: d.count('/') + 1 if d else 0, reverse=True):
+        total = [0, 0, 0]
+        for name, is_dir, child_st in tree[directory] or ():
+            if is_dir:
+                sub = totals.get(_join(directory, name), (0, 0, 0))
+                total[0] += sub[0]
+                total[1] += sub[1]
+                total[2] += sub[2] + 1
+            else:
+                total[0] += child_st.st_size
+                total[1] += 1
+        totals[directory] = total
+
+    def row(path, is_dir, entry_st):
+        parent, _, name = path.rpartition('/')
+        parent = parent if path else None
+        if is_dir:
+            total_size, file_count, dir_count = totals.get(path, (0, 0, 0))
+            return (path, parent, name, 1, 0, entry_st.st_mtime_ns, entry_st.st_ino, None,
+                    total_size, file_count, dir_count, int(tree.get(path) is not None))
+        old = digests.get(path)
+        digest = old[2] if old is not None and old[:2] == (entry_st.st_size, entry_st.st_mtime_ns) else None
+        return (path, parent, name, 0, entry_st.st_size, entry_st.st_mtime_ns, entry_st.st_ino, digest,
+                entry_st.st_size, 1, 0, 1)
+
+    rows = [row(rel, stat.S_ISDIR(st.st_mode), st)]
+    for directory, children in tree.items():
+        for name, is_dir, child_st in children or ():
+            rows.append(row(_join(directory, name), is_dir, child_st))
+    return rows
+
+
+class MetadataIndex:
+    """共享文件夹的元数据索引
+
+    on_change(directory) 在某个目录的列表内容（包括子目录的汇总大小）可能变化后调用，
+    directory 为绝对路径，整体重建后以 None 调用，用于失效目录列表缓存。
+    """
+
+    def __init__(self, share_root, db_path, use_inotify=True, scan_workers=8, on_change=None):
+        self.share_root = os.path.abspath(share_root)
+        self.db_path = db_path
+        self.scan_workers = scan_workers
+        self.on_change = on_change
+        self.ready = False
+        self.rebuild_seconds = None
+        self.reused = False
+        self.hits = 0
+        self.misses = 0
+        self._rebuilding = False
+        self._rebuild_again = False
+        self._rebuild_thread = None
+        self._watch_failures = 0
+        # 待核对的目录 -> 变化次数，核对期间又有新变化时不会被误删
+        self._dirty = {}
+        self._changed = set()
+        self._extensions = []
+        self._lock = threading.RLock()
+        self._state_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = self._connect()
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self.watcher = DirectoryWatcher(self._on_directory_changed, self.start) if use_inotify else None
+        threading.Thread(target=self._sync_loop, name='metadata-sync', daemon=True).start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        # 索引随时可以重建，不需要每次提交都刷盘
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def reader(self):
+        """每个线程一个只读连接，WAL 模式下读取不会被写入阻塞"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def attach(self, extension):
+        """挂接与 entries 表同步的附加索引（如 search_index.SearchIndex），须在 start() 之前调用
+
+        extension.install(db) 在事务中建表和触发器；整体重建时先调用 suspend(db)、写入后调用 resume(db)，
+        以便附加索引批量重建，而不是由触发器逐行维护。
+        """
+        with self._transaction() as db:
+            extension.install(db)
+        self._extensions.append(extension)
+
+    # 路径
+
+    def _relative(self, path):
+        """共享文件夹内的相对路径（根目录为 ''），不在共享文件夹内时返回 None"""
+        relative_path = os.path.relpath(os.path.abspath(path), self.share_root)
+        if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+            return None
+        return '' if relative_path == os.curdir else relative_path.replace(os.sep, '/')
+
+    def _absolute(self, rel):
+        return os.path.join(self.share_root, *rel.split('/')) if rel else self.share_root
+
+    # 查询
+
+    def _trusted(self, directory):
+        """目录 directory 中条目的索引结果是否可以不经 stat 直接使用"""
+        return (self.ready and not self._rebuilding and self.watcher is not None and self.watcher.available
+                and not self._watch_failures and directory not in self._dirty)
+
+    def lookup(self, path):
+        """返回 path 的 IndexEntry，不存在时返回 None
+
+        索引可信时不访问文件系统；否则 stat 一次，大小和修改时间与索引一致时仍带上摘要和目录汇总。
+        """
+        rel = self._relative(path)
+        if rel is None:
+            return stat_entry(path)
+        row = self.reader().execute(_SELECT_ENTRY, (rel,)).fetchone()
+        if row is not None and self._trusted(_parent(rel) or ''):
+            self.hits += 1
+            return IndexEntry(bool(row[0]), *row[1:])
+        self.misses += 1
+        entry = stat_entry(path)
+        if entry is not None and row is not None and entry.is_dir == bool(row[0]):
+            if entry.is_dir:
+                entry = entry._replace(total_size=row[5], file_count=row[6], dir_count=row[7])
+            elif (entry.st_size, entry.st_mtime_ns) == (row[1], row[2]):
+                entry = entry._replace(digest=row[4])
+        return entry
+
+    def listing(self, path):
+        """由索引构造目录的 DirectoryListing，子目录的 size 为递归总大小
+
+        索引不可信或目录内容不在索引中时退回 scan_directory；可作为 ListingCache 的 loader。
+        """
+        rel = self._relative(path)
+        if rel is None or not self._trusted(rel):
+            return scan_directory(path)
+        started = time.perf_counter()
+        db = self.reader()
+        # 在同一个读事务中取目录本身和它的条目，不会读到一半被更新
+        db.execute('BEGIN')
+        try:
+            row = db.execute('SELECT mtime_ns, ino, complete FROM entries WHERE path = ? AND is_dir = 1',
+                             (rel,)).fetchone()
+            if row is None or not row[2]:
+                return scan_directory(path)
+            children = db.execute('SELECT name, is_dir, size, mtime_ns, total_size, file_count FROM entries '
+                                  'WHERE parent = ?', (rel,)).fetchall()
+        finally:
+            db.execute('COMMIT')
+        directories = []
+        files = []
+        last_modified = row[0] / 1e9
+        for name, is_dir, size, mtime_ns, total_size, file_count in children:
+            if is_dir:
+                directories.append(DirectoryEntry(name, True, total_size, mtime_ns, file_count))
+            else:
+                files.append(DirectoryEntry(name, False, size, mtime_ns))
+            last_modified = max(last_modified, mtime_ns / 1e9)
+        directories.sort()
+        files.sort()
+        dir_stat = IndexEntry(True, 0, row[0], row[1], None, None, None, None)
+        etag = listing_etag(dir_stat, directories + files)
+        return DirectoryListing(os.path.abspath(path), directories, files, etag, last_modified,
+                                row[0], time.perf_counter() - started)
+
+    def get_digest(self, path):
+        """返回文件仍然有效的 SHA-256 摘要，没有时返回 None"""
+        entry = self.lookup(path)
+        return entry.digest if entry is not None and not entry.is_dir else None
+
+    def set_digest(self, path, digest):
+        """记录文件当前内容的摘要；只有文件在索引中且大小、修改时间与索引一致时才会保存"""
+        rel = self._relative(path)
+        if not rel:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._transaction() as db:
+            db.execute('UPDATE entries SET digest = ? WHERE path = ? AND is_dir = 0 AND size = ? AND mtime_ns = ?',
+                       (digest, rel, st.st_size, st.st_mtime_ns))
+
+    # 写入
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                self._changed.clear()
+                raise
+            self._db.execute('COMMIT')
+            changed = self._changed
+            self._changed = set()
+        if self.on_change is not None:
+            for rel in changed:
+                self.on_change(None if rel is None else self._absolute(rel))
+
+    def _watch(self, rel):
+        if self.watcher is not None and self.watcher.available:
+            if not self.watcher.watch(self._absolute(rel)):
+                with self._state_lock:
+                    self._watch_failures += 1
+
+    def _unwatch(self, rels):
+        if self.watcher is not None:
+            for rel in rels:
+                self.watcher.unwatch(self._absolute(rel))
+
+    def _prepare(self, rel):
+        """在事务之外读取 rel 的当前状态：不存在时返回 None，否则返回 (stat, 子树扫描结果)"""
+        path = self._absolute(rel)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            if rel and os.path.islink(path):
+                return st, {}
+            return st, scan_tree(self.share_root, rel, self.scan_workers, self._watch)
+        if stat.S_ISREG(st.st_mode):
+            return st, {}
+        return None
+
+    def _apply(self, db, rel, prepared):
+        """在事务中用 _prepare 的结果替换 rel 整棵子树，并把汇总的变化量加到祖先目录上
+
+        变化量按数据库中现有的行计算，同一变化被多个进程或多次事件处理也只计一次。
+        """
+        condition, params = _subtree(rel)
+        digests = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in db.execute(
+            f'SELECT path, size, mtime_ns, digest FROM entries WHERE digest IS NOT NULL AND (path = ? OR {condition})',
+            (rel,) + params)}
+        old = db.execute('SELECT is_dir, total_size, file_count, dir_count FROM entries WHERE path = ?',
+                         (rel,)).fetchone()
+        bulk = not rel and self._extensions
+        if bulk:
+            for extension in self._extensions:
+                extension.suspend(db)
+        old_dirs = set()
+        if old is not None and old[0]:
+            old_dirs = {path for (path,) in db.execute(
+                f'SELECT path FROM entries WHERE is_dir = 1 AND {condition}', params)}
+            old_dirs.add(rel)
+            db.execute(f'DELETE FROM entries WHERE {condition}', params)
+        db.execute('DELETE FROM entries WHERE path = ?', (rel,))
+
+        new = (0, 0, 0)
+        new_dirs = set()
+        if prepared is not None:
+            rows = _build_rows(rel, prepared[0], prepared[1], digests)
+            db.executemany(_INSERT, rows)
+            new = _contribution(bool(rows[0][3]), *rows[0][8:11])
+            new_dirs = {row[0] for row in rows if row[3] and row[11]}
+        if bulk:
+            for extension in self._extensions:
+                extension.resume(db)
+        self._unwatch(old_dirs - new_dirs)
+
+        old = _contribution(bool(old[0]), *old[1:]) if old is not None else (0, 0, 0)
+        self._add_to_ancestors(db, rel, tuple(n - o for n, o in zip(new, old)))
+        if rel:
+            self._changed.update(old_dirs | new_dirs)
+
+    def _add_to_ancestors(self, db, rel, delta):
+        ancestors = list(_ancestors(rel))
+        if any(delta):
+            db.executemany('UPDATE entries SET total_size = total_size + ?, file_count = file_count + ?, '
+                           'dir_count = dir_count + ? WHERE path = ?',
+                           [delta + (ancestor,) for ancestor in ancestors])
+        self._changed.update(ancestors)
+
+    def _touch(self, db, rel):
+        """更新目录本身的修改时间（目录列表的 ETag 用到它）"""
+        if rel is None:
+            return
+        try:
+            st = os.stat(self._absolute(rel))
+        except OSError:
+            return
+        db.execute('UPDATE entries SET mtime_ns = ?, ino = ? WHERE path = ? AND is_dir = 1',
+                   (st.st_mtime_ns, st.st_ino, rel))
+
+    def _is_indexed_dir(self, rel):
+        row = self.reader().execute('SELECT complete FROM entries WHERE path = ? AND is_dir = 1',
+                                     (rel,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def _refresh(self, rel):
+        """让索引中的 rel（文件，或目录及其整棵子树）与磁盘一致"""
+        # 上级目录还不在索引中（如刚创建的多级目录）时从最近的已索引祖先开始
+        while rel and not self._is_indexed_dir(_parent(rel)):
+            rel = _parent(rel)
+        prepared = self._prepare(rel)
+        with self._transaction() as db:
+            self._apply(db, rel, prepared)
+            self._touch(db, _parent(rel))
+
+    def _reconcile(self, directory):
+        """核对目录的直接子条目，只替换有变化的子条目；inotify 只告诉我们哪个目录变了"""
+        if not self._is_indexed_dir(directory):
+            self._refresh(directory)
+            return
+        _rel, children, _subdirs = _scan_one(self.share_root, directory)
+        if children is None:
+            # 目录已被删除或不再可读
+            self._refresh(directory)
+            return
+        indexed = {name: (bool(is_dir), size, mtime_ns, ino) for name, is_dir, size, mtime_ns, ino in
+                   self.reader().execute('SELECT name, is_dir, size, mtime_ns, ino FROM entries WHERE parent = ?',
+                                          (directory,))}
+        changed = {}
+        for name, is_dir, st in children:
+            old = indexed.pop(name, None)
+            if is_dir:
+                if old is None or not old[0] or old[3] != st.st_ino:
+                    changed[name] = self._prepare(_join(directory, name))
+            elif old != (False, st.st_size, st.st_mtime_ns, st.st_ino):
+                changed[name] = self._prepare(_join(directory, name))
+        for name in indexed:
+            changed[name] = None
+        with self._transaction() as db:
+            for name, prepared in changed.items():
+                self._apply(db, _join(directory, name), prepared)
+            self._touch(db, directory)
+            self._changed.add(directory)
+
+    def _rename(self, src, dst):
+        """重命名时直接改写路径，保留摘要、不重新扫描；src 不在索引中时返回 False"""
+        if not src or not dst or src == dst or dst.startswith(src + '/'):
+            return False
+        if not self._is_indexed_dir(_parent(dst)):
+            return False
+        try:
+            st = os.stat(self._absolute(dst))
+        except OSError:
+            return False
+        with self._transaction() as db:
+            row = db.execute('SELECT is_dir, total_size, file_count, dir_count FROM entries WHERE path = ?',
+                             (src,)).fetchone()
+            if row is None or bool(row[0]) != stat.S_ISDIR(st.st_mode):
+                return False
+            # 被覆盖的目标先移除
+            self._apply(db, dst, None)
+            contribution = _contribution(bool(row[0]), *row[1:])
+            self._add_to_ancestors(db, src, tuple(-n for n in contribution))
+            parent, _, name = dst.rpartition('/')
+            db.execute('UPDATE entries SET path = ?, parent = ?, name = ?, mtime_ns = ?, ino = ? WHERE path = ?',
+                       (dst, parent, name, st.st_mtime_ns, st.st_ino, src))
+            moved_dirs = []
+            if row[0]:
+                condition, params = _subtree(src)
+                moved_dirs = [path for (path,) in db.execute(
+                    f'SELECT path FROM entries WHERE is_dir = 1 AND {condition}', params)]
+                db.execute(f'UPDATE entries SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) '
+                           f'WHERE {condition}', (dst, len(src) + 1, dst, len(src) + 1) + params)
+                moved_dirs.append(src)
+            self._add_to_ancestors(db, dst, contribution)
+            self._touch(db, _parent(src))
+            self._touch(db, _parent(dst))
+        # 监视按路径登记，移动后的目录要以新路径重新监视
+        self._unwatch(moved_dirs)
+        for path in moved_dirs:
+            self._watch(dst + path[len(src):])
+        return True
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：同步更新受影响的条目"""
+        src = self._relative(path)
+        dst = self._relative(dest_path) if dest_path is not None else None
+        with self._state_lock:
+            deferred = self._rebuilding or not self.ready
+        if deferred:
+            # 重建的结果会整体写入，这期间的变化留到重建完成后核对
+            for rel in (src, dst):
+                if rel:
+                    self._mark_dirty(_parent(rel))
+            return
+        if event == 'renamed' and self._rename(src, dst):
+            return
+        for rel in (src, dst):
+            if rel is not None:
+                self._refresh(rel)
+
+    # 重建与后台核对
+
+    def start(self):
+        """在后台线程中重建索引；正在重建时记下需要再重建一次（如重建期间 inotify 队列溢出）"""
+        with self._state_lock:
+            if self._rebuild_thread is not None:
+                self._rebuild_again = True
+                return
+            self._rebuild_thread = threading.Thread(target=self._rebuild_loop, name='metadata-rebuild',
+                                                    daemon=True)
+            self._rebuild_thread.start()
+
+    def _rebuild_loop(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('重建元数据索引失败，退回逐次 stat')
+            with self._state_lock:
+                if not self._rebuild_again:
+                    self._rebuild_thread = None
+                    return
+                self._rebuild_again = False
+
+    @contextlib.contextmanager
+    def _rebuild_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.db_path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def rebuild(self):
+        """并行扫描整个共享文件夹重建索引
+
+        另一个进程在本次调用开始之后刚完成重建时直接复用它的结果，只建立监视。
+        """
+        started = time.time()
+        timer = time.perf_counter()
+        with self._state_lock:
+            self._rebuilding = True
+            self._watch_failures = 0
+        succeeded = False
+        try:
+            with self._rebuild_lock():
+                built_at = self.reader().execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+                self.reused = built_at is not None and float(built_at[0]) >= started
+                if self.reused:
+                    for (rel,) in self.reader().execute('SELECT path FROM entries WHERE is_dir = 1 AND complete = 1'):
+                        self._watch(rel)
+                else:
+                    prepared = self._prepare('')
+                    if prepared is None:
+                        raise FileNotFoundError(self.share_root)
+                    with self._transaction() as db:
+                        self._apply(db, '', prepared)
+                        db.execute("INSERT OR REPLACE INTO meta VALUES ('built_at', ?)", (repr(time.time()),))
+                        self._changed.add(None)
+            succeeded = True
+        finally:
+            with self._state_lock:
+                self._rebuilding = False
+                self.ready = self.ready or succeeded
+            # 重建期间积累的变化交给后台核对
+            self._wakeup.set()
+        self.rebuild_seconds = time.perf_counter() - timer
+        logger.info(f'元数据索引{"复用" if self.reused else "重建"}完成，用时 {self.rebuild_seconds:.2f} 秒')
+
+    def _on_directory_changed(self, path):
+        rel = self._relative(path)
+        if rel is not None:
+            self._mark_dirty(rel)
+
+    def _mark_dirty(self, rel):
+        with self._state_lock:
+            self._dirty[rel] = self._dirty.get(rel, 0) + 1
+        self._wakeup.set()
+
+    def _sync_loop(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(SYNC_DELAY)
+            with self._state_lock:
+                self._wakeup.clear()
+                if self._rebuilding or not self.ready:
+                    continue
+                batch = dict(self._dirty)
+            # 先核对上级目录，子目录可能随之被整体替换
+            for rel, generation in sorted(batch.items()):
+                try:
+                    self._reconcile(rel)
+                except Exception:
+                    logger.exception(f'核对目录 {rel or "/"} 失败')
+                with self._state_lock:
+                    if self._dirty.get(rel) == generation:
+                        del self._dirty[rel]
+
+    def stats(self):
+        db = self.reader()
+        files, dirs = db.execute('SELECT COALESCE(SUM(is_dir = 0), 0), COALESCE(SUM(is_dir), 0) '
+                                 'FROM entries').fetchone()
+        root = db.execute("SELECT total_size FROM entries WHERE path = ''").fetchone()
+        digests = db.execute('SELECT COUNT(*) FROM entries WHERE digest IS NOT NULL').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'ready': self.ready,
+            'rebuilding': self._rebuilding,
+            'rebuild_seconds': self.rebuild_seconds,
+            'reused': self.reused,
+            'files': files,
+            'directories': dirs,
+            'total_size': root[0] if root is not None else None,
+            'digests': digests,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'pending_directories': len(self._dirty),
+            'watched_directories': len(self.watcher.watched()) if self.watcher is not None else 0,
+            'watch_failures': self._watch_failures,
+            'mode': 'index' if self._trusted('') else 'stat',
+        }
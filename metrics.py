@@ -0,0 +1,370 @@
+"""运行指标和采样分析器
+
+  - Counter / Gauge / Histogram 三种指标，支持标签，线程安全，以 Prometheus 文本格式输出
+    （不依赖 prometheus_client）
+  - 各缓存、索引已有的 stats() 通过 add_stats() 在抓取时读取，热路径上不重复计数
+  - SamplingProfiler：按需在一段时间内定期抓取所有线程的调用栈，
+    输出折叠栈格式（每行 "帧;帧;帧 次数"），可直接交给 flamegraph.pl / speedscope 画火焰图
+
+指标保存在进程内，多进程部署时每个工作进程各自计数，抓取到的是处理该次请求的进程的数据，
+输出中带有 pid 指标以便区分。
+"""
+import bisect
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+# 请求耗时的默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(指标名后缀, [(标签名, 值), ...], 数值), ...]"""
+        with self._lock:
+            items = list(self._values.items())
+        return [('', list(zip(self.labelnames, key)), value) for key, value in sorted(items)]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 每个分桶各自的计数（最后一个是 +Inf），输出时再累加；以及总和
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        result = []
+        for key, counts, total in sorted(items):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                result.append(('_bucket', labels + [('le', _format_value(bound))], cumulative))
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, cumulative))
+        return result
+
+
+class Timer:
+    """with 语句计时，结束时记入直方图"""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class StreamTracker:
+    """统计正在发送正文的响应数和发送的字节数
+
+    wrap_file() 包装交给服务器发送的文件，保留 fileno()，不影响 sendfile（此时字节数按 Content-Length 另行统计）；
+    wrap_iterable() 包装生成器等流式正文，count_bytes 为 True 时（长度未知）按实际产出的字节计数。
+    两者都在 close() 时减少活动数。
+    """
+
+    def __init__(self, active, sent):
+        self.active = active
+        self.sent = sent
+
+    def wrap_file(self, f, kind='file'):
+        return _TrackedFile(f, self, kind)
+
+    def wrap_iterable(self, iterable, kind='stream', route='', count_bytes=True):
+        return _TrackedIterable(iterable, self, kind, route if count_bytes else None)
+
+
+class _TrackedFile:
+    def __init__(self, f, tracker, kind):
+        self.file = f
+        self.tracker = tracker
+        self.kind = kind
+        self.closed = False
+        tracker.active.inc(kind=kind)
+        # 限速的文件（transfer_scheduler.ShapedFile）没有 fileno()，这里也不能有
+        if hasattr(f, 'fileno'):
+            self.fileno = f.fileno
+        if hasattr(f, 'read_paced'):
+            self.read_paced = f.read_paced
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def close(self):
+        try:
+            if hasattr(self.file, 'close'):
+                self.file.close()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.tracker.active.dec(kind=self.kind)
+
+
+class _TrackedIterable:
+    def __init__(self, iterable, tracker, kind, route):
+        self.iterable = iterable
+        self.iterator = iter(iterable)
+        self.tracker = tracker
+        self.kind = kind
+        self.route = route
+        self.closed = False
+        tracker.active.inc(kind=kind)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = next(self.iterator)
+        if self.route is not None:
+            self.tracker.sent.inc(len(data), route=self.route)
+        return data
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.tracker.active.dec(kind=self.kind)
+
+
+class MetricsRegistry:
+    """指标集合，render() 输出所有指标"""
+
+    def __init__(self, namespace='file_server'):
+        self.namespace = namespace
+        self._metrics = []
+        # (前缀, stats 函数, 计数器字段, 仪表字段)
+        self._stats = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(f'{self.namespace}_{name}', documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(f'{self.namespace}_{name}', documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(f'{self.namespace}_{name}', documentation, labelnames, buckets))
+
+    def add_stats(self, prefix, stats, counters=(), gauges=()):
+        """抓取时调用 stats() 并把其中的字段输出为指标
+
+        字段值为字典时（如按方向区分的字节数），键作为 key 标签输出。
+        """
+        self._stats.append((prefix, stats, tuple(counters), tuple(gauges)))
+
+    def _stats_lines(self):
+        lines = []
+        for prefix, stats, counters, gauges in self._stats:
+            try:
+                values = stats()
+            except Exception as e:
+                lines.append(f'# {prefix} 的统计信息读取失败: {_escape(e)}')
+                continue
+            for kind, fields in (('counter', counters), ('gauge', gauges)):
+                for field in fields:
+                    value = values.get(field)
+                    if value is None:
+                        continue
+                    name = f'{self.namespace}_{prefix}_{field}'
+                    if kind == 'counter':
+                        name += '_total'
+                    lines.append(f'# TYPE {name} {kind}')
+                    if isinstance(value, dict):
+                        for key, item in sorted(value.items()):
+                            lines.append(f'{name}{_format_labels([("key", key)])} {_format_value(item)}')
+                    else:
+                        lines.append(f'{name} {_format_value(value)}')
+        return lines
+
+    def render(self):
+        lines = [f'# TYPE {self.namespace}_process_id gauge', f'{self.namespace}_process_id {os.getpid()}']
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        lines.extend(self._stats_lines())
+        lines.extend(_process_io_lines(self.namespace))
+        return '\n'.join(lines) + '\n'
+
+
+def _process_io_lines(namespace):
+    """进程实际从存储设备读取/写入的字节数（Linux 的 /proc/self/io），不含命中页缓存的读取"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ', 1) for line in f.read().splitlines() if ': ' in line)
+    except OSError:
+        return []
+    lines = []
+    for field, name in (('read_bytes', 'disk_read_bytes_total'), ('write_bytes', 'disk_write_bytes_total')):
+        if field in fields:
+            lines.append(f'# TYPE {namespace}_process_{name} counter')
+            lines.append(f'{namespace}_process_{name} {int(fields[field])}')
+    return lines
+
+
+class SamplingProfiler:
+    """按需开启的采样分析器
+
+    start(seconds) 后由后台线程每隔 interval 秒抓取一次所有线程的调用栈，持续 seconds 秒后自动停止；
+    只在开启期间有开销。结果按调用栈累计采样次数，report() 输出折叠栈格式。
+    """
+
+    def __init__(self, interval=0.01, max_stacks=20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = 0
+        self.started_at = None
+        self.deadline = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds):
+        """开始一次采样（清空上次结果），已在采样时返回 False"""
+        if self.running:
+            return False
+        with self._lock:
+            self._stacks = collections.Counter()
+            self.samples = 0
+        self._stop.clear()
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval) and time.monotonic() < self.deadline:
+            frames = sys._current_frames()
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = ';'.join(reversed(stack))
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+
+    def report(self, limit=None):
+        """折叠栈文本，按采样次数从多到少"""
+        with self._lock:
+            items = self._stacks.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+
+    def status(self):
+        return {
+            'running': self.running,
+            'samples': self.samples,
+            'stacks': len(self._stacks),
+            'interval': self.interval,
+            'started_at': self.started_at,
+            'remaining_seconds': max(self.deadline - time.monotonic(), 0.0) if self.running else 0.0,
+        }
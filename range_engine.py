@@ -0,0 +1,188 @@
+"""HTTP 范围请求处理（RFC 7233）
+
+支持：
+  - bytes=a-b、bytes=a-（开放结尾）、bytes=-n（后缀范围）
+  - 逗号分隔的多段范围，重叠或相距很近的段会合并
+  - 起点越界时返回 416 并带上 Content-Range: bytes */size
+  - If-Range（实体标签或日期）不匹配时退回完整响应；日期只在 Last-Modified 为强校验器时才可能匹配
+  - 多段范围以 multipart/byteranges 返回，全部从同一个文件句柄流式读取
+"""
+import os
+import re
+import time
+
+from flask import Response
+from werkzeug.http import parse_date
+
+from download_engine import FALLBACK_CHUNK_SIZE
+from transfer_scheduler import shape_iterable
+
+# 单个请求允许的最多范围段数，超过则忽略 Range 头返回完整文件，防止被用来放大请求
+MAX_RANGES = 64
+
+# 两段之间间隔小于该字节数时合并为一段，多发少量数据比多一个分段头更划算
+COALESCE_GAP = 80
+
+# 单个范围段：first-last，两端都可以省略（后缀范围省略 first），只接受 ASCII 数字
+_RANGE_SPEC = re.compile(r'([0-9]*)[ \t]*-[ \t]*([0-9]*)')
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 头语法正确，但没有任何一段落在文件范围内"""
+
+
+def parse_range_header(header, size):
+    """解析 Range 头，返回按起点排序、合并后的 [(start, end), ...]（闭区间）
+
+    Range 头无法识别时返回 None，调用方应当忽略它并返回完整文件；
+    所有范围段都无法满足时抛出 RangeNotSatisfiable。
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    parts = spec.split(',')
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    specs = 0
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        # str.isdigit() 也接受 '²' 等 Unicode 数字，int() 却无法转换，这里只认 ASCII 数字
+        match = _RANGE_SPEC.fullmatch(part)
+        if match is None:
+            return None
+        first, last = match.groups()
+        specs += 1
+
+        if not first:
+            # 后缀范围：最后 n 个字节
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            # 语法错误，整个 Range 头无效
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not specs:
+        # 如 bytes=, 这样一个范围段都没有，语法错误
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return coalesce_ranges(ranges)
+
+
+def coalesce_ranges(ranges, gap=COALESCE_GAP):
+    """按起点排序并合并重叠或相距小于 gap 字节的范围段"""
+    ranges = sorted(ranges)
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1 + gap:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(if_range, etag=None, last_modified=None, now=None):
+    """判断 If-Range 是否允许返回部分内容
+
+    if_range 为实体标签时需要与 etag 强匹配（弱标签一律不匹配），
+    为 HTTP 日期时需要与 last_modified（秒级时间戳）完全相等，
+    且 last_modified 须为强校验器：至少比当前时间（now，默认 time.time()）早一秒（RFC 7232 2.2.2），
+    否则同一秒内的再次修改无法区分。
+    没有 If-Range 头时总是允许。
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        return False
+    if if_range.startswith('"'):
+        return etag is not None and not etag.startswith('W/') and if_range == etag
+    date = parse_date(if_range)
+    if date is None or last_modified is None:
+        return False
+    if (time.time() if now is None else now) - last_modified < 1:
+        return False
+    return int(date.timestamp()) == int(last_modified)
+
+
+def range_not_satisfiable_response(size):
+    """构造 416 响应"""
+    response = Response('', 416)
+    response.headers['Content-Range'] = f'bytes */{size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def make_boundary():
+    return os.urandom(12).hex()
+
+
+def _part_header(boundary, mimetype, start, end, size):
+    return (
+        f'\r\n--{boundary}\r\n'
+        f'Content-Type: {mimetype}\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n'
+        '\r\n'
+    ).encode('latin-1')
+
+
+def multipart_byteranges_response(file_path, ranges, size, mimetype, transfer=None, cached=None):
+    """构造 multipart/byteranges 的 206 响应
+
+    各段依次从同一个文件句柄读取（给出 cached 时从缓存的 memoryview 切片），Content-Length 预先精确计算；
+    transfer、cached 见 download_engine.file_response。
+    """
+    boundary = make_boundary()
+    headers = [_part_header(boundary, mimetype, start, end, size) for start, end in ranges]
+    closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges) + len(closing)
+
+    def generate_cached():
+        view = cached.view()
+        try:
+            for header, (start, end) in zip(headers, ranges):
+                yield header
+                for offset in range(start, end + 1, FALLBACK_CHUNK_SIZE):
+                    yield bytes(view[offset:min(offset + FALLBACK_CHUNK_SIZE, end + 1)])
+            yield closing
+        finally:
+            view.release()
+
+    def generate():
+        with open(file_path, 'rb') as f:
+            for header, (start, end) in zip(headers, ranges):
+                yield header
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(FALLBACK_CHUNK_SIZE, remaining))
+                    if not data:
+                        return
+                    remaining -= len(data)
+                    yield data
+            yield closing
+
+    response = Response(shape_iterable(generate_cached() if cached is not None else generate(), transfer), 206,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
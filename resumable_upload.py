@@ -0,0 +1,308 @@
+"""可断点续传、可并行的分块上传
+
+流程（参考 tus 协议）：
+  1. 客户端创建上传会话，声明目标目录、文件名、总大小，服务器确定分块大小
+  2. 客户端以任意顺序、任意并发上传各个分块，每块带 Upload-Checksum 校验
+  3. 断线后查询会话，得到已收到的分块范围，只补传缺失部分
+  4. 全部到齐后请求完成，服务器把组装好的文件原子地放入目标目录
+
+每个会话是会话目录下的一个子目录：
+  meta.json    创建时写入的会话信息，之后不再修改
+  data.part    预分配为最终大小的数据文件，各分块用 os.pwrite 写到各自偏移
+  chunks.map   每个分块一个字节，收到并校验通过后置 1
+
+分块之间互不重叠，状态只存在于文件中，多线程、多进程同时写入同一会话无需加锁。
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# 从请求体读取分块数据时每次读取的字节数
+READ_SIZE = 1024 * 1024
+
+_SHA256_HEX = re.compile(r'[0-9a-fA-F]{64}')
+
+
+def _is_int(value):
+    # JSON 的 true/false 解析为 bool，它也是 int 的子类
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class UploadError(Exception):
+    """上传会话操作失败，status 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class UploadSession:
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.id = meta['id']
+        self.target_dir = meta['target_dir']
+        self.filename = meta['filename']
+        self.size = meta['size']
+        self.chunk_size = meta['chunk_size']
+        self.chunk_count = meta['chunk_count']
+        self.sha256 = meta.get('sha256')
+        self.created = meta['created']
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, 'data.part')
+
+    @property
+    def map_path(self):
+        return os.path.join(self.directory, 'chunks.map')
+
+    def chunk_length(self, index):
+        if index == self.chunk_count - 1:
+            return self.size - self.chunk_size * index
+        return self.chunk_size
+
+    def received_map(self):
+        with open(self.map_path, 'rb') as f:
+            return f.read()
+
+    def received_ranges(self):
+        """已收到的分块，合并为 [[起始序号, 结束序号], ...]（闭区间）"""
+        ranges = []
+        for index, flag in enumerate(self.received_map()):
+            if not flag:
+                continue
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return ranges
+
+    def to_dict(self):
+        received = self.received_map()
+        received_count = sum(1 for flag in received if flag)
+        received_bytes = sum(self.chunk_length(i) for i, flag in enumerate(received) if flag)
+        return {
+            'id': self.id,
+            'path': self.target_dir,
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self.chunk_count,
+            'received_chunks': received_count,
+            'received_bytes': received_bytes,
+            'received': self.received_ranges(),
+            'complete': received_count == self.chunk_count,
+        }
+
+
+def parse_upload_checksum(header):
+    """解析 "Upload-Checksum: sha256 <base64>"，返回摘要字节"""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError('只支持 sha256 校验', 400)
+    try:
+        digest = base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        raise UploadError('Upload-Checksum 格式错误', 400)
+    if len(digest) != hashlib.sha256().digest_size:
+        raise UploadError('Upload-Checksum 长度错误', 400)
+    return digest
+
+
+class UploadSessionManager:
+    """管理会话目录下的所有上传会话"""
+
+    def __init__(self, session_root, session_ttl=24 * 3600, require_checksum=True, gc_interval=600):
+        self.session_root = session_root
+        self.session_ttl = session_ttl
+        self.require_checksum = require_checksum
+        os.makedirs(session_root, exist_ok=True)
+        if gc_interval:
+            threading.Thread(target=self._gc_loop, args=(gc_interval,), name='upload-gc', daemon=True).start()
+
+    def _session_dir(self, session_id):
+        # 会话ID只能是uuid的十六进制形式，防止路径穿越
+        if len(session_id) != 32 or any(c not in '0123456789abcdef' for c in session_id):
+            raise UploadError('上传会话不存在', 404)
+        return os.path.join(self.session_root, session_id)
+
+    def create(self, target_dir, filename, size, chunk_size=None, sha256=None):
+        # 参数来自请求体 JSON，类型都要检查，且在创建会话目录之前检查
+        if not _is_int(size) or size < 0:
+            raise UploadError('文件大小无效', 400)
+        if chunk_size is not None and not _is_int(chunk_size):
+            raise UploadError('chunk_size 必须是整数', 400)
+        if sha256 is not None and not (isinstance(sha256, str) and _SHA256_HEX.fullmatch(sha256)):
+            raise UploadError('sha256 必须是 64 位十六进制字符串', 400)
+        chunk_size = min(max(chunk_size or DEFAULT_CHUNK_SIZE, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        chunk_count = max((size + chunk_size - 1) // chunk_size, 1)
+        session_id = uuid.uuid4().hex
+        directory = self._session_dir(session_id)
+
+        meta = {
+            'id': session_id,
+            'target_dir': target_dir,
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'chunk_count': chunk_count,
+            'sha256': sha256.lower() if sha256 else None,
+            'created': time.time(),
+        }
+        os.makedirs(directory)
+        session = UploadSession(directory, meta)
+        try:
+            with open(session.data_path, 'wb') as f:
+                if size and hasattr(os, 'posix_fallocate'):
+                    # 预先占用磁盘空间，空间不足时在创建阶段就失败
+                    os.posix_fallocate(f.fileno(), 0, size)
+                else:
+                    f.truncate(size)
+            with open(session.map_path, 'wb') as f:
+                f.write(bytes(chunk_count))
+            with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        except OSError as e:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise UploadError(f'创建上传会话失败: {e}', 507)
+        return session
+
+    def get(self, session_id):
+        directory = self._session_dir(session_id)
+        try:
+            with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('上传会话不存在', 404)
+        return UploadSession(directory, meta)
+
+    def write_chunk(self, session, index, stream, content_length, checksum=None):
+        """从 stream 读取第 index 块并写入，返回写入的字节数"""
+        if not 0 <= index < session.chunk_count:
+            raise UploadError('分块序号超出范围', 416)
+        expected = session.chunk_length(index)
+        if content_length is not None and content_length != expected:
+            raise UploadError(f'分块大小应为 {expected} 字节', 400)
+        if checksum is None and self.require_checksum:
+            raise UploadError('缺少 Upload-Checksum 头', 400)
+
+        digest = hashlib.sha256()
+        offset = index * session.chunk_size
+        written = 0
+        fd = os.open(session.data_path, os.O_WRONLY)
+        try:
+            while written < expected:
+                data = stream.read(min(READ_SIZE, expected - written))
+                if not data:
+                    break
+                digest.update(data)
+                view = memoryview(data)
+                while view:
+                    n = os.pwrite(fd, view, offset + written)
+                    view = view[n:]
+                    written += n
+            if written != expected:
+                raise UploadError('分块数据不完整', 400)
+            if checksum is not None and digest.digest() != checksum:
+                # 数据已写入但不标记为收到，客户端重传时覆盖
+                raise UploadError('分块校验失败', 460)
+            if hasattr(os, 'fdatasync'):
+                os.fdatasync(fd)
+            else:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        # 数据落盘后再标记，崩溃时最坏情况是重传一块
+        map_fd = os.open(session.map_path, os.O_WRONLY)
+        try:
+            os.pwrite(map_fd, b'\x01', index)
+        finally:
+            os.close(map_fd)
+        return written
+
+    def complete(self, session, final_path):
+        """校验并把组装好的文件原子地移动到 final_path"""
+        received = session.received_map()
+        missing = [i for i, flag in enumerate(received) if not flag]
+        if missing:
+            raise UploadError(f'还有 {len(missing)} 个分块未上传', 409)
+
+        if session.sha256:
+            digest = hashlib.sha256()
+            with open(session.data_path, 'rb') as f:
+                for block in iter(lambda: f.read(READ_SIZE), b''):
+                    digest.update(block)
+            if digest.hexdigest() != session.sha256:
+                raise UploadError('文件整体校验失败', 460)
+
+        target_dir = os.path.dirname(final_path)
+        try:
+            os.replace(session.data_path, final_path)
+        except OSError:
+            # 会话目录与目标不在同一文件系统：先复制到目标目录的临时文件，再原子替换
+            tmp_path = os.path.join(target_dir, f'.{session.id}.uploading')
+            try:
+                with open(session.data_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, READ_SIZE)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp_path, final_path)
+            except OSError as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise UploadError(f'保存文件失败: {e}', 500)
+        shutil.rmtree(session.directory, ignore_errors=True)
+
+    def abort(self, session):
+        shutil.rmtree(session.directory, ignore_errors=True)
+
+    def collect_garbage(self):
+        """删除超过 session_ttl 没有任何分块写入的会话，返回删除数量"""
+        removed = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.session_root)
+        except OSError:
+            return 0
+        for name in names:
+            directory = os.path.join(self.session_root, name)
+            try:
+                last_activity = max(os.path.getmtime(os.path.join(directory, 'chunks.map')),
+                                    os.path.getmtime(directory))
+            except OSError:
+                # 创建到一半的会话，以目录时间为准
+                try:
+                    last_activity = os.path.getmtime(directory)
+                except OSError:
+                    continue
+            if now - last_activity > self.session_ttl:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"清理了 {removed} 个过期的上传会话")
+        return removed
+
+    def _gc_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.collect_garbage()
+            except Exception:
+                logger.exception("清理上传会话时出错")
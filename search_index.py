@@ -0,0 +1,198 @@
+"""文件名搜索
+
+在元数据索引的数据库中建一张 SQLite FTS5 全文表（trigram 分词），以外部内容方式引用 entries 表，
+对每个条目的名称和相对路径建立三字索引，子串、前缀、扩展名查询都能走索引，几百万条路径也只需几毫秒。
+
+索引由 entries 表上的触发器维护，元数据索引每次增量更新（fs_events 的上传、删除、重命名，以及
+inotify 发现的外部修改）都会同步到搜索表；整体重建时触发器暂时移除，写完后用 FTS5 的 rebuild 批量重建，
+比逐行触发快几倍。
+
+查询：
+  - 子串：不少于 3 个字符时用短语匹配（字面匹配，_、% 等没有特殊含义）
+  - 前缀：不少于 3 个字符时用 LIKE 'q%'，同样由三字索引加速
+  - 更短的查询（如两个汉字）无法使用三字索引，直接在 entries 表上按 LIKE 扫描，
+    由 timeout 限制最长时间，超时返回已找到的结果
+  - 查询中含 '/' 时匹配相对路径，否则只匹配名称；均不区分大小写
+结果按条目在表中的顺序返回，游标为最后检查过的行号。
+"""
+import sqlite3
+import time
+
+from listing_cache import DirectoryEntry
+
+# 单次查询的最长时间（秒），无法使用索引的短查询在大索引上可能需要全表扫描
+SEARCH_TIMEOUT = 2.0
+
+MODES = ('substring', 'prefix')
+
+# 三字分词，不区分大小写；content= 表示内容从 entries 表读取，搜索表只保存索引本身
+_CREATE_TABLE = ("CREATE VIRTUAL TABLE IF NOT EXISTS name_search USING fts5("
+                 "name, path, content='entries', content_rowid='rowid', tokenize='trigram')")
+_TRIGGERS = {
+    'name_search_insert': (
+        'AFTER INSERT ON entries BEGIN '
+        'INSERT INTO name_search(rowid, name, path) VALUES (new.rowid, new.name, new.path); END'),
+    'name_search_delete': (
+        'AFTER DELETE ON entries BEGIN '
+        "INSERT INTO name_search(name_search, rowid, name, path) VALUES ('delete', old.rowid, old.name, old.path); "
+        'END'),
+    'name_search_update': (
+        'AFTER UPDATE OF path, name ON entries BEGIN '
+        "INSERT INTO name_search(name_search, rowid, name, path) VALUES ('delete', old.rowid, old.name, old.path); "
+        'INSERT INTO name_search(rowid, name, path) VALUES (new.rowid, new.name, new.path); END'),
+}
+# 搜索表结构变化时加一，旧数据库会整体重建一次
+_SCHEMA_VERSION = '1'
+
+_COLUMNS = 'e.rowid, e.path, e.name, e.is_dir, e.size, e.total_size, e.file_count, e.mtime_ns'
+_SELECT_FTS = f'SELECT {_COLUMNS} FROM name_search JOIN entries e ON e.rowid = name_search.rowid WHERE '
+_SELECT_PLAIN = f'SELECT {_COLUMNS} FROM entries e WHERE '
+
+_FETCH_SIZE = 256
+
+
+def _phrase(text):
+    """FTS5 短语字面量：整体用双引号括起，内部的双引号写两次"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+class SearchIndex:
+    """挂接在 MetadataIndex 上的文件名搜索"""
+
+    def __init__(self, metadata_index, timeout=SEARCH_TIMEOUT):
+        self.metadata_index = metadata_index
+        self.timeout = timeout
+        self.queries = 0
+        self.truncated = 0
+        self.query_seconds = 0.0
+        metadata_index.attach(self)
+
+    # MetadataIndex 的附加索引接口
+
+    def install(self, db):
+        db.execute(_CREATE_TABLE)
+        version = db.execute("SELECT value FROM meta WHERE key = 'search_schema'").fetchone()
+        if version is None or version[0] != _SCHEMA_VERSION:
+            # 首次启用搜索时 entries 中可能已有数据
+            db.execute("INSERT INTO name_search(name_search) VALUES ('rebuild')")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('search_schema', ?)", (_SCHEMA_VERSION,))
+        self._create_triggers(db)
+
+    def suspend(self, db):
+        for name in _TRIGGERS:
+            db.execute(f'DROP TRIGGER IF EXISTS {name}')
+        db.execute("INSERT INTO name_search(name_search) VALUES ('delete-all')")
+
+    def resume(self, db):
+        db.execute("INSERT INTO name_search(name_search) VALUES ('rebuild')")
+        self._create_triggers(db)
+
+    @staticmethod
+    def _create_triggers(db):
+        for name, body in _TRIGGERS.items():
+            db.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+    # 查询
+
+    def search(self, query='', mode='substring', extensions=(), entry_type=None, within='', limit=100, after=None):
+        """搜索名称（或含 '/' 时的路径）
+
+        extensions 为不带点的小写扩展名，entry_type 为 'file'/'dir'/None，within 为限定的目录（相对路径）。
+        返回 (结果列表 [(相对路径, DirectoryEntry)], 下一页游标或 None, 是否因超时截断)。
+        至少需要 query 或 extensions 之一，否则抛出 ValueError。
+        """
+        if mode not in MODES:
+            raise ValueError(f'不支持的搜索方式: {mode}')
+        query = query.strip()
+        if not query and not extensions:
+            raise ValueError('缺少搜索条件')
+        column = 'path' if '/' in query else 'name'
+        # 能用三字索引的条件放在搜索表上，其余（少于 3 个字符）直接在 entries 上按 LIKE 扫描
+        fts_conditions = []
+        conditions = ["e.path != ''"]
+        params = []
+        if query and len(query) >= 3:
+            if mode == 'substring':
+                fts_conditions.append(('name_search MATCH ?', f'{column} : {_phrase(query)}'))
+            else:
+                fts_conditions.append((f'name_search.{column} LIKE ?', f'{query}%'))
+        elif query:
+            conditions.append(f'e.{column} LIKE ?')
+            params.append(f'{query}%' if mode == 'prefix' else f'%{query}%')
+        if extensions:
+            table = 'name_search' if all(len(ext) >= 2 for ext in extensions) else 'e'
+            conditions.append('(' + ' OR '.join(f'{table}.name LIKE ?' for _ in extensions) + ')')
+            params.extend(f'%.{ext}' for ext in extensions)
+        if entry_type is not None:
+            conditions.append('e.is_dir = ?')
+            params.append(int(entry_type == 'dir'))
+        within = within.strip('/')
+        if within:
+            conditions.append('e.path >= ? AND e.path < ?')
+            params.extend((within + '/', within + '0'))
+        uses_fts = bool(fts_conditions) or any(condition.startswith('(name_search') for condition in conditions)
+        order = 'name_search.rowid' if uses_fts else 'e.rowid'
+        if after is not None:
+            conditions.append(f'{order} > ?')
+            params.append(after)
+        conditions = [condition for condition, _param in fts_conditions] + conditions
+        params = [param for _condition, param in fts_conditions] + params
+        sql = (_SELECT_FTS if uses_fts else _SELECT_PLAIN) + ' AND '.join(conditions) + f' ORDER BY {order}'
+
+        # LIKE 中的 _ 和 % 是通配符，SQL 只做初筛，这里再按字面精确判断
+        needle = query.lower()
+        suffixes = tuple(f'.{ext}' for ext in extensions)
+
+        def accept(path, name):
+            text = (path if column == 'path' else name).lower()
+            if needle and not (text.startswith(needle) if mode == 'prefix' else needle in text):
+                return False
+            return not suffixes or name.lower().endswith(suffixes)
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        db = self.metadata_index.reader()
+        db.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        results = []
+        last_rowid = None
+        exhausted = False
+        truncated = False
+        cursor = db.cursor()
+        try:
+            cursor.execute(sql, params)
+            while len(results) < limit:
+                rows = cursor.fetchmany(_FETCH_SIZE)
+                if not rows:
+                    exhausted = True
+                    break
+                for rowid, path, name, is_dir, size, total_size, file_count, mtime_ns in rows:
+                    last_rowid = rowid
+                    if not accept(path, name):
+                        continue
+                    if is_dir:
+                        entry = DirectoryEntry(name, True, total_size, mtime_ns, file_count)
+                    else:
+                        entry = DirectoryEntry(name, False, size, mtime_ns)
+                    results.append((path, entry))
+                    if len(results) >= limit:
+                        break
+        except sqlite3.OperationalError as e:
+            if 'interrupt' not in str(e):
+                raise
+            truncated = True
+        finally:
+            cursor.close()
+            db.set_progress_handler(None, 0)
+        self.queries += 1
+        self.truncated += truncated
+        self.query_seconds += time.monotonic() - started
+        next_cursor = None if exhausted or last_rowid is None else last_rowid
+        return results, next_cursor, truncated
+
+    def stats(self):
+        return {
+            'queries': self.queries,
+            'truncated': self.truncated,
+            'average_ms': self.query_seconds / self.queries * 1000 if self.queries else 0.0,
+            'ready': self.metadata_index.ready,
+        }
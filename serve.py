@@ -0,0 +1,780 @@
+"""生产环境入口：多进程，每个进程多线程
+
+用法:
+    python serve.py --workers 4 --threads 16 --port 12345
+配置见 config.py，命令行参数优先于 FILE_SERVER_* 环境变量。
+
+安装了 gunicorn 时默认使用 gunicorn（gthread 工作进程，自带 sendfile 和平滑重载）；
+否则使用这里的内置预派生服务器（仅限支持 fork 的平台）：
+  - 主进程监听端口后 fork 出工作进程，所有工作进程在同一个监听套接字上 accept；
+    工作进程意外退出时自动补齐
+  - 每个工作进程用有界线程池处理连接，线程全部占用时不再 accept，连接留给其他工作进程
+  - 支持 HTTP/1.1 keep-alive 和分块传输；timeout 是读取请求、发送响应时单次等待客户端的最长时间，
+    keepalive 是两次请求之间的最长空闲时间
+  - wsgi.file_wrapper 包装的文件用 socket.sendfile 零拷贝发送
+  - SIGHUP 平滑重载：先启动新一代工作进程（重新导入应用代码），全部就绪后旧进程停止 accept，
+    处理完手头的请求后退出，期间监听套接字一直打开，不丢连接；新代码加载失败时保留旧进程
+  - SIGTERM / SIGINT 平滑停止，超过 graceful_timeout 仍未结束的工作进程被强制结束
+
+--backend asyncio 在单个进程的事件循环中运行 asgi_app（见 asgi_server.py），
+下载由事件循环发送而不占用线程，适合大量并发的慢速下载；不支持 SIGHUP 重载。
+
+每个工作进程各自导入应用，进程内的缓存互相独立，跨进程的变更靠 inotify 和 (大小, 修改时间) 校验发现。
+"""
+import argparse
+import importlib
+import importlib.util
+import logging
+import os
+import re
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+from config import ServerConfig
+
+logger = logging.getLogger('serve')
+access_logger = logging.getLogger('serve.access')
+
+APP_SPEC = 'file_server:app'
+
+# 工作进程加载应用失败时的退出码
+EXIT_LOAD_FAILED = 3
+
+# 应用没有读完的请求体不超过该字节数时读掉丢弃以复用连接，否则关闭连接
+MAX_DRAIN = 1024 * 1024
+
+BACKENDS = ('auto', 'gunicorn', 'builtin', 'asyncio')
+
+# 分块长度只能是十六进制数字；int(x, 16) 还接受 -5、0x10、1_0，负数会让 read() 一直读到连接关闭
+_CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]{1,16}')
+
+
+def load_app(spec):
+    """按 '模块:变量' 导入 WSGI 应用"""
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr or 'app')
+
+
+class SendfileWrapper:
+    """wsgi.file_wrapper：服务器识别出它后直接 sendfile，其他情况按块迭代"""
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.block_size)
+        if data:
+            return data
+        raise StopIteration
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
+class _InputStream:
+    """wsgi.input 的基类，子类实现 _read(size)；readline 读多了的部分放回 _pushback"""
+
+    def __init__(self):
+        self._pushback = b''
+
+    def _read(self, size):
+        raise NotImplementedError
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        if not self._pushback:
+            return self._read(size)
+        if size < 0:
+            data, self._pushback = self._pushback, b''
+            return data + self._read(-1)
+        data, self._pushback = self._pushback[:size], self._pushback[size:]
+        return data
+
+    def readline(self, size=-1):
+        parts = []
+        total = 0
+        while size is None or size < 0 or total < size:
+            want = 8192 if size is None or size < 0 else min(8192, size - total)
+            data = self.read(want)
+            if not data:
+                break
+            end = data.find(b'\n')
+            if end >= 0:
+                self._pushback = data[end + 1:] + self._pushback
+                parts.append(data[:end + 1])
+                break
+            parts.append(data)
+            total += len(data)
+        return b''.join(parts)
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self, limit):
+        """读掉剩余请求体，超过 limit 字节时放弃，返回是否已读完"""
+        drained = 0
+        while drained <= limit:
+            data = self.read(min(64 * 1024, limit - drained + 1))
+            if not data:
+                return True
+            drained += len(data)
+        return False
+
+
+class _BodyReader(_InputStream):
+    """按 Content-Length 读取请求体，读到末尾后返回 b''，不会读到下一个请求"""
+
+    def __init__(self, rfile, length):
+        super().__init__()
+        self._rfile = rfile
+        self._remaining = length
+
+    def _read(self, size):
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError('请求体不完整')
+        self._remaining -= len(data)
+        return data
+
+
+class _ChunkedReader(_InputStream):
+    """解码 Transfer-Encoding: chunked 的请求体"""
+
+    def __init__(self, rfile):
+        super().__init__()
+        self._rfile = rfile
+        self._left = 0
+        self._done = False
+
+    def _next_chunk(self):
+        line = self._rfile.readline(65537)
+        if not line:
+            raise ConnectionError('请求体不完整')
+        size = line.split(b';', 1)[0].strip()
+        if not _CHUNK_SIZE.fullmatch(size):
+            raise ConnectionError('无效的分块长度')
+        self._left = int(size, 16)
+        if self._left == 0:
+            # 跳过尾部字段
+            while line not in (b'\r\n', b'\n', b''):
+                line = self._rfile.readline(65537)
+            self._done = True
+
+    def _read(self, size):
+        parts = []
+        while not self._done and size != 0:
+            if self._left == 0:
+                self._next_chunk()
+                continue
+            n = self._left if size < 0 else min(size, self._left)
+            data = self._rfile.read(n)
+            if len(data) < n:
+                raise ConnectionError('请求体不完整')
+            parts.append(data)
+            self._left -= n
+            if size > 0:
+                size -= n
+            if self._left == 0:
+                self._rfile.readline(3)  # 块结尾的 CRLF
+        return b''.join(parts)
+
+
+class WSGIRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 的 WSGI 连接处理器，一个实例处理一个连接上的全部请求"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'file_server'
+    # 响应头和正文分几次写出，开着 Nagle 算法时小响应会等客户端的延迟确认，每个请求多出约 40ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # StreamRequestHandler.setup 按 self.timeout 设置套接字超时
+        self.timeout = self.server.config.timeout
+        super().setup()
+        self.requests_handled = 0
+
+    def handle_one_request(self):
+        config = self.server.config
+        if self.requests_handled:
+            # keep-alive 连接等待下一个请求
+            self.connection.settimeout(config.keepalive)
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (TimeoutError, ConnectionError):
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        self.connection.settimeout(config.timeout)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = self.request_version = self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        try:
+            self.run_wsgi()
+        except (TimeoutError, ConnectionError):
+            self.close_connection = True
+            return
+        self.requests_handled += 1
+        if self.server.stopping:
+            self.close_connection = True
+
+    def make_environ(self):
+        path, _, query = self.path.partition('?')
+        if path.startswith(('http://', 'https://')):
+            path = urllib.parse.urlsplit(path).path or '/'
+        server_name, server_port = self.server.address[:2]
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': self.request_version,
+            'REMOTE_ADDR': self.client_address[0],
+            'REMOTE_PORT': str(self.client_address[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.input_terminated': True,
+            'wsgi.file_wrapper': SendfileWrapper,
+        }
+        for key, value in self.headers.items():
+            # 名称中带下划线的请求头与带连字符的无法区分，丢弃以免被伪造
+            if '_' in key:
+                continue
+            key = key.replace('-', '_').upper()
+            value = value.strip()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            if key in environ:
+                environ[key] += ',' + value
+            else:
+                environ[key] = value
+
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            environ.pop('CONTENT_LENGTH', None)
+            environ['wsgi.input'] = _ChunkedReader(self.rfile)
+        else:
+            length = environ.get('CONTENT_LENGTH', '')
+            if length and not length.isdigit():
+                raise ValueError(f'无效的 Content-Length: {length}')
+            environ['wsgi.input'] = _BodyReader(self.rfile, int(length or 0))
+        return environ
+
+    def run_wsgi(self):
+        try:
+            environ = self.make_environ()
+        except ValueError:
+            self.close_connection = True
+            self.send_error(400)
+            return
+        self._status = None
+        self._response_headers = None
+        self._headers_sent = False
+        self._chunked = False
+        self._body_allowed = True
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if self._headers_sent:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif self._status is not None:
+                raise AssertionError('start_response 已经调用过')
+            self._status, self._response_headers = status, headers
+            return self._write
+
+        try:
+            result = self.server.app(environ, start_response)
+            try:
+                if isinstance(result, SendfileWrapper) and self._can_sendfile(result):
+                    self._sendfile(result)
+                else:
+                    for data in result:
+                        self._write(data)
+                if not self._headers_sent:
+                    self._send_headers()
+                if self._chunked:
+                    self.wfile.write(b'0\r\n\r\n')
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except (TimeoutError, ConnectionError):
+            raise
+        except Exception:
+            logger.exception(f'处理请求 {self.requestline!r} 时出错')
+            self.close_connection = True
+            if not self._headers_sent:
+                self.send_error(500)
+            return
+
+        if not environ['wsgi.input'].drain(MAX_DRAIN):
+            self.close_connection = True
+
+    def _send_headers(self):
+        code, _, reason = self._status.partition(' ')
+        code = int(code)
+        self.send_response(code, reason)
+        names = set()
+        for key, value in self._response_headers:
+            self.send_header(key, value)
+            names.add(key.lower())
+        self._body_allowed = not (self.command == 'HEAD' or 100 <= code < 200 or code in (204, 304))
+        if 'content-length' not in names and self._body_allowed:
+            if self.request_version >= 'HTTP/1.1':
+                self._chunked = True
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                # HTTP/1.0 只能以关闭连接表示正文结束
+                self.close_connection = True
+        if self.close_connection or self.server.stopping:
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        elif self.request_version == 'HTTP/1.0':
+            self.send_header('Connection', 'keep-alive')
+        self.end_headers()
+        self._headers_sent = True
+
+    def _write(self, data):
+        if not self._headers_sent:
+            self._send_headers()
+        if not data or not self._body_allowed:
+            return
+        if self._chunked:
+            self.wfile.write(f'{len(data):x}\r\n'.encode())
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def _can_sendfile(self, wrapper):
+        if not hasattr(os, 'sendfile') or not hasattr(wrapper.filelike, 'fileno'):
+            return False
+        return any(key.lower() == 'content-length' for key, _value in self._response_headers)
+
+    def _sendfile(self, wrapper):
+        """从文件当前位置起发送 Content-Length 个字节"""
+        self._send_headers()
+        if not self._body_allowed:
+            return
+        length = int(next(value for key, value in self._response_headers if key.lower() == 'content-length'))
+        fd = wrapper.filelike.fileno()
+        offset = os.lseek(fd, 0, os.SEEK_CUR)
+        sent = self.connection.sendfile(wrapper.filelike, offset, length)
+        if sent < length:
+            # 文件在发送期间被截短，无法再满足 Content-Length
+            raise ConnectionError('文件发送不完整')
+
+    def log_message(self, format, *args):
+        access_logger.info(f'{self.address_string()} {format % args}')
+
+
+class WorkerServer:
+    """工作进程内的服务器：在共享的监听套接字上 accept，连接交给有界线程池"""
+
+    def __init__(self, listener, app, config):
+        self.listener = listener
+        self.app = app
+        self.config = config
+        self.address = listener.getsockname()
+        self.stopping = False
+        self._slots = threading.Semaphore(config.threads)
+        self._executor = ThreadPoolExecutor(max_workers=config.threads, thread_name_prefix='http')
+
+    def serve_forever(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.listener, selectors.EVENT_READ)
+            while not self.stopping:
+                # 没有空闲线程时不 accept，连接留在监听队列里由其他工作进程处理
+                if not self._slots.acquire(timeout=0.5):
+                    continue
+                accepted = self._accept(selector)
+                if accepted is None:
+                    self._slots.release()
+                    continue
+                self._executor.submit(self._handle, *accepted)
+
+    def _accept(self, selector):
+        if not selector.select(timeout=0.5):
+            return None
+        try:
+            return self.listener.accept()
+        except (BlockingIOError, InterruptedError):
+            # 被其他工作进程抢先 accept
+            return None
+        except OSError as e:
+            logger.warning(f'accept 失败: {e}')
+            return None
+
+    def _handle(self, conn, address):
+        try:
+            WSGIRequestHandler(conn, address, self)
+        except (TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception(f'处理来自 {address[0]} 的连接时出错')
+        finally:
+            try:
+                conn.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            conn.close()
+            self._slots.release()
+
+    def stop(self):
+        """停止 accept，已建立的连接处理完当前请求后关闭"""
+        self.stopping = True
+
+    def wait(self, timeout):
+        """等待正在处理的连接结束，返回是否全部结束"""
+        deadline = time.monotonic() + timeout
+        for _ in range(self.config.threads):
+            if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+
+def _worker_main(listener, config, ready_fd):
+    """工作进程入口，不会返回"""
+    server = None
+    stop_requested = False
+
+    def on_term(signum, frame):
+        nonlocal stop_requested
+        stop_requested = True
+        if server is not None:
+            server.stop()
+
+    signal.signal(signal.SIGTERM, on_term)
+    # Ctrl+C 会发给整个进程组，由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    try:
+        app = load_app(APP_SPEC)
+    except BaseException:
+        logger.exception('加载应用失败')
+        os._exit(EXIT_LOAD_FAILED)
+    server = WorkerServer(listener, app, config)
+    if stop_requested:
+        server.stop()
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    try:
+        server.serve_forever()
+        if not server.wait(config.graceful_timeout):
+            logger.warning(f'工作进程 {os.getpid()} 等待请求结束超时，强制退出')
+    except BaseException:
+        logger.exception('工作进程异常退出')
+        os._exit(1)
+    os._exit(0)
+
+
+class _Worker:
+    __slots__ = ('pid', 'generation', 'ready_fd', 'ready', 'kill_at')
+
+    def __init__(self, pid, generation, ready_fd):
+        self.pid = pid
+        self.generation = generation
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.kill_at = None  # 已发送 SIGTERM 时为强制结束的时间
+
+
+class Arbiter:
+    """主进程：管理工作进程的启动、补齐、平滑重载和停止"""
+
+    def __init__(self, config):
+        self.config = config
+        self.workers = {}
+        self.generation = 0
+        self.reloading_from = None  # 平滑重载进行中时为旧一代的编号
+        self._signals = []
+        self._started = False
+        self._respawn_after = 0.0
+
+    def run(self):
+        self.listener = socket.create_server((self.config.host, self.config.port), backlog=self.config.backlog)
+        self.listener.setblocking(False)
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        self._wake_fds = (wake_r, wake_w)
+        signal.set_wakeup_fd(wake_w)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        # 只为在子进程退出时唤醒 select
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        logger.info(f'监听 http://{self.config.host}:{self.config.port}，'
+                    f'{self.config.workers} 个工作进程 x {self.config.threads} 线程')
+        for _ in range(self.config.workers):
+            self._spawn()
+        try:
+            while True:
+                self._wait(1.0)
+                self._reap()
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self._reload()
+                    else:
+                        return self._shutdown()
+                if not self._started and not self.workers:
+                    logger.error('工作进程启动失败')
+                    return 1
+                self._finish_reload()
+                self._kill_overdue()
+                self._maintain()
+        finally:
+            signal.set_wakeup_fd(-1)
+            for fd in self._wake_fds:
+                os.close(fd)
+            self.listener.close()
+
+    def _spawn(self):
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.set_wakeup_fd(-1)
+                os.close(ready_r)
+                for fd in self._wake_fds:
+                    os.close(fd)
+                for worker in self.workers.values():
+                    if worker.ready_fd is not None:
+                        os.close(worker.ready_fd)
+                _worker_main(self.listener, self.config, ready_w)
+            finally:
+                os._exit(1)
+        os.close(ready_w)
+        self.workers[pid] = _Worker(pid, self.generation, ready_r)
+        return pid
+
+    def _wait(self, timeout):
+        fds = [self._wake_fds[0]] + [w.ready_fd for w in self.workers.values() if w.ready_fd is not None]
+        with selectors.DefaultSelector() as selector:
+            for fd in fds:
+                selector.register(fd, selectors.EVENT_READ)
+            events = selector.select(timeout)
+        for key, _mask in events:
+            if key.fd == self._wake_fds[0]:
+                try:
+                    while os.read(key.fd, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            worker = next(w for w in self.workers.values() if w.ready_fd == key.fd)
+            worker.ready = os.read(key.fd, 1) == b'1'
+            os.close(key.fd)
+            worker.ready_fd = None
+            if worker.ready:
+                self._started = True
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.kill_at is None:
+                logger.warning(f'工作进程 {pid} 意外退出，退出码 {code}')
+            if code == EXIT_LOAD_FAILED:
+                # 代码有问题时不要反复 fork
+                self._respawn_after = time.monotonic() + 1.0
+            if not worker.ready and worker.generation == self.generation and self.reloading_from is not None:
+                self._abort_reload()
+
+    def _maintain(self):
+        """补齐当前一代的工作进程；首次启动时有进程加载失败则不再补齐"""
+        if not self._started and any(not w.ready for w in self.workers.values()):
+            return
+        if time.monotonic() < self._respawn_after:
+            return
+        current = sum(1 for w in self.workers.values() if w.generation == self.generation and w.kill_at is None)
+        for _ in range(self.config.workers - current):
+            self._spawn()
+
+    def _reload(self):
+        if self.reloading_from is not None:
+            logger.info('上一次重载尚未完成，忽略 SIGHUP')
+            return
+        logger.info('收到 SIGHUP，启动新一代工作进程')
+        self.reloading_from = self.generation
+        self.generation += 1
+        for _ in range(self.config.workers):
+            self._spawn()
+
+    def _finish_reload(self):
+        """新一代全部就绪后让旧进程退出"""
+        if self.reloading_from is None:
+            return
+        new = [w for w in self.workers.values() if w.generation == self.generation]
+        if len(new) < self.config.workers or not all(w.ready for w in new):
+            return
+        for worker in self.workers.values():
+            if worker.generation != self.generation:
+                self._terminate(worker)
+        self.reloading_from = None
+        logger.info('重载完成')
+
+    def _abort_reload(self):
+        logger.error('新一代工作进程加载失败，继续使用原有的工作进程')
+        for worker in list(self.workers.values()):
+            if worker.generation == self.generation:
+                self._terminate(worker)
+        self.generation = self.reloading_from
+        self.reloading_from = None
+
+    def _terminate(self, worker):
+        if worker.kill_at is not None:
+            return
+        worker.kill_at = time.monotonic() + self.config.graceful_timeout + 5
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.kill_at is not None and now > worker.kill_at:
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _shutdown(self):
+        logger.info('正在停止，等待请求处理完成')
+        for worker in self.workers.values():
+            self._terminate(worker)
+        while self.workers:
+            self._wait(0.5)
+            self._reap()
+            self._kill_overdue()
+        return 0
+
+
+def serve_single(config):
+    """不支持 fork 的平台：单进程多线程，不支持平滑重载"""
+    app = load_app(APP_SPEC)
+    listener = socket.create_server((config.host, config.port), backlog=config.backlog)
+    listener.setblocking(False)
+    server = WorkerServer(listener, app, config)
+    logger.info(f'监听 http://{config.host}:{config.port}，单进程 x {config.threads} 线程')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+        server.wait(config.graceful_timeout)
+    finally:
+        listener.close()
+    return 0
+
+
+def serve_gunicorn(config):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f'{config.host}:{config.port}',
+                'workers': config.workers,
+                'threads': config.threads,
+                'worker_class': 'gthread',
+                'keepalive': config.keepalive,
+                'timeout': config.timeout,
+                'graceful_timeout': config.graceful_timeout,
+                'backlog': config.backlog,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(APP_SPEC)
+
+    Application().run()
+    return 0
+
+
+def serve_asyncio(config):
+    import asgi_server
+    from asgi_app import AsgiAdapter
+    asgi_server.run(AsgiAdapter(load_app(APP_SPEC), config.threads), config)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='文件服务器生产环境入口')
+    parser.add_argument('--backend', choices=BACKENDS, default='auto',
+                        help='auto：安装了 gunicorn 时用 gunicorn，否则用内置服务器；asyncio：单进程事件循环')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='工作进程数')
+    parser.add_argument('--threads', type=int, help='每个工作进程的线程数')
+    parser.add_argument('--keepalive', type=float, help='keep-alive 空闲超时（秒）')
+    parser.add_argument('--timeout', type=float, help='请求超时（秒）')
+    parser.add_argument('--graceful-timeout', type=float, help='平滑重载/停止的等待时间（秒）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+    config = ServerConfig.from_env(host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+                                   keepalive=args.keepalive, timeout=args.timeout,
+                                   graceful_timeout=args.graceful_timeout)
+    # 工作进程导入 file_server 时从环境变量读取配置；密钥在这里生成一次，所有工作进程和重载后的进程共用
+    os.environ.update(config.to_env())
+
+    backend = args.backend
+    if backend == 'auto':
+        backend = 'gunicorn' if importlib.util.find_spec('gunicorn') else 'builtin'
+    if backend == 'gunicorn':
+        return serve_gunicorn(config)
+    if backend == 'asyncio':
+        return serve_asyncio(config)
+    if not hasattr(os, 'fork'):
+        logger.warning('当前平台不支持 fork，以单进程模式运行')
+        return serve_single(config)
+    return Arbiter(config).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
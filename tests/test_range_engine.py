@@ -0,0 +1,116 @@
+"""range_engine 的边界情况：后缀范围、多段与合并、416、If-Range、畸形和非 ASCII 的 Range 头"""
+import pytest
+from werkzeug.http import http_date
+
+from range_engine import (COALESCE_GAP, MAX_RANGES, RangeNotSatisfiable, coalesce_ranges, if_range_matches,
+                          multipart_byteranges_response, parse_range_header, range_not_satisfiable_response)
+
+SIZE = 10000
+
+
+def test_single_ranges():
+    assert parse_range_header('bytes=0-99', SIZE) == [(0, 99)]
+    assert parse_range_header('bytes=9990-', SIZE) == [(9990, 9999)]
+    # 终点越界时截到文件末尾
+    assert parse_range_header('bytes=9000-20000', SIZE) == [(9000, 9999)]
+    assert parse_range_header('BYTES = 5-5', SIZE) == [(5, 5)]
+
+
+def test_suffix_ranges():
+    assert parse_range_header('bytes=-100', SIZE) == [(9900, 9999)]
+    # 后缀长度超过文件大小时返回整个文件
+    assert parse_range_header('bytes=-20000', SIZE) == [(0, 9999)]
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=-0', SIZE)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=-5', 0)
+
+
+def test_multi_range_sorted_and_coalesced():
+    assert parse_range_header('bytes=5000-5099,0-99', SIZE) == [(0, 99), (5000, 5099)]
+    # 重叠的段合并
+    assert parse_range_header('bytes=0-99,50-199', SIZE) == [(0, 199)]
+    # 间隔不超过 COALESCE_GAP 的段合并，更远的保留为两段
+    assert parse_range_header(f'bytes=0-99,{100 + COALESCE_GAP}-299', SIZE) == [(0, 299)]
+    assert parse_range_header(f'bytes=0-99,{101 + COALESCE_GAP}-299', SIZE) == [(0, 99), (101 + COALESCE_GAP, 299)]
+    # 越界的段被跳过，其余段照常返回
+    assert parse_range_header('bytes=20000-,0-9', SIZE) == [(0, 9)]
+    # 空段忽略
+    assert parse_range_header('bytes=0-9,,', SIZE) == [(0, 9)]
+
+
+def test_coalesce_ranges():
+    assert coalesce_ranges([(10, 20), (0, 5), (15, 30)], gap=0) == [(0, 5), (10, 30)]
+    assert coalesce_ranges([(0, 5), (6, 9)], gap=0) == [(0, 9)]
+
+
+def test_unsatisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=10000-', SIZE)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=20000-30000,10000-', SIZE)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=0-', 0)
+    response = range_not_satisfiable_response(SIZE)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+@pytest.mark.parametrize('header', [
+    None, '', 'bytes', 'bytes=', 'bytes=,', 'bytes= , ,', 'items=0-9', 'bytes=a-b', 'bytes=5', 'bytes=-',
+    'bytes=9-0', 'bytes=0-9,x', 'bytes=+1-5', 'bytes=0x1-5', 'bytes=1.5-2',
+    ','.join(['bytes=0-0'] + ['0-0'] * MAX_RANGES),
+])
+def test_malformed_headers_ignored(header):
+    assert parse_range_header(header, SIZE) is None
+
+
+@pytest.mark.parametrize('header', ['bytes=²-', 'bytes=0-²', 'bytes=-²', 'bytes=١٢-', 'bytes=0-９', 'bytes=0\u2009-9'])
+def test_non_ascii_headers_ignored(header):
+    assert parse_range_header(header, SIZE) is None
+
+
+def test_if_range_etag():
+    etag = '"abc"'
+    assert if_range_matches(None, etag, 0)
+    assert if_range_matches('"abc"', etag, 0)
+    assert not if_range_matches('"other"', etag, 0)
+    # 弱标签不能用于 If-Range
+    assert not if_range_matches('W/"abc"', etag, 0)
+    assert not if_range_matches('"abc"', 'W/"abc"', 0)
+    assert not if_range_matches('"abc"', None, 0)
+
+
+def test_if_range_date():
+    mtime = 1700000000
+    now = mtime + 60
+    assert if_range_matches(http_date(mtime), None, mtime, now=now)
+    assert if_range_matches(http_date(mtime), None, mtime + 0.5, now=now)
+    assert not if_range_matches(http_date(mtime - 1), None, mtime, now=now)
+    assert not if_range_matches('not a date', None, mtime, now=now)
+    assert not if_range_matches(http_date(mtime), None, None, now=now)
+
+
+def test_if_range_date_requires_strong_last_modified():
+    mtime = 1700000000
+    # 文件在最近一秒内修改过，Last-Modified 只是弱校验器
+    assert not if_range_matches(http_date(mtime), None, mtime, now=mtime + 0.5)
+    assert if_range_matches(http_date(mtime), None, mtime, now=mtime + 1)
+
+
+def test_multipart_byteranges_body(tmp_path):
+    data = bytes(range(256)) * 40
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    ranges = parse_range_header('bytes=0-9,5000-5009,-10', len(data))
+    response = multipart_byteranges_response(str(path), ranges, len(data), 'application/octet-stream')
+    body = response.get_data()
+    assert response.status_code == 206
+    assert int(response.headers['Content-Length']) == len(body)
+    boundary = response.headers['Content-Type'].split('boundary=')[1]
+    parts = body.split(f'--{boundary}'.encode())[1:-1]
+    assert len(parts) == len(ranges)
+    for part, (start, end) in zip(parts, ranges):
+        head, _, content = part.partition(b'\r\n\r\n')
+        assert f'Content-Range: bytes {start}-{end}/{len(data)}'.encode() in head
+        assert content[:-2] == data[start:end + 1]
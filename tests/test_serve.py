@@ -0,0 +1,21 @@
+"""serve.py 内置服务器的分块请求体解码"""
+import io
+
+import pytest
+
+from serve import _ChunkedReader
+
+
+def test_chunked_body():
+    reader = _ChunkedReader(io.BytesIO(b'5;ext=1\r\nhello\r\nA\r\n, world!!!\r\n0\r\nX-Trailer: 1\r\n\r\n'))
+    assert reader.read() == b'hello, world!!!'
+    assert reader.read() == b''
+
+
+@pytest.mark.parametrize('size', [b'-5', b'0x10', b'1_0', b'+5', b'', b' ', b'\xd9\xa5', b'1' * 17])
+def test_invalid_chunk_size(size):
+    rfile = io.BytesIO(size + b'\r\n' + b'x' * 64 + b'\r\n0\r\n\r\n')
+    with pytest.raises(ConnectionError, match='无效的分块长度'):
+        _ChunkedReader(rfile).read()
+    # 出错时不会把连接上剩下的数据当作请求体读掉
+    assert rfile.tell() == len(size) + 2
@@ -0,0 +1,273 @@
+"""图片/视频缩略图
+
+  - 图片用 Pillow 生成，视频用 ffmpeg 截取一帧；两者都是可选依赖，缺少时对应类型没有缩略图
+  - 生成在有界的进程池中进行，排队的任务数也有上限，不会拖慢处理请求的线程；
+    进程池用 spawn 方式启动，避免在多线程进程中 fork
+  - 结果以 JPEG 存入磁盘缓存，文件名包含源文件路径的哈希、大小、修改时间和尺寸，
+    源文件变化后自然失效；缓存按总大小 LRU 淘汰
+  - 生成失败（损坏的文件等）的源文件版本会被记住，不再反复尝试
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = shutil.which('ffmpeg')
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'}
+VIDEO_EXTENSIONS = {'avi', 'mp4', 'm4v', 'mkv', 'mov', 'webm', 'wmv', 'flv'}
+
+JPEG_QUALITY = 80
+# ffmpeg 截取一帧的超时时间（秒）
+VIDEO_TIMEOUT = 60
+
+# lookup() 的结果状态
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+
+# 生成中显示的占位图
+PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="128" height="128" viewBox="0 0 128 128">'
+    '<rect width="128" height="128" rx="8" fill="#e6e6e6"/>'
+    '<circle cx="44" cy="64" r="6" fill="#aaa"/><circle cx="64" cy="64" r="6" fill="#aaa"/>'
+    '<circle cx="84" cy="64" r="6" fill="#aaa"/></svg>'
+)
+# 无法生成缩略图时显示的图标
+BROKEN_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="128" height="128" viewBox="0 0 128 128">'
+    '<rect width="128" height="128" rx="8" fill="#f0f0f0"/>'
+    '<path d="M40 88l18-24 14 16 10-12 16 20z" fill="#ccc"/></svg>'
+)
+
+
+def thumbnail_kind(filename):
+    """按扩展名返回 'image'、'video'，没有可用的生成工具时返回 None"""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext in IMAGE_EXTENSIONS and Image is not None:
+        return 'image'
+    if ext in VIDEO_EXTENSIONS and FFMPEG is not None:
+        return 'video'
+    return None
+
+
+def _render_image(source, dest, size):
+    with Image.open(source) as image:
+        # JPEG 可在解码时直接缩小，大图省掉大部分解码时间
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(dest, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+
+
+def _render_video(source, dest, size, ffmpeg):
+    scale = f'scale={size}:{size}:force_original_aspect_ratio=decrease'
+    # 先取第 1 秒的画面（避开片头黑屏），太短的视频再取第一帧
+    for seek in ('1', '0'):
+        subprocess.run(
+            [ffmpeg, '-v', 'error', '-nostdin', '-y', '-ss', seek, '-i', source, '-frames:v', '1',
+             '-vf', scale, '-f', 'image2', '-c:v', 'mjpeg', '-q:v', '4', dest],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=VIDEO_TIMEOUT, check=False,
+        )
+        if os.path.exists(dest) and os.path.getsize(dest) > 0:
+            return
+    raise RuntimeError(f'ffmpeg 无法从 {source} 截取画面')
+
+
+def render(kind, source, dest, size, ffmpeg=None):
+    """在子进程中执行：生成 source 的缩略图写入 dest"""
+    if kind == 'image':
+        _render_image(source, dest, size)
+    else:
+        _render_video(source, dest, size, ffmpeg)
+
+
+class ThumbnailCache:
+    """缩略图磁盘缓存和生成进程池
+
+    文件名为 <源路径的sha1>-<大小>-<修改时间ns>-<尺寸>.jpg，同一源文件的旧版本在生成新版本时删除。
+    """
+
+    def __init__(self, cache_root, max_bytes=512 * 1024 ** 2, workers=2, max_pending=256):
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        self._entries = OrderedDict()  # 文件名 -> 大小，按最近使用排序
+        self._total = 0
+        self._pending = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        self.rejected = 0
+        self.evicted = 0
+        os.makedirs(cache_root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """启动时按修改时间恢复 LRU 顺序，清掉上次残留的临时文件"""
+        entries = []
+        for name in os.listdir(self.cache_root):
+            path = os.path.join(self.cache_root, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _mtime, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _prefix(source_path):
+        return hashlib.sha1(os.path.abspath(source_path).encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _name(self, source_path, st, size):
+        return f'{self._prefix(source_path)}-{st.st_size:x}-{st.st_mtime_ns:x}-{size}.jpg'
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def lookup(self, source_path, st, size):
+        """返回 (状态, 缩略图路径)；未生成时排队生成并返回 PENDING，队列已满时同样返回 PENDING 稍后再试"""
+        kind = thumbnail_kind(source_path)
+        if kind is None:
+            return FAILED, None
+        name = self._name(source_path, st, size)
+        with self._lock:
+            cached = self._entries.get(name)
+            if cached is not None:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return READY, os.path.join(self.cache_root, name)
+            if name in self._failed:
+                return FAILED, None
+            self.misses += 1
+            if name in self._pending:
+                return PENDING, None
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return PENDING, None
+            self._pending.add(name)
+            tmp = os.path.join(self.cache_root, f'{uuid.uuid4().hex}.tmp')
+            try:
+                future = self._executor().submit(render, kind, source_path, tmp, size, FFMPEG)
+            except BrokenProcessPool:
+                self._pool = None
+                self._pending.discard(name)
+                return PENDING, None
+        future.add_done_callback(lambda f: self._finish(f, source_path, st, name, tmp))
+        return PENDING, None
+
+    def _finish(self, future, source_path, st, name, tmp):
+        try:
+            future.result()
+            # 生成期间源文件被修改，结果作废
+            now = os.stat(source_path)
+            if (now.st_size, now.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                os.remove(tmp)
+                return
+            size = os.path.getsize(tmp)
+            os.replace(tmp, os.path.join(self.cache_root, name))
+            with self._lock:
+                self._drop_other_versions(name)
+                self._entries[name] = size
+                self._total += size
+                self.generated += 1
+                self._evict()
+        except BrokenProcessPool:
+            logger.error('缩略图进程池异常退出，将重新创建')
+            with self._lock:
+                self._pool = None
+        except Exception as e:
+            logger.warning(f'生成 {source_path} 的缩略图失败: {e}')
+            with self._lock:
+                self._failed.add(name)
+                self.failures += 1
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with self._lock:
+                self._pending.discard(name)
+
+    def _drop_other_versions(self, name):
+        """删除同一源文件的过时缩略图（其他大小/修改时间），同一版本的其他尺寸保留"""
+        prefix, version = name.split('-', 1)
+        version = version.rsplit('-', 1)[0]
+        for other in [n for n in self._entries if n.startswith(prefix + '-')]:
+            if other.split('-', 1)[1].rsplit('-', 1)[0] != version:
+                self._remove(other)
+
+    def _remove(self, name):
+        size = self._entries.pop(name, None)
+        if size is None:
+            return
+        self._total -= size
+        try:
+            os.remove(os.path.join(self.cache_root, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and self._total > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def invalidate(self, source_path):
+        """删除某个源文件的所有缩略图"""
+        prefix = self._prefix(source_path) + '-'
+        with self._lock:
+            for name in [n for n in self._entries if n.startswith(prefix)]:
+                self._remove(name)
+            self._failed = {n for n in self._failed if not n.startswith(prefix)}
+
+    def on_fs_event(self, event, path, dest_path=None):
+        """fs_events 回调：删除、改名、覆盖后尽早释放过时缩略图占用的空间"""
+        self.invalidate(path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'generated': self.generated,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'pending': len(self._pending),
+                'evicted': self.evicted,
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'image_support': Image is not None,
+                'video_support': FFMPEG is not None,
+            }
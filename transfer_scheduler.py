@@ -0,0 +1,412 @@
+"""传输调度：限速、公平分配带宽和单客户端并发限制
+
+只管理大块传输（大文件下载、打包下载、上传），目录列表、小文件等交互式请求不受限速，
+也不占用并发名额。
+
+  - 上行（下载）和下行（上传）分别设置全局限速和单客户端限速（字节/秒，0 表示不限）
+  - 全局带宽在当前有传输的客户端之间平均分配，每个客户端的份额再在它的各个传输之间平均分配，
+    开很多连接并不能多占带宽；每个传输按分到的速率用令牌桶节流，有传输开始或结束时立即重新分配
+  - 最近有交互式请求时，大块传输合计只使用全局限速的 (1 - interactive_reserve)，
+    余下的带宽留给目录列表等请求，避免它们排在大文件后面
+  - 单个客户端（IP）同时进行的大块传输超过 max_transfers_per_client 时抛出 TooManyTransfers（对应 429）
+  - 限制保存在 JSON 文件中，运行时可修改；多进程部署时各工作进程按修改时间发现变化并重新加载。
+    注意限速和并发计数都按进程计算，N 个工作进程时实际全局上限约为设置值的 N 倍
+
+未限速时下载仍交给服务器 sendfile；限速时改为按小块读取并在两块之间等待。
+修改限制后，按块读取的传输（包括开始时未限速、尚未交给 sendfile 的）从下一块起按新速率发送；
+已经交给服务器 sendfile 的未限速下载无法中途节流，新的限速只对之后开始的传输生效。
+在事件循环中发送时（asgi_app），等待由事件循环完成而不占用线程，见 read_paced、next_paced 和 deferred_throttle。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ('download', 'upload')
+
+DEFAULT_LIMITS = {
+    'download_rate': 0,
+    'upload_rate': 0,
+    'client_download_rate': 0,
+    'client_upload_rate': 0,
+    'max_transfers_per_client': 8,
+    'interactive_reserve': 0.2,
+}
+
+# 令牌桶最多积攒的时长（秒），决定短时突发的大小
+BURST_SECONDS = 0.25
+# 限速时每次读取的字节数约为速率的这一比例（即每秒约 10 次），并限制在下面的范围内
+SLICE_SECONDS = 0.1
+MIN_SLICE = 4 * 1024
+MAX_SLICE = 256 * 1024
+# 交互式请求结束后保留带宽的时长（秒）
+INTERACTIVE_WINDOW = 1.0
+# 检查限制文件是否被其他进程修改的最短间隔（秒）
+RELOAD_INTERVAL = 1.0
+# 429 响应建议的重试等待秒数
+RETRY_AFTER = 5
+
+_END = object()
+_pacing = threading.local()
+
+
+class TooManyTransfers(Exception):
+    """客户端同时进行的传输数已达上限"""
+
+    def __init__(self, client, limit, retry_after=RETRY_AFTER):
+        super().__init__(f'{client} 同时进行的传输已达上限 {limit}')
+        self.client = client
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def validate_limits(changes):
+    """检查并转换要修改的限制，返回新的字典；未知字段或非法值抛出 ValueError"""
+    result = {}
+    for name, value in changes.items():
+        if name not in DEFAULT_LIMITS:
+            raise ValueError(f'未知的限制: {name}')
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{name} 必须是数字')
+        if name == 'interactive_reserve':
+            if not 0 <= value < 1:
+                raise ValueError('interactive_reserve 必须在 [0, 1) 之间')
+            result[name] = float(value)
+        else:
+            if value < 0:
+                raise ValueError(f'{name} 不能为负数')
+            result[name] = int(value)
+    return result
+
+
+class deferred_throttle:
+    """在此上下文中（当前线程），限速的读取和迭代不再 sleep，而是把应等待的秒数累加到 delay，由调用方自行等待
+
+    用于事件循环在 I/O 线程中取一块数据：响应正文被 werkzeug、指标统计等层层包装后拿不到 next_paced，
+    在上下文中调用外层迭代器即可，线程取完数据立即返回，等待在事件循环中进行。
+    """
+
+    def __enter__(self):
+        self.delay = 0.0
+        self._previous = getattr(_pacing, 'current', None)
+        _pacing.current = self
+        return self
+
+    def __exit__(self, *exc):
+        _pacing.current = self._previous
+
+
+def _wait(delay):
+    if not delay:
+        return
+    deferred = getattr(_pacing, 'current', None)
+    if deferred is not None:
+        deferred.delay += delay
+    else:
+        time.sleep(delay)
+
+
+class Transfer:
+    """一个正在进行的大块传输，close() 后释放并发名额"""
+
+    def __init__(self, scheduler, client, direction):
+        self.scheduler = scheduler
+        self.client = client
+        self.direction = direction
+        self.started = time.monotonic()
+        self.bytes = 0
+        self.attached = False
+        self.closed = False
+        self._tokens = 0.0
+        self._last = self.started
+
+    @property
+    def shaped(self):
+        """是否需要节流（未设置任何限速时为 False，可以继续使用 sendfile）"""
+        return self.scheduler.is_shaped(self.direction)
+
+    def slice_size(self, size=-1):
+        """限速时每次读取的字节数，不超过 size"""
+        rate = self.scheduler.rate_for(self)
+        if rate is None:
+            return size
+        step = int(min(max(rate * SLICE_SECONDS, MIN_SLICE), MAX_SLICE))
+        return step if size is None or size < 0 else min(size, step)
+
+    def reserve(self, nbytes):
+        """记录已传输 nbytes 字节，返回按当前速率还需等待的秒数"""
+        self.bytes += nbytes
+        self.scheduler.count_bytes(self.direction, nbytes)
+        rate = self.scheduler.rate_for(self)
+        if rate is None:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(rate * BURST_SECONDS, self._tokens + (now - self._last) * rate) - nbytes
+        self._last = now
+        if self._tokens >= 0:
+            return 0.0
+        delay = -self._tokens / rate
+        self.scheduler.count_delay(delay)
+        return delay
+
+    def throttle(self, nbytes):
+        _wait(self.reserve(nbytes))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.scheduler.finish(self)
+
+
+class ShapedFile:
+    """按传输速率读取的类文件对象，用于下载的文件和上传的请求体
+
+    限速时不提供 fileno()，服务器因而不会绕过它直接 sendfile；close() 时释放传输名额。
+    """
+
+    def __init__(self, f, transfer, owns_transfer=True):
+        self.file = f
+        self.transfer = transfer
+        # 上传的请求体在路由中读完，传输由请求结束时释放，而不是在关闭请求体时
+        self.owns_transfer = owns_transfer
+        if owns_transfer:
+            transfer.attached = True
+
+    def read_paced(self, size=-1):
+        """读取一块，返回 (数据, 需要等待的秒数)；供事件循环自行等待而不占用线程"""
+        data = self.file.read(self.transfer.slice_size(size))
+        return data, self.transfer.reserve(len(data))
+
+    def read(self, size=-1):
+        data, delay = self.read_paced(size)
+        _wait(delay)
+        return data
+
+    def close(self):
+        try:
+            if hasattr(self.file, 'close'):
+                self.file.close()
+        finally:
+            if self.owns_transfer:
+                self.transfer.close()
+
+
+class _UnshapedFile(ShapedFile):
+    """不限速时保留 fileno()，服务器仍可 sendfile
+
+    服务器没有用 sendfile 而是逐块 read() 时，每块都重新检查限制，传输中途设置的限速同样生效。
+    """
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if self.transfer.shaped:
+            return super().read(size)
+        data = self.file.read(size)
+        self.transfer.reserve(len(data))
+        return data
+
+
+class ShapedIterable:
+    """按传输速率产出数据块的可迭代对象（打包下载、在线压缩等），close() 时释放传输名额"""
+
+    def __init__(self, iterable, transfer):
+        self.iterable = iterable
+        self.iterator = iter(iterable)
+        self.transfer = transfer
+        self._view = memoryview(b'')
+        transfer.attached = True
+
+    def __iter__(self):
+        return self
+
+    def next_paced(self, default=None):
+        """取下一块，返回 (数据, 需要等待的秒数)，迭代结束时返回 (default, 0)；供事件循环自行等待而不占用线程"""
+        if not self._view:
+            try:
+                self._view = memoryview(next(self.iterator))
+            except StopIteration:
+                return default, 0.0
+        step = self.transfer.slice_size(len(self._view))
+        data, self._view = self._view[:step], self._view[step:]
+        return bytes(data), self.transfer.reserve(len(data))
+
+    def __next__(self):
+        data, delay = self.next_paced(_END)
+        if data is _END:
+            raise StopIteration
+        _wait(delay)
+        return data
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.transfer.close()
+
+
+def shape_file(f, transfer, owns_transfer=True):
+    """用传输包装类文件对象；transfer 为 None（交互式请求）时原样返回
+
+    owns_transfer 为 True 时关闭该对象即结束传输（下载的文件交给服务器发送，发送完才关闭）。
+    """
+    if transfer is None:
+        return f
+    wrapper = ShapedFile if transfer.shaped else _UnshapedFile
+    return wrapper(f, transfer, owns_transfer)
+
+
+def shape_iterable(iterable, transfer):
+    """用传输包装响应正文；transfer 为 None 时原样返回"""
+    return iterable if transfer is None else ShapedIterable(iterable, transfer)
+
+
+class TransferScheduler:
+    """登记大块传输，按当前限制为每个传输分配速率"""
+
+    def __init__(self, limits_path=None, **limits):
+        self.limits_path = limits_path
+        self._limits = dict(DEFAULT_LIMITS)
+        self._limits.update(validate_limits(limits))
+        self._lock = threading.Lock()
+        # 方向 -> 客户端 -> 传输数
+        self._active = {direction: defaultdict(int) for direction in DIRECTIONS}
+        self._per_client = defaultdict(int)
+        self._interactive_until = 0.0
+        self._limits_mtime = None
+        self._next_reload = 0.0
+        self.started = {direction: 0 for direction in DIRECTIONS}
+        self.rejected = 0
+        self.bytes = {direction: 0 for direction in DIRECTIONS}
+        self.delay_seconds = 0.0
+        self._reload()
+
+    # 限制的读取和修改
+
+    def _reload(self):
+        """限制文件被（本进程或其他进程）修改过时重新加载"""
+        if self.limits_path is None:
+            return
+        try:
+            mtime = os.stat(self.limits_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._limits_mtime:
+            return
+        try:
+            with open(self.limits_path, encoding='utf-8') as f:
+                stored = validate_limits(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f'读取传输限制 {self.limits_path} 失败: {e}')
+            return
+        with self._lock:
+            self._limits = dict(DEFAULT_LIMITS, **stored)
+            self._limits_mtime = mtime
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now >= self._next_reload:
+            self._next_reload = now + RELOAD_INTERVAL
+            self._reload()
+
+    def limits(self):
+        self._maybe_reload()
+        with self._lock:
+            return dict(self._limits)
+
+    def set_limits(self, **changes):
+        """修改限制并写入限制文件，立即对正在进行的传输生效，返回修改后的全部限制"""
+        changes = validate_limits(changes)
+        with self._lock:
+            self._limits.update(changes)
+            limits = dict(self._limits)
+        if self.limits_path is not None:
+            tmp = f'{self.limits_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(limits, f, indent=2)
+            os.replace(tmp, self.limits_path)
+            self._limits_mtime = os.stat(self.limits_path).st_mtime_ns
+        return limits
+
+    # 传输登记
+
+    def start(self, client, direction):
+        """登记一个大块传输，超过单客户端并发上限时抛出 TooManyTransfers"""
+        if direction not in DIRECTIONS:
+            raise ValueError(f'未知的传输方向: {direction}')
+        self._maybe_reload()
+        with self._lock:
+            limit = self._limits['max_transfers_per_client']
+            if limit and self._per_client[client] >= limit:
+                self.rejected += 1
+                raise TooManyTransfers(client, limit)
+            self._per_client[client] += 1
+            self._active[direction][client] += 1
+            self.started[direction] += 1
+        return Transfer(self, client, direction)
+
+    def finish(self, transfer):
+        with self._lock:
+            active = self._active[transfer.direction]
+            active[transfer.client] -= 1
+            if active[transfer.client] <= 0:
+                del active[transfer.client]
+            self._per_client[transfer.client] -= 1
+            if self._per_client[transfer.client] <= 0:
+                del self._per_client[transfer.client]
+
+    def note_interactive(self):
+        """处理了一个交互式请求，接下来一小段时间内为交互式请求保留带宽"""
+        self._interactive_until = time.monotonic() + INTERACTIVE_WINDOW
+
+    # 速率分配
+
+    def is_shaped(self, direction):
+        self._maybe_reload()
+        limits = self._limits
+        return bool(limits[f'{direction}_rate'] or limits[f'client_{direction}_rate'])
+
+    def rate_for(self, transfer):
+        """传输当前应得的速率（字节/秒），不限速时返回 None"""
+        self._maybe_reload()
+        direction = transfer.direction
+        with self._lock:
+            total = self._limits[f'{direction}_rate']
+            per_client = self._limits[f'client_{direction}_rate']
+            if not total and not per_client:
+                return None
+            active = self._active[direction]
+            streams = max(active.get(transfer.client, 0), 1)
+            share = float('inf')
+            if total:
+                if time.monotonic() < self._interactive_until:
+                    total *= 1 - self._limits['interactive_reserve']
+                share = total / max(len(active), 1)
+            if per_client:
+                share = min(share, per_client)
+        return share / streams
+
+    def count_bytes(self, direction, nbytes):
+        self.bytes[direction] += nbytes
+
+    def count_delay(self, seconds):
+        self.delay_seconds += seconds
+
+    def stats(self):
+        limits = self.limits()
+        with self._lock:
+            return {
+                'limits': limits,
+                'active': {direction: sum(self._active[direction].values()) for direction in DIRECTIONS},
+                'active_clients': {direction: len(self._active[direction]) for direction in DIRECTIONS},
+                'started': dict(self.started),
+                'rejected': self.rejected,
+                'bytes': dict(self.bytes),
+                'throttled_seconds': self.delay_seconds,
+            }
@@ -0,0 +1,125 @@
+"""流式上传写入
+
+不经过 request.files：直接增量解析 multipart 请求体，
+每个文件部分边接收边写入目标目录下的临时文件（大块缓冲写），同时计算 SHA-256，
+按 fsync 策略落盘后用 os.replace 原子地改名为最终文件名。
+与 werkzeug 先落一份临时文件、file.save() 再复制一次相比，每个字节只写一次磁盘。
+"""
+import hashlib
+import os
+import tempfile
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+# 每次从请求体读取的字节数
+READ_SIZE = 1024 * 1024
+# 临时文件的写缓冲大小
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# fsync 策略：
+#   never   不主动落盘，交给操作系统（最快，断电可能丢失刚上传的文件）
+#   file    改名前对文件 fsync，保证改名后的文件内容完整
+#   always  再对目录 fsync，保证改名本身也已落盘
+FSYNC_POLICIES = ('never', 'file', 'always')
+
+
+class UploadedFile:
+    """一个写入完成的文件"""
+
+    __slots__ = ('original_filename', 'filename', 'path', 'size', 'sha256')
+
+    def __init__(self, original_filename, filename, path, size, sha256):
+        self.original_filename = original_filename
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+class _PartWriter:
+    def __init__(self, target_dir, original_filename, filename):
+        self.target_dir = target_dir
+        self.original_filename = original_filename
+        self.filename = filename
+        fd, self.tmp_path = tempfile.mkstemp(dir=target_dir, prefix='.upload-', suffix='.tmp')
+        self.file = open(fd, 'wb', buffering=WRITE_BUFFER_SIZE)
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self, fsync_policy):
+        self.file.flush()
+        if fsync_policy != 'never':
+            os.fsync(self.file.fileno())
+        self.file.close()
+        final_path = os.path.join(self.target_dir, self.filename)
+        os.replace(self.tmp_path, final_path)
+        if fsync_policy == 'always':
+            fsync_directory(self.target_dir)
+        return UploadedFile(self.original_filename, self.filename, final_path, self.size,
+                            self.digest.hexdigest())
+
+    def discard(self):
+        try:
+            self.file.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+def fsync_directory(directory):
+    """对目录 fsync，让其中的新建和改名落盘（Windows 不支持，直接跳过）"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def ingest_multipart(stream, boundary, target_dir, make_filename, field_name='file',
+                     fsync_policy='file', on_file=None):
+    """解析 multipart 请求体并把 field_name 字段的文件写入 target_dir
+
+    make_filename(original_filename) 返回最终文件名；文件名为空的部分会被跳过。
+    每写完一个文件调用一次 on_file(UploadedFile)，返回全部 UploadedFile 的列表。
+    请求体不完整或中途断开时删除未完成的临时文件并抛出异常，已完成的文件保留。
+    """
+    if fsync_policy not in FSYNC_POLICIES:
+        raise ValueError(f'未知的 fsync 策略: {fsync_policy}')
+
+    decoder = MultipartDecoder(boundary.encode('latin-1') if isinstance(boundary, str) else boundary)
+    results = []
+    writer = None
+    try:
+        while True:
+            chunk = stream.read(READ_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == field_name and event.filename:
+                    writer = _PartWriter(target_dir, event.filename, make_filename(event.filename))
+                elif isinstance(event, Data) and writer is not None:
+                    writer.write(event.data)
+                    if not event.more_data:
+                        uploaded = writer.commit(fsync_policy)
+                        writer = None
+                        results.append(uploaded)
+                        if on_file is not None:
+                            on_file(uploaded)
+                event = decoder.next_event()
+            if isinstance(event, Epilogue):
+                return results
+            if not chunk:
+                raise ValueError('请求体不完整')
+    finally:
+        if writer is not None:
+            writer.discard()
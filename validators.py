@@ -0,0 +1,108 @@
+"""缓存验证器与条件请求
+
+  - 文件的 ETag 由 inode、大小、修改时间（纳秒）拼成，只需一次 stat，不读内容
+  - 目录列表的 ETag 由目录及其条目的名称、大小、修改时间摘要得到，是弱标签
+  - If-None-Match / If-Modified-Since 命中时返回 304，If-Match / If-Unmodified-Since 不满足时返回 412
+  - Cache-Control 按相对路径的通配符规则选择
+"""
+import fnmatch
+import hashlib
+
+from flask import Response
+from werkzeug.http import http_date, parse_date
+
+
+def file_etag(st):
+    """根据 os.stat 结果生成文件的强 ETag"""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def listing_etag(dir_stat, entries):
+    """根据目录 stat 和条目 [(name, is_dir, size, mtime_ns), ...] 生成目录列表的弱 ETag"""
+    digest = hashlib.sha1(f'{dir_stat.st_ino}:{dir_stat.st_mtime_ns}'.encode())
+    for name, is_dir, size, mtime_ns, *_rest in entries:
+        digest.update(f'\0{name}\0{int(is_dir)}\0{size}\0{mtime_ns}'.encode('utf-8', 'surrogateescape'))
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def _strip_weak(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def _split_tags(header):
+    return [tag.strip() for tag in header.split(',') if tag.strip()]
+
+
+def none_match(if_none_match, etag):
+    """If-None-Match 使用弱比较，命中返回 True"""
+    if not if_none_match or etag is None:
+        return False
+    tags = _split_tags(if_none_match)
+    if '*' in tags:
+        return True
+    etag = _strip_weak(etag)
+    return any(_strip_weak(tag) == etag for tag in tags)
+
+
+def is_not_modified(headers, etag, last_modified):
+    """判断条件 GET 是否可以返回 304
+
+    按 RFC 7232，存在 If-None-Match 时忽略 If-Modified-Since。
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return none_match(if_none_match, etag)
+    since = parse_date(headers.get('If-Modified-Since'))
+    if since is None or last_modified is None:
+        return False
+    return int(last_modified) <= int(since.timestamp())
+
+
+def precondition_failed(headers, etag, last_modified):
+    """If-Match（强比较）或 If-Unmodified-Since 不满足时返回 True"""
+    if_match = headers.get('If-Match')
+    if if_match:
+        tags = _split_tags(if_match)
+        if '*' in tags:
+            return False
+        if etag is None or etag.startswith('W/'):
+            return True
+        return etag not in tags
+    since = parse_date(headers.get('If-Unmodified-Since'))
+    if since is None or last_modified is None:
+        return False
+    return int(last_modified) > int(since.timestamp())
+
+
+def cache_control_for(relative_path, rules, default):
+    """返回第一条匹配 relative_path 的规则的 Cache-Control 值
+
+    rules 为 [(通配符, Cache-Control), ...]，不含 '/' 的通配符只匹配文件名。
+    """
+    name = relative_path.rsplit('/', 1)[-1]
+    for pattern, value in rules:
+        target = relative_path if '/' in pattern else name
+        if fnmatch.fnmatch(target.lower(), pattern.lower()):
+            return value
+    return default
+
+
+def set_validators(response, etag, last_modified, cache_control=None):
+    """给响应加上 ETag、Last-Modified 和 Cache-Control"""
+    if etag is not None:
+        response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(int(last_modified))
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified_response(etag, last_modified, cache_control=None):
+    """构造 304 响应"""
+    return set_validators(Response(status=304), etag, last_modified, cache_control)
+
+
+def precondition_failed_response(etag, last_modified):
+    """构造 412 响应"""
+    return set_validators(Response('', 412), etag, last_modified)